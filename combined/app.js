@@ -0,0 +1,84 @@
+/*
+ * Combined Launcher
+ * Runs the users, costs, admin and logs services in one node process,
+ * for small hosts where four processes cost too much memory and connections.
+ * The services share one mongoose connection pool, one log shipper and one set of models.
+ *
+ * Install the dependencies only in the repository root (npm install there),
+ * not in the process folders - then every service loads the same shared modules
+ * (linked from shared/), express, mongoose and pino.
+ * The four separate processes keep working as before.
+ *
+ * Configuration (environment variables):
+ * - COMBINED_MODE - 'ports': every service on its own port, like the separate processes (default)
+ *                   'prefix': all services on PORT under /users, /costs, /admin and /logs
+ * - PORT          - the port in prefix mode (default 3000)
+ * - USERS_PORT, COSTS_PORT, ADMIN_PORT, LOGS_PORT - the ports in ports mode (default 3001-3004)
+ * - CLUSTER_WORKERS, SHUTDOWN_TIMEOUT_MS, MONGO_POOL_SIZE and LOG_* work like in every service
+ */
+
+const path = require('path');
+const express = require('express');
+
+const ROOT = path.join(__dirname, '..');
+
+const SERVICES = [
+    { name: 'Users Service', dir: 'process-1-users', prefix: '/users', portVar: 'USERS_PORT', port: 3001 },
+    { name: 'Costs Service', dir: 'process-2-costs', prefix: '/costs', portVar: 'COSTS_PORT', port: 3002 },
+    { name: 'Admin Service', dir: 'process-3-admin', prefix: '/admin', portVar: 'ADMIN_PORT', port: 3003 },
+    { name: 'Logs Service', dir: 'process-4-logs', prefix: '/logs', portVar: 'LOGS_PORT', port: 3004 }
+];
+
+const { connectDB, closeDB } = require('cost-manager-shared/db');
+const { runService, serveAll } = require('cost-manager-shared/cluster');
+
+/*
+ * listeners function
+ * One server per service in ports mode, or one server with all of them mounted in prefix mode
+ */
+const listeners = (services) => {
+    if (process.env.COMBINED_MODE === 'prefix') {
+        const app = express();
+        services.forEach(service => app.use(service.prefix, service.app));
+        const port = process.env.PORT || 3000;
+        return [{
+            app: app,
+            port: port,
+            onListening: () => console.log('Cost Manager running on port ' + port + ' (' +
+                services.map(service => service.prefix).join(', ') + ')')
+        }];
+    }
+
+    return services.map(service => {
+        const port = process.env[service.portVar] || service.port;
+        return {
+            app: service.app,
+            port: port,
+            onListening: () => console.log(service.name + ' running on port ' + port)
+        };
+    });
+};
+
+// with CLUSTER_WORKERS set every worker runs all four services
+runService('Cost Manager', () => {
+    // each app.js exports its app, and start/stop when it has work to do around serving
+    const services = SERVICES.map(service =>
+        Object.assign({}, service, require(path.join(ROOT, service.dir, 'src/app'))));
+
+    connectDB().then(async () => {
+        for (const service of services) {
+            if (service.start) {
+                await service.start();
+            }
+        }
+
+        serveAll(listeners(services), async () => {
+            for (const service of services) {
+                if (service.stop) {
+                    await service.stop();
+                }
+            }
+            await closeDB();
+        });
+    });
+});
@@ -0,0 +1,22 @@
+"""
+Cost Manager Python Client
+
+Pooled clients for the four Cost Manager services (users, costs, admin, logs):
+- CostManagerClient      - blocking client (httpx.Client)
+- AsyncCostManagerClient - asyncio client (httpx.AsyncClient)
+
+Every service gets its own keep-alive connection pool, so repeated calls
+reuse the same TCP/TLS connection instead of opening a new one each time.
+"""
+
+from .aio import AsyncCostManagerClient
+from .base import DEFAULT_URLS, LogGap, ServiceError
+from .client import CostManagerClient
+
+__all__ = [
+    "AsyncCostManagerClient",
+    "CostManagerClient",
+    "DEFAULT_URLS",
+    "LogGap",
+    "ServiceError",
+]
@@ -0,0 +1,266 @@
+"""asyncio client for the Cost Manager services"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Dict, Iterable, List, Optional, Union
+
+import httpx
+
+from . import base
+from .base import LogGap, ReportKey
+from .types import (BulkResult, Cost, CostHistory, LogEntry, RangeReport, Report, TeamMember,
+                    Trace, User, UserWithTotal)
+
+
+class AsyncCostManagerClient:
+    """
+    asyncio client with one keep-alive connection pool per service
+
+        async with AsyncCostManagerClient() as client:
+            reports = await client.get_reports([(123123, 2025, m) for m in range(1, 13)])
+    """
+
+    def __init__(self, users_url: Optional[str] = None, costs_url: Optional[str] = None,
+                 admin_url: Optional[str] = None, logs_url: Optional[str] = None,
+                 timeout: float = 30.0, max_connections: int = 20, retries: int = 2):
+        urls = base.service_urls(users_url, costs_url, admin_url, logs_url)
+        # retries only repeat requests that failed to connect, so they are always safe
+        self._clients = {
+            name: httpx.AsyncClient(base_url=url, timeout=timeout,
+                                    limits=base.pool_limits(max_connections),
+                                    transport=httpx.AsyncHTTPTransport(retries=retries))
+            for name, url in urls.items()
+        }
+        self._max_connections = max_connections
+
+    async def close(self) -> None:
+        await asyncio.gather(*(client.aclose() for client in self._clients.values()))
+
+    async def __aenter__(self) -> "AsyncCostManagerClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    # ---------- low level ----------
+
+    async def request(self, service: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """Sends any request to a service and returns the raw response (no error check)"""
+        return await self._clients[service].request(method, path, **base.with_request_id(kwargs))
+
+    async def _call(self, service: str, method: str, path: str, **kwargs) -> Any:
+        return base.parse(await self.request(service, method, path, **kwargs))
+
+    async def _pages(self, service: str, path: str, page_size: int,
+                     params: Dict) -> AsyncIterator[Dict]:
+        """Follows the X-Next-After header until the last page"""
+        after = None
+        while True:
+            response = await self.request(service, "GET", path,
+                                          params=base.page_params(after, page_size, params))
+            for doc in base.parse(response):
+                yield doc
+            after = response.headers.get("X-Next-After")
+            if not after:
+                return
+
+    async def _stream(self, service: str, path: str, params: Dict) -> AsyncIterator[Dict]:
+        """Reads an NDJSON response one document at a time"""
+        kwargs = base.with_request_id({"params": dict(params, format="ndjson")})
+        async with self._clients[service].stream("GET", path, **kwargs) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                raise base.error_from(response)
+            async for line in response.aiter_lines():
+                doc = base.parse_line(line)
+                if doc is not None:
+                    yield doc
+
+    async def _gather(self, calls: List[Awaitable], concurrency: Optional[int]) -> List:
+        """Runs the calls at the same time, at most concurrency at once, results in order"""
+        semaphore = asyncio.Semaphore(concurrency or self._max_connections)
+
+        async def limited(call):
+            async with semaphore:
+                return await call
+
+        return list(await asyncio.gather(*(limited(call) for call in calls)))
+
+    # ---------- admin service ----------
+
+    async def about(self) -> List[TeamMember]:
+        return await self._call("admin", "GET", "/api/about")
+
+    # ---------- users service ----------
+
+    async def list_users(self, after: Optional[int] = None,
+                         limit: Optional[int] = None) -> List[User]:
+        """All users, or one page of them when after or limit is given"""
+        return await self._call("users", "GET", "/api/users",
+                                params=base.page_params(after, limit))
+
+    def iter_users(self, page_size: int = 100) -> AsyncIterator[User]:
+        """All users, fetched page by page"""
+        return self._pages("users", "/api/users", page_size, {})
+
+    def stream_users(self) -> AsyncIterator[User]:
+        """All users, streamed in one response"""
+        return self._stream("users", "/api/users", {})
+
+    async def get_user(self, user_id: int) -> UserWithTotal:
+        return await self._call("users", "GET", f"/api/users/{user_id}")
+
+    async def add_user(self, id: int, first_name: str, last_name: str, birthday: str) -> User:
+        return await self._call("users", "POST", "/api/add",
+                                json=base.user_body(id, first_name, last_name, birthday))
+
+    async def get_users(self, user_ids: Iterable[int],
+                        concurrency: Optional[int] = None) -> List[UserWithTotal]:
+        """Fetches many users with their totals at the same time, in the given order"""
+        return await self._gather([self.get_user(user_id) for user_id in user_ids], concurrency)
+
+    # ---------- costs service ----------
+
+    async def add_cost(self, description: str, category: str, userid: int, sum: float,
+                       created_at: Optional[str] = None) -> Cost:
+        return await self._call("costs", "POST", "/api/add",
+                                json=base.cost_body(description, category, userid, sum, created_at))
+
+    async def add_costs(self, items: Union[List[Dict], AsyncIterable[Dict]]) -> BulkResult:
+        """
+        Adds many cost items in one request
+        A list is sent as a JSON array, an async iterable is streamed as NDJSON
+        """
+        if isinstance(items, list):
+            response = await self.request("costs", "POST", "/api/add/bulk", json=items)
+        else:
+            async def lines():
+                async for item in items:
+                    yield (json.dumps(item) + "\n").encode()
+
+            response = await self.request("costs", "POST", "/api/add/bulk", content=lines(),
+                                          headers={"Content-Type": "application/x-ndjson"})
+        # 207 means some items failed, they are listed in the results
+        if response.status_code == 207:
+            return response.json()
+        return base.parse(response)
+
+    async def list_costs(self, userid: int, after: Optional[str] = None,
+                         limit: Optional[int] = None, **filters) -> CostHistory:
+        """
+        One page of the costs of a user, oldest first (see base.history_params for the filters)
+        aggregate=True adds count/sum/min/max per category of all the matching costs
+        """
+        params = base.page_params(after, limit, base.history_params(userid, **filters))
+        return await self._call("costs", "GET", "/api/costs", params=params)
+
+    async def iter_costs(self, userid: int, page_size: int = 100,
+                         **filters) -> AsyncIterator[Cost]:
+        """All the costs of a user matching the filters, fetched page by page"""
+        after = None
+        while True:
+            response = await self.request("costs", "GET", "/api/costs", params=base.page_params(
+                after, page_size, base.history_params(userid, **filters)))
+            for cost in base.parse(response)["costs"]:
+                yield cost
+            after = response.headers.get("X-Next-After")
+            if not after:
+                return
+
+    async def get_report(self, userid: int, year: int, month: int) -> Report:
+        return await self._call("costs", "GET", "/api/report",
+                                params=base.report_params(userid, year, month))
+
+    async def get_range_report(self, userid: int, start: str, end: str,
+                               items: bool = True) -> RangeReport:
+        """Reports of every month from start to end ("YYYY-MM", both included) in one request"""
+        return await self._call("costs", "GET", "/api/report/range",
+                                params=base.range_params(userid, start, end, items))
+
+    async def get_reports(self, keys: Iterable[ReportKey],
+                          concurrency: Optional[int] = None) -> List[Report]:
+        """Fetches many (userid, year, month) reports at the same time, in the given order"""
+        return await self._gather([self.get_report(*key) for key in keys], concurrency)
+
+    async def report_cache_stats(self) -> Dict:
+        return await self._call("costs", "GET", "/api/report/cache")
+
+    # ---------- logs service ----------
+
+    async def list_logs(self, after: Optional[str] = None, limit: Optional[int] = None,
+                        **filters) -> List[LogEntry]:
+        """
+        Logs matching the filters (see base.log_filters),
+        all of them or one page when after or limit is given
+        """
+        params = base.page_params(after, limit, base.log_filters(**filters))
+        return await self._call("logs", "GET", "/api/logs", params=params)
+
+    def iter_logs(self, page_size: int = 100, **filters) -> AsyncIterator[LogEntry]:
+        """Logs matching the filters, fetched page by page"""
+        return self._pages("logs", "/api/logs", page_size, base.log_filters(**filters))
+
+    def stream_logs(self, **filters) -> AsyncIterator[LogEntry]:
+        """Logs matching the filters, streamed in one response"""
+        return self._stream("logs", "/api/logs", base.log_filters(**filters))
+
+    def tail_logs(self, last_event_id: Optional[str] = None, **filters) -> "AsyncLogTail":
+        """
+        New logs matching the filters, as the services write them (Server-Sent Events)
+        Never ends by itself: when the connection drops it reconnects with the id of
+        the last event, and the service first sends the logs that were missed.
+        The returned AsyncLogTail has that id as last_event_id, to continue later
+        """
+        return AsyncLogTail(self._clients["logs"], last_event_id, base.log_filters(**filters))
+
+    async def get_trace(self, request_id: str) -> Trace:
+        """Every request logged with this request id, with its timing spans"""
+        return await self._call("logs", "GET", f"/api/logs/trace/{request_id}")
+
+    # ---------- tracing ----------
+
+    # a plain context manager, tasks started inside the block inherit the id
+    trace = staticmethod(base.trace)
+
+
+class AsyncLogTail:
+    """
+    Async iterator over the logs of GET /api/logs/tail (see AsyncCostManagerClient.tail_logs)
+    last_event_id is the position after the last log it returned
+    Logs the service could not send come as one LogGap (see base.LogGap)
+    """
+
+    def __init__(self, client: httpx.AsyncClient, last_event_id: Optional[str], params: Dict):
+        self._parser = base.EventParser(last_event_id)
+        self._logs = self._read(client, params)
+
+    @property
+    def last_event_id(self) -> Optional[str]:
+        return self._parser.last_id
+
+    def __aiter__(self) -> "AsyncLogTail":
+        return self
+
+    async def __anext__(self) -> Union[LogEntry, LogGap]:
+        return await self._logs.__anext__()
+
+    async def aclose(self) -> None:
+        await self._logs.aclose()
+
+    async def _read(self, client: httpx.AsyncClient,
+                    params: Dict) -> AsyncIterator[Union[LogEntry, LogGap]]:
+        parser = self._parser
+        while True:
+            kwargs = base.with_request_id({"params": params, "headers": parser.headers()})
+            try:
+                async with client.stream("GET", "/api/logs/tail", **kwargs) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        raise base.error_from(response)
+                    async for line in response.aiter_lines():
+                        item = base.tail_item(parser.feed(line))
+                        if item is not None:
+                            yield item
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(parser.retry)
@@ -0,0 +1,235 @@
+"""
+Shared parts of the sync and async clients
+
+Request building and response handling live here, so both clients
+send exactly the same requests and raise the same errors.
+"""
+
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import httpx
+
+# Local services by default, override with the same variables as bench.py
+DEFAULT_URLS = {
+    "users": os.environ.get("USERS_URL", "http://localhost:3001"),
+    "costs": os.environ.get("COSTS_URL", "http://localhost:3002"),
+    "admin": os.environ.get("ADMIN_URL", "http://localhost:3003"),
+    "logs": os.environ.get("LOGS_URL", "http://localhost:3004"),
+}
+
+SERVICES = tuple(DEFAULT_URLS)
+
+# (userid, year, month) of one report
+ReportKey = Tuple[int, int, int]
+
+# request id sent as X-Request-Id inside a trace() block
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+class ServiceError(Exception):
+    """
+    An error response from a service, with the {id, message} body it returned
+    retry_after is the Retry-After of a 503 (service overloaded), in seconds
+    """
+
+    def __init__(self, status_code: int, id: Any, message: str, retry_after: Optional[int] = None):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.id = id
+        self.message = message
+        self.retry_after = retry_after
+
+
+class LogGap:
+    """
+    Yielded by a log tail in place of logs the service could not send, because the
+    client fell too far behind or its Last-Event-ID is not in the oplog anymore
+    after is the id of the last event before the gap, since the time of the first
+    missed log (None when not known). Read the missed logs from list_logs(since=...)
+    """
+
+    def __init__(self, after: Optional[str], since: Optional[str]):
+        self.after = after
+        self.since = since
+
+    def __repr__(self) -> str:
+        return f"LogGap(after={self.after!r}, since={self.since!r})"
+
+
+def service_urls(users_url=None, costs_url=None, admin_url=None, logs_url=None) -> Dict[str, str]:
+    """Base URL of every service, DEFAULT_URLS for the ones not given"""
+    given = {"users": users_url, "costs": costs_url, "admin": admin_url, "logs": logs_url}
+    return {name: given[name] or DEFAULT_URLS[name] for name in SERVICES}
+
+
+@contextmanager
+def trace(request_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Sends every request made inside the block with the same X-Request-Id,
+    so the services log them as one trace (see get_trace)
+    """
+    request_id = request_id or str(uuid.uuid4())
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
+
+
+def with_request_id(kwargs: Dict) -> Dict:
+    """Adds the X-Request-Id header of the current trace() block to the request arguments"""
+    request_id = _request_id.get()
+    if request_id is None:
+        return kwargs
+    headers = dict(kwargs.get("headers") or {})
+    headers.setdefault("X-Request-Id", request_id)
+    return dict(kwargs, headers=headers)
+
+
+def pool_limits(max_connections: int) -> httpx.Limits:
+    return httpx.Limits(max_connections=max_connections,
+                        max_keepalive_connections=max_connections)
+
+
+def error_from(response: httpx.Response) -> ServiceError:
+    """Builds a ServiceError from an error response (response body must be read)"""
+    retry_after = response.headers.get("Retry-After")
+    retry_after = int(retry_after) if retry_after and retry_after.isdigit() else None
+    try:
+        data = response.json()
+        return ServiceError(response.status_code, data.get("id"), data.get("message", ""),
+                            retry_after)
+    except (ValueError, AttributeError):
+        return ServiceError(response.status_code, 0, response.text, retry_after)
+
+
+def parse(response: httpx.Response) -> Any:
+    """Returns the JSON body, or raises ServiceError for an error status"""
+    if response.status_code >= 400:
+        raise error_from(response)
+    return response.json()
+
+
+def parse_line(line: str) -> Optional[Any]:
+    """Parses one NDJSON line, None for empty lines"""
+    line = line.strip()
+    return json.loads(line) if line else None
+
+
+class EventParser:
+    """
+    Reads a Server-Sent Events stream line by line (GET /api/logs/tail)
+    feed returns (event, data) when an empty line ends an event, else None
+    last_id is the id of the last event, sent back as Last-Event-ID on reconnect
+    """
+
+    def __init__(self, last_id: Optional[str] = None):
+        self.last_id = last_id
+        # seconds to wait before reconnecting, the server can change it
+        self.retry = 2.0
+        self._event = "message"
+        self._data: List[str] = []
+
+    def feed(self, line: str) -> Optional[Tuple[str, str]]:
+        if not line:
+            event, data = self._event, self._data
+            self._event, self._data = "message", []
+            return (event, "\n".join(data)) if data else None
+        # lines starting with ':' are comments (heartbeats)
+        if line.startswith(":"):
+            return None
+        name, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if name == "data":
+            self._data.append(value)
+        elif name == "event":
+            self._event = value
+        elif name == "id":
+            self.last_id = value
+        elif name == "retry" and value.isdigit():
+            self.retry = int(value) / 1000
+        return None
+
+    def headers(self) -> Dict[str, str]:
+        return {"Last-Event-ID": self.last_id} if self.last_id else {}
+
+
+def tail_item(event: Optional[Tuple[str, str]]) -> Optional[Any]:
+    """The log (or LogGap) of one tail event from EventParser.feed, None for other events"""
+    if not event:
+        return None
+    name, data = event
+    if name == "message":
+        return json.loads(data)
+    if name == "gap":
+        gap = json.loads(data)
+        return LogGap(gap.get("after"), gap.get("from"))
+    return None
+
+
+def page_params(after: Optional[Any], limit: Optional[int], extra: Optional[Dict] = None) -> Dict:
+    params = dict(extra or {})
+    if after is not None:
+        params["after"] = after
+    if limit is not None:
+        params["limit"] = limit
+    return params
+
+
+def user_body(id: int, first_name: str, last_name: str, birthday: str) -> Dict:
+    return {"id": id, "first_name": first_name, "last_name": last_name, "birthday": birthday}
+
+
+def cost_body(description: str, category: str, userid: int, sum: float,
+              created_at: Optional[str] = None) -> Dict:
+    body = {"description": description, "category": category, "userid": userid, "sum": sum}
+    if created_at is not None:
+        body["createdAt"] = created_at
+    return body
+
+
+def report_params(userid: int, year: int, month: int) -> Dict:
+    return {"id": userid, "year": year, "month": month}
+
+
+def range_params(userid: int, start: str, end: str, items: bool) -> Dict:
+    params = {"id": userid, "from": start, "to": end}
+    if not items:
+        params["items"] = "false"
+    return params
+
+
+def history_params(userid: int, since=None, until=None, category=None,
+                   aggregate: bool = False) -> Dict:
+    """
+    Query parameters of GET /api/costs, only the filters that were given
+    category is one category or a list of them
+    """
+    if isinstance(category, (list, tuple)):
+        category = ",".join(category)
+    params = {"id": userid, "from": since, "to": until, "category": category,
+              "aggregate": "true" if aggregate else None}
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def log_filters(since=None, until=None, service=None, message=None,
+                method=None, url=None, request_id=None, archive=False) -> Dict:
+    """
+    Query parameters of GET /api/logs, only the filters that were given
+    archive=True also searches the logs the service moved to its archive files
+    """
+    params = {"from": since, "to": until, "service": service,
+              "message": message, "method": method, "url": url, "request_id": request_id,
+              "archive": "true" if archive else None}
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def ndjson_lines(items: Iterable[Dict]) -> Iterable[bytes]:
+    """Encodes cost items as NDJSON lines for the bulk endpoint"""
+    for item in items:
+        yield (json.dumps(item) + "\n").encode()
@@ -0,0 +1,260 @@
+"""Blocking client for the Cost Manager services"""
+
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+import httpx
+
+from . import base
+from .base import LogGap, ReportKey
+from .types import (BulkResult, Cost, CostHistory, LogEntry, RangeReport, Report, TeamMember,
+                    Trace, User, UserWithTotal)
+
+
+class CostManagerClient:
+    """
+    Blocking client with one keep-alive connection pool per service
+
+    Use it as a context manager (or call close()) so the pools are closed:
+
+        with CostManagerClient() as client:
+            client.get_user(123123)
+    """
+
+    def __init__(self, users_url: Optional[str] = None, costs_url: Optional[str] = None,
+                 admin_url: Optional[str] = None, logs_url: Optional[str] = None,
+                 timeout: float = 30.0, max_connections: int = 20, retries: int = 2):
+        urls = base.service_urls(users_url, costs_url, admin_url, logs_url)
+        # retries only repeat requests that failed to connect, so they are always safe
+        self._clients = {
+            name: httpx.Client(base_url=url, timeout=timeout,
+                               limits=base.pool_limits(max_connections),
+                               transport=httpx.HTTPTransport(retries=retries))
+            for name, url in urls.items()
+        }
+        self._max_connections = max_connections
+
+    def close(self) -> None:
+        for client in self._clients.values():
+            client.close()
+
+    def __enter__(self) -> "CostManagerClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # ---------- low level ----------
+
+    def request(self, service: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """Sends any request to a service and returns the raw response (no error check)"""
+        return self._clients[service].request(method, path, **base.with_request_id(kwargs))
+
+    def _call(self, service: str, method: str, path: str, **kwargs) -> Any:
+        return base.parse(self.request(service, method, path, **kwargs))
+
+    def _map(self, fn: Callable[[Any], Any], items: List, max_workers: Optional[int]) -> List:
+        """
+        Calls fn for every item in a thread pool, results in the same order
+        Every call runs in a copy of our context, so the X-Request-Id of a
+        trace() block reaches the worker threads
+        """
+        workers = max_workers or min(self._max_connections, max(1, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+            return [future.result() for future in futures]
+
+    def _pages(self, service: str, path: str, page_size: int, params: Dict) -> Iterator[Dict]:
+        """Follows the X-Next-After header until the last page"""
+        after = None
+        while True:
+            response = self.request(service, "GET", path,
+                                    params=base.page_params(after, page_size, params))
+            yield from base.parse(response)
+            after = response.headers.get("X-Next-After")
+            if not after:
+                return
+
+    def _stream(self, service: str, path: str, params: Dict) -> Iterator[Dict]:
+        """Reads an NDJSON response one document at a time"""
+        kwargs = base.with_request_id({"params": dict(params, format="ndjson")})
+        with self._clients[service].stream("GET", path, **kwargs) as response:
+            if response.status_code >= 400:
+                response.read()
+                raise base.error_from(response)
+            for line in response.iter_lines():
+                doc = base.parse_line(line)
+                if doc is not None:
+                    yield doc
+
+    # ---------- admin service ----------
+
+    def about(self) -> List[TeamMember]:
+        return self._call("admin", "GET", "/api/about")
+
+    # ---------- users service ----------
+
+    def list_users(self, after: Optional[int] = None, limit: Optional[int] = None) -> List[User]:
+        """All users, or one page of them when after or limit is given"""
+        return self._call("users", "GET", "/api/users", params=base.page_params(after, limit))
+
+    def iter_users(self, page_size: int = 100) -> Iterator[User]:
+        """All users, fetched page by page"""
+        return self._pages("users", "/api/users", page_size, {})
+
+    def stream_users(self) -> Iterator[User]:
+        """All users, streamed in one response"""
+        return self._stream("users", "/api/users", {})
+
+    def get_user(self, user_id: int) -> UserWithTotal:
+        return self._call("users", "GET", f"/api/users/{user_id}")
+
+    def add_user(self, id: int, first_name: str, last_name: str, birthday: str) -> User:
+        return self._call("users", "POST", "/api/add",
+                          json=base.user_body(id, first_name, last_name, birthday))
+
+    # ---------- costs service ----------
+
+    def add_cost(self, description: str, category: str, userid: int, sum: float,
+                 created_at: Optional[str] = None) -> Cost:
+        return self._call("costs", "POST", "/api/add",
+                          json=base.cost_body(description, category, userid, sum, created_at))
+
+    def add_costs(self, items: Iterable[Dict]) -> BulkResult:
+        """
+        Adds many cost items in one request
+        A list is sent as a JSON array, any other iterable is streamed as NDJSON
+        """
+        if isinstance(items, list):
+            response = self.request("costs", "POST", "/api/add/bulk", json=items)
+        else:
+            response = self.request("costs", "POST", "/api/add/bulk",
+                                    content=base.ndjson_lines(items),
+                                    headers={"Content-Type": "application/x-ndjson"})
+        # 207 means some items failed, they are listed in the results
+        if response.status_code == 207:
+            return response.json()
+        return base.parse(response)
+
+    def list_costs(self, userid: int, after: Optional[str] = None, limit: Optional[int] = None,
+                   **filters) -> CostHistory:
+        """
+        One page of the costs of a user, oldest first (see base.history_params for the filters)
+        aggregate=True adds count/sum/min/max per category of all the matching costs
+        """
+        params = base.page_params(after, limit, base.history_params(userid, **filters))
+        return self._call("costs", "GET", "/api/costs", params=params)
+
+    def iter_costs(self, userid: int, page_size: int = 100, **filters) -> Iterator[Cost]:
+        """All the costs of a user matching the filters, fetched page by page"""
+        after = None
+        while True:
+            response = self.request("costs", "GET", "/api/costs", params=base.page_params(
+                after, page_size, base.history_params(userid, **filters)))
+            yield from base.parse(response)["costs"]
+            after = response.headers.get("X-Next-After")
+            if not after:
+                return
+
+    def get_report(self, userid: int, year: int, month: int) -> Report:
+        return self._call("costs", "GET", "/api/report",
+                          params=base.report_params(userid, year, month))
+
+    def get_range_report(self, userid: int, start: str, end: str,
+                         items: bool = True) -> RangeReport:
+        """Reports of every month from start to end ("YYYY-MM", both included) in one request"""
+        return self._call("costs", "GET", "/api/report/range",
+                          params=base.range_params(userid, start, end, items))
+
+    def get_reports(self, keys: Iterable[ReportKey],
+                    max_workers: Optional[int] = None) -> List[Report]:
+        """Fetches many (userid, year, month) reports at the same time, in the given order"""
+        return self._map(lambda key: self.get_report(*key), list(keys), max_workers)
+
+    def get_users(self, user_ids: Iterable[int],
+                  max_workers: Optional[int] = None) -> List[UserWithTotal]:
+        """Fetches many users with their totals at the same time, in the given order"""
+        return self._map(self.get_user, list(user_ids), max_workers)
+
+    def report_cache_stats(self) -> Dict:
+        return self._call("costs", "GET", "/api/report/cache")
+
+    # ---------- logs service ----------
+
+    def list_logs(self, after: Optional[str] = None, limit: Optional[int] = None,
+                  **filters) -> List[LogEntry]:
+        """
+        Logs matching the filters (see base.log_filters),
+        all of them or one page when after or limit is given
+        """
+        params = base.page_params(after, limit, base.log_filters(**filters))
+        return self._call("logs", "GET", "/api/logs", params=params)
+
+    def iter_logs(self, page_size: int = 100, **filters) -> Iterator[LogEntry]:
+        """Logs matching the filters, fetched page by page"""
+        return self._pages("logs", "/api/logs", page_size, base.log_filters(**filters))
+
+    def stream_logs(self, **filters) -> Iterator[LogEntry]:
+        """Logs matching the filters, streamed in one response"""
+        return self._stream("logs", "/api/logs", base.log_filters(**filters))
+
+    def tail_logs(self, last_event_id: Optional[str] = None, **filters) -> "LogTail":
+        """
+        New logs matching the filters, as the services write them (Server-Sent Events)
+        Never ends by itself: when the connection drops it reconnects with the id of
+        the last event, and the service first sends the logs that were missed.
+        The returned LogTail has that id as last_event_id, to continue later
+        """
+        return LogTail(self._clients["logs"], last_event_id, base.log_filters(**filters))
+
+    def get_trace(self, request_id: str) -> Trace:
+        """Every request logged with this request id, with its timing spans"""
+        return self._call("logs", "GET", f"/api/logs/trace/{request_id}")
+
+    # ---------- tracing ----------
+
+    trace = staticmethod(base.trace)
+
+
+class LogTail:
+    """
+    Iterator over the logs of GET /api/logs/tail (see CostManagerClient.tail_logs)
+    last_event_id is the position after the last log it returned
+    Logs the service could not send come as one LogGap (see base.LogGap)
+    """
+
+    def __init__(self, client: httpx.Client, last_event_id: Optional[str], params: Dict):
+        self._parser = base.EventParser(last_event_id)
+        self._logs = self._read(client, params)
+
+    @property
+    def last_event_id(self) -> Optional[str]:
+        return self._parser.last_id
+
+    def __iter__(self) -> "LogTail":
+        return self
+
+    def __next__(self) -> Union[LogEntry, LogGap]:
+        return next(self._logs)
+
+    def close(self) -> None:
+        self._logs.close()
+
+    def _read(self, client: httpx.Client, params: Dict) -> Iterator[Union[LogEntry, LogGap]]:
+        parser = self._parser
+        while True:
+            kwargs = base.with_request_id({"params": params, "headers": parser.headers()})
+            try:
+                with client.stream("GET", "/api/logs/tail", **kwargs) as response:
+                    if response.status_code >= 400:
+                        response.read()
+                        raise base.error_from(response)
+                    for line in response.iter_lines():
+                        item = base.tail_item(parser.feed(line))
+                        if item is not None:
+                            yield item
+            except httpx.TransportError:
+                pass
+            time.sleep(parser.retry)
@@ -0,0 +1,141 @@
+"""Response shapes of the Cost Manager services"""
+
+from typing import Dict, List, Optional, TypedDict
+
+
+class TeamMember(TypedDict):
+    first_name: str
+    last_name: str
+
+
+class User(TypedDict, total=False):
+    _id: str
+    id: int
+    first_name: str
+    last_name: str
+    birthday: str
+
+
+class UserWithTotal(TypedDict):
+    first_name: str
+    last_name: str
+    id: int
+    total: float
+
+
+class Cost(TypedDict, total=False):
+    _id: str
+    description: str
+    category: str
+    userid: int
+    sum: float
+    createdAt: str
+
+
+class CategoryStats(TypedDict):
+    count: int
+    sum: float
+    # None when the category has no costs
+    min: Optional[float]
+    max: Optional[float]
+
+
+class CostHistory(TypedDict, total=False):
+    userid: int
+    # _id, description, category, sum and createdAt of every cost
+    costs: List[Cost]
+    # only when the aggregate was requested, one entry per category
+    aggregate: Dict[str, CategoryStats]
+
+
+class ReportItem(TypedDict):
+    sum: float
+    description: str
+    day: int
+
+
+class Report(TypedDict):
+    userid: int
+    year: int
+    month: int
+    # one entry per category: [{"food": [...]}, {"health": [...]}, ...]
+    costs: List[Dict[str, List[ReportItem]]]
+
+
+class RangeMonth(TypedDict, total=False):
+    year: int
+    month: int
+    totals: Dict[str, float]
+    total: float
+    # only when the item lists were requested
+    costs: List[Dict[str, List[ReportItem]]]
+
+
+# "from" is a Python keyword, so this one uses the functional syntax
+# from and to are "YYYY-MM"
+RangeReport = TypedDict("RangeReport", {
+    "userid": int,
+    "from": str,
+    "to": str,
+    "months": List[RangeMonth],
+    "totals": Dict[str, float],
+    "total": float,
+})
+
+
+class BulkItemResult(TypedDict, total=False):
+    index: int
+    _id: str
+    id: int
+    message: str
+
+
+class BulkUpdateError(TypedDict):
+    update: str
+    message: str
+
+
+class BulkResult(TypedDict):
+    inserted: int
+    failed: int
+    results: List[BulkItemResult]
+    # totals or reports updates that failed after the costs were saved
+    updateErrors: List[BulkUpdateError]
+
+
+class Span(TypedDict):
+    type: str
+    name: str
+    start_ms: float
+    duration_ms: float
+
+
+class LogEntry(TypedDict, total=False):
+    _id: str
+    level: int
+    time: str
+    name: str
+    msg: str
+    method: str
+    url: str
+    request_id: str
+    # only on the line written when the request was done
+    status: int
+    duration_ms: float
+    spans: List[Span]
+
+
+class TracedRequest(TypedDict, total=False):
+    service: str
+    method: str
+    url: str
+    status: int
+    time: str
+    duration_ms: float
+    aborted: bool
+    spans: List[Span]
+
+
+class Trace(TypedDict):
+    request_id: str
+    requests: List[TracedRequest]
@@ -6,33 +6,96 @@
  */
 
 const express = require('express');
-const { connectDB, logger } = require('./db');
-const User = require('./models/user');
-const Cost = require('./models/cost');
+const { connectDB, closeDB, createLogger, logShipper } = require('cost-manager-shared/db');
+const { runService, serve } = require('cost-manager-shared/cluster');
+const { requestLogger } = require('cost-manager-shared/logger');
+const User = require('cost-manager-shared/models/user');
+const Total = require('cost-manager-shared/models/total');
+const { streamCursor } = require('cost-manager-shared/stream');
+const { compress } = require('cost-manager-shared/compress');
+const { httpMetrics, metricsHandler } = require('cost-manager-shared/metrics');
+const { serializeUser, serializeUsers, serializeUserWithTotal } = require('./serialize');
 
 // creating the express app
 const app = express();
 
+// the service name in the logs and the metrics
+const SERVICE_NAME = require('../package.json').name;
+const logger = createLogger(SERVICE_NAME);
+
+// strong ETags, so If-None-Match requests can be answered with 304
+app.set('etag', 'strong');
+
+// the total of a user changes when costs are added,
+// so clients can keep user details only for a few seconds before asking again
+const USER_CACHE_CONTROL = 'private, max-age=' + (process.env.USER_MAX_AGE || '5') + ', must-revalidate';
+
+// count and time every request, and serve them on GET /metrics (see metrics.js)
+// /metrics comes before the request logger so scrapes do not fill the logs
+app.use(httpMetrics(SERVICE_NAME));
+app.get('/metrics', metricsHandler);
+
+// compress responses with brotli or gzip (see compress.js)
+app.use(compress());
+
 // this middleware lets us read JSON from request body
 app.use(express.json());
 
 // middleware for logging - runs on every request that comes in
 // we need this for the pino logs requirement
-app.use((req, res, next) => {
-    logger.info({ method: req.method, url: req.url }, 'User Service Request');
-    next();
-});
+app.use(requestLogger(logger, logShipper, 'User Service Request'));
+
+// page size for GET /api/users when limit is not given, and the biggest allowed
+const DEFAULT_PAGE_SIZE = 100;
+const MAX_PAGE_SIZE = 1000;
 
 /*
  * GET /api/users
  * Returns all users from the database
- * No parameters needed
+ *
+ * Optional query parameters:
+ * - after, limit: keyset pagination - returns up to limit users with id > after,
+ *   ordered by id. If there may be more, the X-Next-After header has the
+ *   value to use as after for the next page
+ * - format=ndjson (or Accept: application/x-ndjson): one user per line
+ *   instead of a JSON array
+ *
+ * Without after/limit all users are streamed from a cursor,
+ * so we never hold the whole users list in memory
  */
 app.get('/api/users', async (req, res) => {
     try {
-        // find all users - empty object {} means no filter
-        const users = await User.find({});
-        res.json(users);
+        const format = req.query.format === 'ndjson' || req.get('Accept') === 'application/x-ndjson'
+            ? 'ndjson'
+            : 'json';
+
+        if (req.query.after !== undefined || req.query.limit !== undefined) {
+            const after = req.query.after !== undefined ? Number(req.query.after) : null;
+            const limit = req.query.limit !== undefined ? parseInt(req.query.limit) : DEFAULT_PAGE_SIZE;
+            if ((after !== null && isNaN(after)) || isNaN(limit) || limit < 1) {
+                return res.status(400).json({ id: 0, message: "Invalid pagination parameters" });
+            }
+            const pageSize = Math.min(limit, MAX_PAGE_SIZE);
+
+            // the unique index on id serves both the filter and the sort
+            const filter = after !== null ? { id: { $gt: after } } : {};
+            const users = await User.find(filter).sort({ id: 1 }).limit(pageSize).lean();
+
+            // a full page means there might be more users after it
+            if (users.length === pageSize) {
+                res.set('X-Next-After', String(users[users.length - 1].id));
+            }
+
+            if (format === 'ndjson') {
+                return res.type('application/x-ndjson')
+                    .send(users.map(u => serializeUser(u) + '\n').join(''));
+            }
+            return res.type('application/json').send(serializeUsers(users));
+        }
+
+        // no pagination - stream every user from a lean cursor
+        const cursor = User.find({}).sort({ id: 1 }).lean().cursor({ batchSize: 500 });
+        await streamCursor(cursor, res, format, serializeUser);
     } catch (error) {
         // if something goes wrong return error with id and message
         res.status(500).json({ id: 0, message: error.message });
@@ -50,28 +113,29 @@ app.get('/api/users/:id', async (req, res) => {
         const userId = parseInt(req.params.id);
         
         // look for user with this id
-        const user = await User.findOne({ id: userId });
+        // lean - we only read a few fields, no need for a full mongoose document
+        const user = await User.findOne({ id: userId }).lean();
         
         // if user doesnt exist return 404 error
         if (!user) {
             return res.status(404).json({ id: userId, message: "User not found" });
         }
 
-        // now we need to calculate total costs for this user
-        // first get all costs that belong to this user
-        const costs = await Cost.find({ userid: userId });
-        
-        // sum up all the costs using reduce
-        // starts from 0 and adds each cost.sum to it
-        const total = costs.reduce((sum, cost) => sum + cost.sum, 0);
+        // get the total costs of this user
+        // the costs service keeps a running total for every user,
+        // so we read one small document instead of all the costs
+        // if there is no total document the user has no costs yet
+        const userTotal = await Total.findOne({ userid: userId }).lean();
+        const total = userTotal ? userTotal.total : 0;
 
         // return the user info with total
-        res.json({
+        res.set('Cache-Control', USER_CACHE_CONTROL);
+        res.type('application/json').send(serializeUserWithTotal({
             first_name: user.first_name,
             last_name: user.last_name,
             id: user.id,
             total: total
-        });
+        }));
     } catch (error) {
         res.status(500).json({ id: req.params.id, message: error.message });
     }
@@ -98,7 +162,7 @@ app.post('/api/add', async (req, res) => {
         await newUser.save();
         
         // return 201 (created) status with the new user data
-        res.status(201).json(newUser);
+        res.status(201).type('application/json').send(serializeUser(newUser));
     } catch (error) {
         res.status(500).json({ id: req.body.id || 0, message: error.message });
     }
@@ -108,8 +172,16 @@ app.post('/api/add', async (req, res) => {
 const PORT = process.env.PORT || 3001;
 
 // first connect to database, then start the server
-connectDB().then(() => {
-    app.listen(PORT, () => {
-        console.log('Users Service running on port ' + PORT);
+// only when run directly - the combined launcher mounts the app itself
+// with CLUSTER_WORKERS set every worker runs this (see cluster.js)
+if (require.main === module) {
+    runService('Users Service', () => {
+        connectDB().then(() => {
+            serve(app, PORT, () => {
+                console.log('Users Service running on port ' + PORT);
+            }, closeDB);
+        });
     });
-});
+}
+
+module.exports = { app };
@@ -0,0 +1,29 @@
+/*
+ * Schema Serializers
+ * The response shapes of this service, compiled once with compile and
+ * compileArray (see serialize.js in the shared package)
+ */
+
+const { compile, compileArray } = require('cost-manager-shared/serialize');
+
+// a user as saved in the database (GET /api/users, POST /api/add)
+const serializeUser = compile({
+    _id: 'id',
+    id: 'number',
+    first_name: 'string',
+    last_name: 'string',
+    birthday: 'date',
+    __v: 'number'
+});
+
+const serializeUsers = compileArray(serializeUser);
+
+// a user with the total of his costs (GET /api/users/:id)
+const serializeUserWithTotal = compile({
+    first_name: 'string',
+    last_name: 'string',
+    id: 'number',
+    total: 'number'
+});
+
+module.exports = { serializeUser, serializeUsers, serializeUserWithTotal };
@@ -0,0 +1,187 @@
+/*
+ * Admission Control
+ * Report calculations and bulk uploads are expensive: they hold mongo pool
+ * connections and event loop time. A burst of them used to queue everything
+ * else behind them, even a cheap POST /api/add or a cached report.
+ *
+ * Every expensive route gets a Limiter: at most `concurrency` runs at a time,
+ * the rest wait in a queue of at most `queueSize` for at most `queueTimeoutMs`.
+ * A full queue or a wait that is too long fails fast with OverloadedError,
+ * the route answers 503 with Retry-After (see sendOverloaded).
+ * Only the calculation is limited - reports from the memory cache or the
+ * reports collection never wait (see reports.js).
+ *
+ * Configuration (environment variables), <ROUTE> is REPORT, RANGE, BULK or HISTORY:
+ * - <ROUTE>_CONCURRENCY      - runs at the same time
+ * - <ROUTE>_QUEUE_SIZE       - runs that can wait for a free slot
+ * - <ROUTE>_QUEUE_TIMEOUT_MS - the longest a run can wait
+ */
+
+const { registry } = require('cost-manager-shared/metrics');
+
+const WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10];
+
+/*
+ * OverloadedError class
+ * Thrown when a run is not admitted, retryAfter is in seconds
+ */
+class OverloadedError extends Error {
+    constructor(route, reason, retryAfter) {
+        super('Service overloaded, try again later');
+        this.route = route;
+        this.reason = reason;
+        this.retryAfter = retryAfter;
+    }
+}
+
+/*
+ * Limiter class
+ * A concurrency limit with a bounded wait queue, oldest waiting run first
+ */
+class Limiter {
+    constructor(route, concurrency, queueSize, queueTimeoutMs) {
+        this.route = route;
+        this.concurrency = concurrency;
+        this.queueSize = queueSize;
+        this.queueTimeoutMs = queueTimeoutMs;
+        this.active = 0;
+        // waiting runs: { queued, resolve, timer }
+        this.queue = [];
+        // moving average of a run in milliseconds, for Retry-After
+        this.averageMs = 0;
+        this.rejected = { full: 0, timeout: 0 };
+    }
+
+    /*
+     * retryAfter function
+     * Seconds until the queue we saw probably drained
+     */
+    retryAfter() {
+        const ms = this.averageMs * (this.queue.length + 1) / Math.max(this.concurrency, 1);
+        return Math.max(1, Math.ceil(ms / 1000));
+    }
+
+    reject(reason) {
+        this.rejected[reason]++;
+        return new OverloadedError(this.route, reason, this.retryAfter());
+    }
+
+    // waits for a free slot, the slot is ours when the promise resolves
+    acquire() {
+        if (this.active < this.concurrency) {
+            this.active++;
+            waitTime.observe([this.route], 0);
+            return Promise.resolve();
+        }
+        if (this.queue.length >= this.queueSize) {
+            return Promise.reject(this.reject('full'));
+        }
+        return new Promise((resolve, reject) => {
+            const waiting = { queued: process.hrtime.bigint(), resolve: resolve, timer: null };
+            waiting.timer = setTimeout(() => {
+                this.queue.splice(this.queue.indexOf(waiting), 1);
+                reject(this.reject('timeout'));
+            }, this.queueTimeoutMs);
+            this.queue.push(waiting);
+        });
+    }
+
+    // gives the slot to the oldest waiting run, or frees it
+    release() {
+        const next = this.queue.shift();
+        if (!next) {
+            this.active--;
+            return;
+        }
+        clearTimeout(next.timer);
+        waitTime.observe([this.route], Number(process.hrtime.bigint() - next.queued) / 1e9);
+        next.resolve();
+    }
+
+    /*
+     * run function
+     * Runs fn when a slot is free, rejects with OverloadedError if it is not admitted
+     */
+    async run(fn) {
+        await this.acquire();
+        const start = process.hrtime.bigint();
+        try {
+            return await fn();
+        } finally {
+            const ms = Number(process.hrtime.bigint() - start) / 1e6;
+            this.averageMs = this.averageMs === 0 ? ms : this.averageMs * 0.9 + ms * 0.1;
+            this.release();
+        }
+    }
+
+    stats() {
+        return {
+            concurrency: this.concurrency,
+            queueSize: this.queueSize,
+            queueTimeoutMs: this.queueTimeoutMs,
+            active: this.active,
+            queued: this.queue.length,
+            rejected: Object.assign({}, this.rejected)
+        };
+    }
+}
+
+const waitTime = registry.histogram('admission_queue_wait_seconds',
+    'Time a limited run waited for a free slot', ['route'], WAIT_BUCKETS);
+
+// every limiter by route, for the metrics
+const limiters = new Map();
+
+/*
+ * createLimiter function
+ * A limiter configured from <PREFIX>_CONCURRENCY, <PREFIX>_QUEUE_SIZE and <PREFIX>_QUEUE_TIMEOUT_MS
+ */
+const createLimiter = (route, prefix, defaults) => {
+    const env = (name, value) => parseInt(process.env[prefix + '_' + name] || String(value));
+    const limiter = new Limiter(route,
+        env('CONCURRENCY', defaults.concurrency),
+        env('QUEUE_SIZE', defaults.queueSize),
+        env('QUEUE_TIMEOUT_MS', defaults.queueTimeoutMs));
+    limiters.set(route, limiter);
+    return limiter;
+};
+
+// report calculations use a few pool connections, the rest stay free for everything else
+const reportLimiter = createLimiter('report', 'REPORT', { concurrency: 4, queueSize: 50, queueTimeoutMs: 2000 });
+const rangeLimiter = createLimiter('range', 'RANGE', { concurrency: 2, queueSize: 20, queueTimeoutMs: 2000 });
+const bulkLimiter = createLimiter('bulk', 'BULK', { concurrency: 2, queueSize: 4, queueTimeoutMs: 10000 });
+// the aggregate of GET /api/costs can read the whole history of a user
+const historyLimiter = createLimiter('history', 'HISTORY', { concurrency: 4, queueSize: 50, queueTimeoutMs: 2000 });
+
+const byRoute = (read) => (m) => limiters.forEach((limiter, route) => m.set([route], read(limiter)));
+registry.gauge('admission_concurrency_limit', 'Runs allowed at the same time', ['route'],
+    byRoute(l => l.concurrency));
+registry.gauge('admission_active', 'Runs going on right now', ['route'], byRoute(l => l.active));
+registry.gauge('admission_queue_limit', 'Runs allowed to wait for a slot', ['route'],
+    byRoute(l => l.queueSize));
+registry.gauge('admission_queued', 'Runs waiting for a slot right now', ['route'], byRoute(l => l.queue.length));
+registry.counter('admission_rejected_total', 'Runs answered with 503 by reason (full queue or wait timeout)',
+    ['route', 'reason'], m => limiters.forEach((limiter, route) => {
+        m.set([route, 'full'], limiter.rejected.full);
+        m.set([route, 'timeout'], limiter.rejected.timeout);
+    }));
+
+/*
+ * sendOverloaded function
+ * 503 with Retry-After and our { id, message } error body
+ */
+const sendOverloaded = (res, id, error) => {
+    res.set('Retry-After', String(error.retryAfter));
+    res.status(503).json({ id: id || 0, message: error.message });
+};
+
+module.exports = {
+    OverloadedError,
+    Limiter,
+    reportLimiter,
+    rangeLimiter,
+    bulkLimiter,
+    historyLimiter,
+    limiters,
+    sendOverloaded
+};
@@ -5,15 +5,61 @@
  */
 
 const express = require('express');
-const { connectDB, logger } = require('./db');
-const Cost = require('./models/cost');
+const { connectDB, closeDB, createLogger, logShipper } = require('cost-manager-shared/db');
+const { runService, serve } = require('cost-manager-shared/cluster');
+const { requestLogger } = require('cost-manager-shared/logger');
+const Cost = require('cost-manager-shared/models/cost');
 const Report = require('./models/report');
-const User = require('./models/user');
+const Total = require('cost-manager-shared/models/total');
+const { ingestArray, ingestStream } = require('./bulk');
+const { userCache } = require('./usercache');
+const {
+    CATEGORIES,
+    reportCache,
+    reportFlights,
+    reportStats,
+    isPastMonth,
+    loadReport,
+    listMonths,
+    loadRangeReports,
+    holdReports,
+    applyCosts,
+    watchReports,
+    unwatchReports
+} = require('./reports');
+const { SHORT_TTL, REVALIDATE, encode, sendEncoded } = require('cost-manager-shared/httpcache');
+const { compress } = require('cost-manager-shared/compress');
+const { registry, httpMetrics, metricsHandler } = require('cost-manager-shared/metrics');
+const { OverloadedError, bulkLimiter, limiters, sendOverloaded } = require('./admission');
+const { serializeCost, serializeReport, serializeHistory } = require('./serialize');
+const { parseHistoryQuery, loadHistory } = require('./history');
 
 const app = express();
 
+// the service name in the logs and the metrics
+const SERVICE_NAME = require('../package.json').name;
+const logger = createLogger(SERVICE_NAME);
+
+// strong ETags, so If-None-Match requests can be answered with 304
+app.set('etag', 'strong');
+
+// count and time every request, and serve them on GET /metrics (see metrics.js)
+// /metrics comes before the request logger so scrapes do not fill the logs
+app.use(httpMetrics(SERVICE_NAME));
+app.get('/metrics', metricsHandler);
+
+// compress responses with brotli or gzip (see compress.js)
+app.use(compress());
+
 // middleware to parse JSON in request body
-app.use(express.json());
+// the bulk route has its own parser with a bigger size limit
+const jsonParser = express.json();
+app.use((req, res, next) => {
+    if (req.path === '/api/add/bulk') {
+        return next();
+    }
+    jsonParser(req, res, next);
+});
 
 /*
  * Middleware to handle trailing slash in URLs
@@ -24,16 +70,14 @@ app.use((req, res, next) => {
     if (req.path.endsWith('/') && req.path.length > 1) {
         const newPath = req.path.slice(0, -1);
         const query = req.url.includes('?') ? req.url.substring(req.url.indexOf('?')) : '';
-        return res.redirect(307, newPath + query);
+        // baseUrl keeps the path prefix when mounted by the combined launcher
+        return res.redirect(307, req.baseUrl + newPath + query);
     }
     next();
 });
 
 // logging middleware - logs every request to MongoDB
-app.use((req, res, next) => {
-    logger.info({ method: req.method, url: req.url }, 'Costs Service Request');
-    next();
-});
+app.use(requestLogger(logger, logShipper, 'Costs Service Request'));
 
 /*
  * POST /api/add
@@ -45,9 +89,10 @@ app.post('/api/add', async (req, res) => {
     try {
         const { description, category, userid, sum, createdAt } = req.body;
         
-        // first check if the user exists in database
+        // first check if the user exists
         // we cant add cost for user that doesnt exist
-        const userExists = await User.findOne({ id: userid });
+        // known users are answered from memory, others are checked in the database
+        const userExists = await userCache.exists(userid);
         if (!userExists) {
             throw new Error("User not found");
         }
@@ -61,16 +106,110 @@ app.post('/api/add', async (req, res) => {
             createdAt: createdAt || new Date()  // use provided date or current date
         });
         
+        // a report of a past month is not saved while its cost is being added
+        const held = await holdReports([newCost]);
+
         // save to database
-        await newCost.save();
+        try {
+            await newCost.save();
+        } catch (error) {
+            await applyCosts([], held);
+            throw error;
+        }
+
+        // add the sum to the running total of the user
+        // $inc is atomic so two costs added at the same time both count
+        // upsert creates the total document for the first cost of the user
+        // right after the save, see scripts/totals.js
+        try {
+            await Total.updateOne(
+                { userid: newCost.userid },
+                { $inc: { total: newCost.sum } },
+                { upsert: true }
+            );
+        } finally {
+            // a cost in a past month goes into the saved report of that month
+            await applyCosts([newCost], held);
+        }
         
         // return 201 created status with the new cost
-        res.status(201).json(newCost);
+        res.status(201).type('application/json').send(serializeCost(newCost));
     } catch (error) {
         res.status(500).json({ id: req.body.userid || 0, message: error.message });
     }
 });
 
+/*
+ * POST /api/add/bulk
+ * Adds many cost items in one request
+ * The body is a JSON array of cost items (Content-Type: application/json),
+ * or one cost item per line (Content-Type: application/x-ndjson)
+ *
+ * Returns one result per item in the same order:
+ * { index, _id } for saved items, { index, id, message } for failed items
+ * Status is 201 if every item was saved, 207 if some of them failed
+ * updateErrors lists running totals or report updates that failed after
+ * the costs were saved ([{ update, message }]), the costs stay saved
+ */
+app.post('/api/add/bulk',
+    express.json({ limit: process.env.BULK_BODY_LIMIT || '50mb' }),
+    async (req, res) => {
+        try {
+            if (!req.is('application/x-ndjson') && !Array.isArray(req.body)) {
+                return res.status(400).json({ id: 0, message: "Body must be an array or NDJSON" });
+            }
+            // only a few uploads run at the same time (see admission.js)
+            const ingest = await bulkLimiter.run(() => req.is('application/x-ndjson')
+                ? ingestStream(req)
+                : ingestArray(req.body));
+
+            res.status(ingest.failed === 0 ? 201 : 207).json({
+                inserted: ingest.inserted,
+                failed: ingest.failed,
+                results: ingest.results,
+                updateErrors: ingest.updateErrors
+            });
+        } catch (error) {
+            if (error instanceof OverloadedError) {
+                return sendOverloaded(res, 0, error);
+            }
+            res.status(500).json({ id: 0, message: error.message });
+        }
+    }
+);
+
+/*
+ * GET /api/costs
+ * Returns the costs of one user, oldest first, one page at a time (see history.js)
+ * Query parameters: id (userid)
+ * Optional:
+ * - from, to: createdAt range (epoch ms or date string), from is included, to is not
+ * - category: one category or a comma separated list
+ * - after, limit: keyset pagination on (createdAt, _id), X-Next-After header has the next after
+ * - aggregate=true: count, sum, min and max per category of all the matching costs
+ *
+ * Returns { userid, costs: [{ _id, description, category, sum, createdAt }], aggregate }
+ */
+app.get('/api/costs', async (req, res) => {
+    try {
+        const parsed = parseHistoryQuery(req.query);
+        const history = await loadHistory(parsed);
+        if (history.next) {
+            res.set('X-Next-After', history.next);
+        }
+        res.type('application/json').send(serializeHistory({
+            userid: parsed.userid,
+            costs: history.costs,
+            aggregate: history.aggregate
+        }));
+    } catch (error) {
+        if (error instanceof OverloadedError) {
+            return sendOverloaded(res, req.query.id, error);
+        }
+        res.status(error.status || 500).json({ id: req.query.id || 0, message: error.message });
+    }
+});
+
 /*
  * GET /api/report
  * Returns monthly cost report for a specific user
@@ -78,7 +217,11 @@ app.post('/api/add', async (req, res) => {
  * 
  * This endpoint implements the Computed Design Pattern:
  * If the report is for a past month, we save it to database
- * so next time we dont need to calculate it again
+ * so next time we dont need to calculate it again (see reports.js)
+ *
+ * Responses have a strong ETag, If-None-Match with the same ETag gets 304.
+ * Past months can be kept by clients for a few minutes, they only change
+ * when a cost is added with a past createdAt.
  */
 app.get('/api/report', async (req, res) => {
     const { id, year, month } = req.query;
@@ -89,92 +232,204 @@ app.get('/api/report', async (req, res) => {
     }
     
     try {
-        /*
-         * Computed Design Pattern Implementation:
-         * First check if we already have this report saved in database
-         * If yes, just return it (no need to calculate again)
-         */
-        const existingReport = await Report.findOne({ 
-            userid: parseInt(id), 
-            year: parseInt(year), 
-            month: parseInt(month) 
-        });
-        
-        if (existingReport) {
-            // report already exists, return it directly
-            return res.json(existingReport.data);
+        const reportYear = parseInt(year);
+        const reportMonth = parseInt(month);
+        const report = await loadReport(parseInt(id), reportYear, reportMonth);
+
+        // serialize once - cached reports keep their body and ETag for next time
+        if (!report.encoded) {
+            report.encoded = encode(report.data, serializeReport);
         }
-        
-        // report doesnt exist, need to calculate it
-        // find all costs for this user in the specified month and year
-        const costs = await Cost.find({
-            userid: parseInt(id),
-            // using $expr to extract year and month from createdAt date
-            $expr: {
-                $and: [
-                    { $eq: [{ $year: "$createdAt" }, parseInt(year)] },
-                    { $eq: [{ $month: "$createdAt" }, parseInt(month)] }
-                ]
+        // a past month report rarely changes, the current month can change any time
+        const cacheControl = isPastMonth(reportYear, reportMonth) ? SHORT_TTL : REVALIDATE;
+        sendEncoded(res, report.encoded, cacheControl);
+    } catch (error) {
+        if (error instanceof OverloadedError) {
+            return sendOverloaded(res, id, error);
+        }
+        res.status(500).json({ id: id || 0, message: error.message });
+    }
+});
+
+// the most months one range report can have (10 years)
+const MAX_RANGE_MONTHS = 120;
+
+/*
+ * parseYearMonth function
+ * Parses 'YYYY-MM' into { year, month }, or returns null if it is not valid
+ */
+const parseYearMonth = (value) => {
+    const match = /^(\d{4})-(\d{1,2})$/.exec(value || '');
+    if (!match || parseInt(match[2]) < 1 || parseInt(match[2]) > 12) {
+        return null;
+    }
+    return { year: parseInt(match[1]), month: parseInt(match[2]) };
+};
+
+/*
+ * GET /api/report/range
+ * Returns the reports of many months for a specific user in one request
+ * Query parameters: id (userid), from and to (YYYY-MM, both included)
+ * Optional: items=false to get only the totals without the item lists
+ *
+ * Past months come from the saved monthly reports,
+ * only the current month is calculated live every time
+ */
+app.get('/api/report/range', async (req, res) => {
+    const { id } = req.query;
+    const from = parseYearMonth(req.query.from);
+    const to = parseYearMonth(req.query.to);
+
+    if (!id || !from || !to) {
+        return res.status(400).json({ id: id || 0, message: "Missing or invalid parameters" });
+    }
+
+    const months = listMonths(from.year, from.month, to.year, to.month);
+    if (months.length === 0 || months.length > MAX_RANGE_MONTHS) {
+        return res.status(400).json({ id: id, message: "Range must have 1 to " + MAX_RANGE_MONTHS + " months" });
+    }
+
+    try {
+        const userid = parseInt(id);
+        const withItems = req.query.items !== 'false';
+        const reports = await loadRangeReports(userid, months, withItems);
+
+        // totals of the whole range, per category and all together
+        const totals = {};
+        CATEGORIES.forEach(cat => {
+            totals[cat] = 0;
+        });
+
+        const monthsData = reports.map((report, i) => {
+            const monthData = {
+                year: months[i].year,
+                month: months[i].month,
+                totals: report.totals,
+                total: CATEGORIES.reduce((sum, cat) => sum + report.totals[cat], 0)
+            };
+            CATEGORIES.forEach(cat => {
+                totals[cat] += report.totals[cat];
+            });
+            if (withItems) {
+                monthData.costs = report.data.costs;
             }
+            return monthData;
         });
-        
-        // all the categories we need to include in report
-        const categories = ['food', 'health', 'housing', 'sport', 'education'];
-        
-        // build the report data structure
-        const reportData = { 
-            userid: parseInt(id), 
-            year: parseInt(year), 
-            month: parseInt(month), 
-            costs: [] 
-        };
-        
-        // for each category, filter the costs and format them
-        categories.forEach(cat => {
-            const catCosts = costs
-                .filter(c => c.category === cat)
-                .map(c => ({
-                    sum: c.sum,
-                    description: c.description,
-                    day: c.createdAt.getDate()  // get just the day number
-                }));
-            // add to costs array as object with category name as key
-            reportData.costs.push({ [cat]: catCosts });
+
+        res.json({
+            userid: userid,
+            from: req.query.from,
+            to: req.query.to,
+            months: monthsData,
+            totals: totals,
+            total: CATEGORIES.reduce((sum, cat) => sum + totals[cat], 0)
         });
-        
-        /*
-         * Computed Design Pattern - Saving:
-         * If this is a past month, save the report for future requests
-         * We dont save current or future months because they might change
-         */
-        const currentYear = new Date().getFullYear();
-        const currentMonth = new Date().getMonth() + 1;  // getMonth returns 0-11
-        
-        if (parseInt(year) < currentYear || 
-            (parseInt(year) === currentYear && parseInt(month) < currentMonth)) {
-            // this is a past month, save the report
-            const newReport = new Report({
-                userid: parseInt(id),
-                year: parseInt(year),
-                month: parseInt(month),
-                data: reportData
-            });
-            await newReport.save();
-            console.log('Computed report saved for user ' + id + ', ' + year + '-' + month);
-        }
-        
-        res.json(reportData);
     } catch (error) {
-        res.status(500).json({ id: id || 0, message: error.message });
+        if (error instanceof OverloadedError) {
+            return sendOverloaded(res, id, error);
+        }
+        res.status(500).json({ id: id, message: error.message });
     }
 });
 
+/*
+ * GET /api/report/cache
+ * Returns the report cache counters and the admission limiters
+ * We use them to decide how big the cache and the limits should be
+ */
+app.get('/api/report/cache', (req, res) => {
+    const admission = {};
+    limiters.forEach((limiter, route) => {
+        admission[route] = limiter.stats();
+    });
+    res.json({
+        admission: admission,
+        cache: reportCache.stats(),
+        singleFlight: reportFlights.stats(),
+        stored: reportStats.stored,
+        computed: reportStats.computed,
+        updated: reportStats.updated
+    });
+});
+
+// the same counters and the user cache on /metrics
+registry.counter('report_cache_lookups_total', 'Report cache lookups by result', ['result'], m => {
+    const stats = reportCache.stats();
+    m.set(['hit'], stats.hits);
+    m.set(['miss'], stats.misses);
+});
+registry.counter('report_cache_evictions_total', 'Reports removed from the full cache', [],
+    m => m.set([], reportCache.stats().evictions));
+registry.gauge('report_cache_entries', 'Reports in the cache', [], m => m.set([], reportCache.stats().size));
+registry.counter('reports_total', 'Reports read from the reports collection or computed', ['source'], m => {
+    m.set(['stored'], reportStats.stored);
+    m.set(['computed'], reportStats.computed);
+});
+registry.counter('report_updates_total', 'Saved reports that got costs added with a past createdAt', [],
+    m => m.set([], reportStats.updated));
+registry.counter('report_coalesced_total', 'Report requests that joined a computation already running', [],
+    m => m.set([], reportFlights.stats().coalesced));
+registry.counter('user_cache_lookups_total', 'User id cache lookups by result', ['result'], m => {
+    const stats = userCache.stats();
+    m.set(['hit'], stats.hits);
+    m.set(['miss'], stats.misses);
+});
+registry.gauge('user_cache_entries', 'User ids in the cache', [], m => m.set([], userCache.stats().size));
+
 // get port from environment or use default
 const PORT = process.env.PORT || 3002;
 
+/*
+ * start function
+ * Runs once the database is connected, before serving
+ */
+const start = async () => {
+    // build the indexes before serving so the first reports are fast too
+    try {
+        await Cost.createIndexes();
+        await Total.createIndexes();
+        await Report.createIndexes();
+    } catch (err) {
+        console.error('Index build error:', err);
+    }
+
+    // load the known user ids and keep them up to date
+    try {
+        await userCache.warm();
+        userCache.watch();
+    } catch (err) {
+        console.error('User cache error:', err);
+    }
+
+    // drop cached reports when another worker updates them
+    watchReports();
+};
+
+/*
+ * stop function
+ * Runs on shutdown, before the database is closed
+ */
+const stop = async () => {
+    await userCache.unwatch();
+    await unwatchReports();
+};
+
 // connect to database then start server
-connectDB().then(() => {
-    app.listen(PORT, () => {
-        console.log('Costs Service running on port ' + PORT);
+// only when run directly - the combined launcher mounts the app itself
+// with CLUSTER_WORKERS set every worker runs this (see cluster.js)
+// each worker has its own report and user caches
+if (require.main === module) {
+    runService('Costs Service', () => {
+        connectDB().then(async () => {
+            await start();
+            serve(app, PORT, () => {
+                console.log('Costs Service running on port ' + PORT);
+            }, async () => {
+                await stop();
+                await closeDB();
+            });
+        });
     });
-});
+}
+
+module.exports = { app, start, stop };
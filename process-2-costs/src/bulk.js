@@ -0,0 +1,253 @@
+/*
+ * Bulk Cost Ingestion
+ * Used by POST /api/add/bulk to add many cost items in one request
+ *
+ * Items are handled in chunks of BULK_CHUNK_SIZE:
+ * 1. the user ids we did not check yet are checked with one $in query
+ * 2. every item is validated with the Cost schema
+ * 3. the valid items are saved with one unordered insertMany
+ * 4. the running totals of the users are updated with one bulkWrite
+ * 5. costs in past months are added to their saved reports with one bulkWrite
+ *
+ * Once step 3 saved a cost its result stays "saved": if step 4 or 5 fails the
+ * error is reported in updateErrors, not as a failed request, so a client does
+ * not retry and add the costs twice. npm run totals:check -- --fix and
+ * reports:check -- --fix repair what was missed.
+ */
+
+const Cost = require('cost-manager-shared/models/cost');
+const User = require('cost-manager-shared/models/user');
+const Total = require('cost-manager-shared/models/total');
+const { userCache } = require('./usercache');
+const { holdReports, applyCosts } = require('./reports');
+
+const BULK_CHUNK_SIZE = parseInt(process.env.BULK_CHUNK_SIZE || '1000');
+
+/*
+ * readLines function
+ * Reads a stream (like the request body) and yields one line at a time
+ * We wait for every line to be handled before reading more,
+ * so a big upload is never held in memory as a whole
+ */
+async function* readLines(stream) {
+    let rest = '';
+    stream.setEncoding('utf8');
+    for await (const chunk of stream) {
+        const lines = (rest + chunk).split('\n');
+        // the last part might be a line that is not complete yet
+        rest = lines.pop();
+        for (const line of lines) {
+            yield line;
+        }
+    }
+    if (rest) {
+        yield rest;
+    }
+}
+
+/*
+ * BulkIngest class
+ * Keeps the results and the user ids we already checked between chunks
+ */
+class BulkIngest {
+    constructor() {
+        // one result per item, in the same order as the items
+        this.results = [];
+        this.inserted = 0;
+        this.failed = 0;
+        // totals and reports updates that failed after costs were saved: [{ update, message }]
+        this.updateErrors = [];
+        // user ids we already looked up - true if the user exists
+        this.checkedUsers = new Map();
+        // the chunk that is waiting to be saved: [{ index, item }]
+        this.chunk = [];
+    }
+
+    /*
+     * checkUsers function
+     * Looks up all the user ids we did not check yet with a single $in query
+     */
+    async checkUsers(userids) {
+        const unchecked = [];
+        new Set(userids).forEach(id => {
+            if (!Number.isFinite(id) || this.checkedUsers.has(id)) {
+                return;
+            }
+            // users we know from the cache dont need a query
+            if (userCache.has(id)) {
+                this.checkedUsers.set(id, true);
+            } else {
+                unchecked.push(id);
+            }
+        });
+        if (unchecked.length === 0) {
+            return;
+        }
+        const found = await User.find({ id: { $in: unchecked } }, { id: 1, _id: 0 }).lean();
+        unchecked.forEach(id => this.checkedUsers.set(id, false));
+        found.forEach(u => {
+            this.checkedUsers.set(u.id, true);
+            userCache.add(u.id);
+        });
+    }
+
+    fail(index, id, message) {
+        this.results[index] = { index: index, id: id || 0, message: message };
+        this.failed++;
+    }
+
+    /*
+     * add function
+     * Adds one item, the chunk is saved when it is full
+     * parseError is set when an NDJSON line was not valid JSON
+     */
+    async add(index, item, parseError) {
+        if (parseError) {
+            this.fail(index, 0, parseError);
+        } else {
+            this.chunk.push({ index: index, item: item });
+        }
+        if (this.chunk.length >= BULK_CHUNK_SIZE) {
+            await this.flush();
+        }
+    }
+
+    /*
+     * flush function
+     * Saves the waiting chunk
+     */
+    async flush() {
+        const chunk = this.chunk;
+        this.chunk = [];
+        if (chunk.length === 0) {
+            return;
+        }
+
+        await this.checkUsers(chunk.map(c => c.item && Number(c.item.userid)));
+
+        // validate every item, only the valid ones go to insertMany
+        const valid = [];
+        chunk.forEach(({ index, item }) => {
+            if (!item || typeof item !== 'object') {
+                return this.fail(index, 0, "Invalid cost item");
+            }
+            const { description, category, userid, sum, createdAt } = item;
+            if (!this.checkedUsers.get(Number(userid))) {
+                return this.fail(index, userid, "User not found");
+            }
+            const cost = new Cost({
+                description,
+                category,
+                userid,
+                sum,
+                createdAt: createdAt || new Date()  // use provided date or current date
+            });
+            const error = cost.validateSync();
+            if (error) {
+                return this.fail(index, userid, error.message);
+            }
+            valid.push({ index: index, cost: cost });
+        });
+
+        if (valid.length === 0) {
+            return;
+        }
+
+        // ordered: false - one bad item does not stop the others
+        const failedPositions = new Map();
+        let held = new Map();
+        try {
+            // reports of past months are not saved while their costs are being added
+            held = await holdReports(valid.map(v => v.cost));
+            await Cost.insertMany(valid.map(v => v.cost), { ordered: false });
+        } catch (err) {
+            if (!err.writeErrors) {
+                // the whole chunk failed (like a lost connection)
+                valid.forEach(v => this.fail(v.index, v.cost.userid, err.message));
+                await this.afterInsert('reports', () => applyCosts([], held));
+                return;
+            }
+            err.writeErrors.forEach(w => failedPositions.set(w.index, w.errmsg || w.message));
+        }
+
+        // per user sum of the costs that were saved, for the running totals
+        const sums = new Map();
+        const saved = [];
+        valid.forEach((v, position) => {
+            if (failedPositions.has(position)) {
+                return this.fail(v.index, v.cost.userid, failedPositions.get(position));
+            }
+            this.results[v.index] = { index: v.index, _id: v.cost._id };
+            this.inserted++;
+            saved.push(v.cost);
+            sums.set(v.cost.userid, (sums.get(v.cost.userid) || 0) + v.cost.sum);
+        });
+
+        if (sums.size > 0) {
+            await this.afterInsert('totals', () => Total.bulkWrite([...sums].map(([userid, sum]) => ({
+                updateOne: {
+                    filter: { userid: userid },
+                    update: { $inc: { total: sum } },
+                    upsert: true
+                }
+            })), { ordered: false }));
+        }
+        await this.afterInsert('reports', () => applyCosts(saved, held));
+    }
+
+    /*
+     * afterInsert function
+     * Runs an update of saved costs, a failure is kept in updateErrors
+     * instead of failing the costs that are already saved
+     */
+    async afterInsert(update, fn) {
+        try {
+            await fn();
+        } catch (err) {
+            console.error('Bulk ' + update + ' update error (run ' + update + ':check --fix):', err.message);
+            this.updateErrors.push({ update: update, message: err.message });
+        }
+    }
+}
+
+/*
+ * ingestArray function
+ * Adds the items of a JSON array
+ * All the user ids of the array are checked with one $in query up front
+ */
+const ingestArray = async (items) => {
+    const ingest = new BulkIngest();
+    await ingest.checkUsers(items.map(item => item && Number(item.userid)));
+    for (let i = 0; i < items.length; i++) {
+        await ingest.add(i, items[i]);
+    }
+    await ingest.flush();
+    return ingest;
+};
+
+/*
+ * ingestStream function
+ * Adds the items of an NDJSON stream, one cost item per line
+ */
+const ingestStream = async (stream) => {
+    const ingest = new BulkIngest();
+    let index = 0;
+    for await (const line of readLines(stream)) {
+        if (!line.trim()) {
+            continue;
+        }
+        let item = null;
+        let parseError = null;
+        try {
+            item = JSON.parse(line);
+        } catch (err) {
+            parseError = "Invalid JSON: " + err.message;
+        }
+        await ingest.add(index, item, parseError);
+        index++;
+    }
+    await ingest.flush();
+    return ingest;
+};
+
+module.exports = { ingestArray, ingestStream };
@@ -0,0 +1,107 @@
+/*
+ * In-Process Cache Helpers
+ * LRUCache - small memory cache with a size limit and a time limit (TTL)
+ * SingleFlight - makes sure only one computation runs for the same key at a time
+ *
+ * We use these in front of the reports collection,
+ * so the hottest reports dont need a round trip to mongo at all
+ */
+
+/*
+ * LRUCache class
+ * A Map remembers insertion order, so the first key is always the least
+ * recently used one. On every get we move the key to the end of the map.
+ */
+class LRUCache {
+    constructor(maxSize, ttlMs) {
+        this.maxSize = maxSize;
+        this.ttlMs = ttlMs;
+        this.items = new Map();
+        // counters so we can see how well the cache works
+        this.hits = 0;
+        this.misses = 0;
+        this.evictions = 0;
+    }
+
+    get(key) {
+        const item = this.items.get(key);
+        if (!item) {
+            this.misses++;
+            return undefined;
+        }
+        // expired items are removed and count as a miss
+        if (item.expiresAt <= Date.now()) {
+            this.items.delete(key);
+            this.misses++;
+            return undefined;
+        }
+        // move the key to the end - it is now the most recently used
+        this.items.delete(key);
+        this.items.set(key, item);
+        this.hits++;
+        return item.value;
+    }
+
+    set(key, value) {
+        if (this.maxSize <= 0) {
+            return;
+        }
+        this.items.delete(key);
+        this.items.set(key, { value: value, expiresAt: Date.now() + this.ttlMs });
+        // remove the least recently used items until we fit in the size limit
+        while (this.items.size > this.maxSize) {
+            const oldestKey = this.items.keys().next().value;
+            this.items.delete(oldestKey);
+            this.evictions++;
+        }
+    }
+
+    delete(key) {
+        this.items.delete(key);
+    }
+
+    stats() {
+        return {
+            size: this.items.size,
+            maxSize: this.maxSize,
+            ttlMs: this.ttlMs,
+            hits: this.hits,
+            misses: this.misses,
+            evictions: this.evictions
+        };
+    }
+}
+
+/*
+ * SingleFlight class
+ * If a computation for a key is already running, new callers get the
+ * same promise instead of starting another computation
+ */
+class SingleFlight {
+    constructor() {
+        this.inFlight = new Map();
+        // how many callers joined a computation that was already running
+        this.coalesced = 0;
+    }
+
+    run(key, fn) {
+        const running = this.inFlight.get(key);
+        if (running) {
+            this.coalesced++;
+            return running;
+        }
+        // remove the key when done (also on error) so the next call runs again
+        const promise = fn().finally(() => this.inFlight.delete(key));
+        this.inFlight.set(key, promise);
+        return promise;
+    }
+
+    stats() {
+        return {
+            inFlight: this.inFlight.size,
+            coalesced: this.coalesced
+        };
+    }
+}
+
+module.exports = { LRUCache, SingleFlight };
@@ -0,0 +1,180 @@
+/*
+ * Cost History
+ * Used by GET /api/costs to list the costs of one user without going
+ * through the monthly reports
+ *
+ * - filters: a createdAt range and one or more categories
+ * - keyset pagination on (createdAt, _id): the after token of a page is the
+ *   createdAt and _id of its last cost, the next page starts right after it.
+ *   Unlike skip, every page costs the same no matter how deep it is,
+ *   and costs added meanwhile do not shift the pages
+ * - optional aggregate: count, sum, min and max per category of all the
+ *   costs that match the filters (not only the page), calculated in mongo
+ *
+ * The {userid, createdAt, _id} index of the costs serves the filter and the sort.
+ */
+
+const mongoose = require('mongoose');
+const Cost = require('cost-manager-shared/models/cost');
+const { CATEGORIES } = require('./reports');
+const { historyLimiter } = require('./admission');
+
+// page size when limit is not given, and the biggest allowed
+const DEFAULT_PAGE_SIZE = 100;
+const MAX_PAGE_SIZE = 1000;
+
+// after token: createdAt in epoch ms and the _id, like 1767225600000_65b2...
+const AFTER = /^(\d+)_([0-9a-f]{24})$/;
+
+// only the fields a history needs, not userid, updatedAt and __v
+const PROJECTION = { description: 1, category: 1, sum: 1, createdAt: 1 };
+
+const badRequest = (message) => Object.assign(new Error(message), { status: 400 });
+
+/*
+ * parseTime function
+ * Accepts epoch milliseconds ("1700000000000") or a date string ("2026-01-31")
+ * Returns a Date, or null if the value is not a valid time
+ */
+const parseTime = (value) => {
+    const date = /^\d+$/.test(value) ? new Date(Number(value)) : new Date(value);
+    return isNaN(date.getTime()) ? null : date;
+};
+
+const afterToken = (cost) => new Date(cost.createdAt).getTime() + '_' + String(cost._id);
+
+/*
+ * parseHistoryQuery function
+ * Turns the query parameters into { userid, filter, after, limit, aggregate }
+ * Throws an error with status 400 if a parameter is invalid
+ */
+const parseHistoryQuery = (query) => {
+    const userid = parseInt(query.id);
+    if (isNaN(userid)) {
+        throw badRequest("Missing parameters");
+    }
+    const filter = { userid: userid };
+
+    // date range - from is included, to is not
+    if (query.from || query.to) {
+        filter.createdAt = {};
+        if (query.from) {
+            const from = parseTime(query.from);
+            if (!from) {
+                throw badRequest("Invalid from");
+            }
+            filter.createdAt.$gte = from;
+        }
+        if (query.to) {
+            const to = parseTime(query.to);
+            if (!to) {
+                throw badRequest("Invalid to");
+            }
+            filter.createdAt.$lt = to;
+        }
+    }
+
+    // one category or a comma separated list
+    if (query.category) {
+        const categories = String(query.category).split(',');
+        if (categories.some(cat => !CATEGORIES.includes(cat))) {
+            throw badRequest("Invalid category");
+        }
+        filter.category = categories.length === 1 ? categories[0] : { $in: categories };
+    }
+
+    let after = null;
+    if (query.after) {
+        const match = AFTER.exec(query.after);
+        if (!match) {
+            throw badRequest("Invalid after");
+        }
+        after = { createdAt: new Date(Number(match[1])), _id: new mongoose.Types.ObjectId(match[2]) };
+    }
+
+    const limit = query.limit !== undefined ? parseInt(query.limit) : DEFAULT_PAGE_SIZE;
+    if (isNaN(limit) || limit < 1) {
+        throw badRequest("Invalid limit");
+    }
+
+    return {
+        userid: userid,
+        filter: filter,
+        after: after,
+        limit: Math.min(limit, MAX_PAGE_SIZE),
+        aggregate: query.aggregate === 'true'
+    };
+};
+
+/*
+ * loadPage function
+ * One page of costs, oldest first, and the after token of the next page
+ * (null when this is the last page)
+ */
+const loadPage = async (filter, after, limit) => {
+    const query = Object.assign({}, filter);
+    if (after) {
+        // (createdAt, _id) > after
+        query.$or = [
+            { createdAt: { $gt: after.createdAt } },
+            { createdAt: after.createdAt, _id: { $gt: after._id } }
+        ];
+    }
+    const costs = await Cost.find(query, PROJECTION)
+        .sort({ createdAt: 1, _id: 1 })
+        .limit(limit)
+        .lean();
+
+    // a full page means there might be more costs after it
+    const next = costs.length === limit ? afterToken(costs[costs.length - 1]) : null;
+    return { costs, next };
+};
+
+/*
+ * aggregateHistory function
+ * Count, sum, min and max per category of every cost that matches the filter
+ * Categories without costs get count 0 and null min and max
+ */
+const aggregateHistory = async (filter) => {
+    const groups = await historyLimiter.run(() => Cost.aggregate([
+        { $match: filter },
+        {
+            $group: {
+                _id: '$category',
+                count: { $sum: 1 },
+                sum: { $sum: '$sum' },
+                min: { $min: '$sum' },
+                max: { $max: '$sum' }
+            }
+        }
+    ]));
+
+    const byCategory = new Map(groups.map(g => [g._id, g]));
+    const categories = !filter.category
+        ? CATEGORIES
+        : (filter.category.$in || [filter.category]);
+
+    const aggregate = {};
+    CATEGORIES.filter(cat => categories.includes(cat)).forEach(cat => {
+        const g = byCategory.get(cat);
+        aggregate[cat] = g
+            ? { count: g.count, sum: g.sum, min: g.min, max: g.max }
+            : { count: 0, sum: 0, min: null, max: null };
+    });
+    return aggregate;
+};
+
+/*
+ * loadHistory function
+ * The page (and the aggregate when asked) of a parsed query,
+ * both queries run at the same time
+ */
+const loadHistory = async (parsed) => {
+    const [page, aggregate] = await Promise.all([
+        loadPage(parsed.filter, parsed.after, parsed.limit),
+        parsed.aggregate ? aggregateHistory(parsed.filter) : undefined
+    ]);
+    return { costs: page.costs, next: page.next, aggregate: aggregate };
+};
+
+module.exports = { parseHistoryQuery, loadHistory };
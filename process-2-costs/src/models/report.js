@@ -28,11 +28,36 @@ const reportSchema = new mongoose.Schema({
     },
     // the actual report data - we store it as object
     // contains userid, year, month, and costs array
+    // a document without data only holds pending and version of a month
+    // that was never saved (see holdReports in reports.js)
     data: {
-        type: Object,
-        required: true
+        type: Object
+    },
+    // sum of every category in this month, like { food: 120, health: 0, ... }
+    // the monthly rollup that range reports read instead of the item lists
+    totals: {
+        type: Object
+    },
+    // costs of this month that are being added right now
+    pending: {
+        type: Number
+    },
+    // goes up every time costs of this month start to be added,
+    // a calculated report is only saved if it did not change meanwhile
+    version: {
+        type: Number
+    },
+    // when costs of this month last started to be added
+    heldAt: {
+        type: Date
     }
 });
 
+/*
+ * Unique index - only one saved report per user and month
+ * Also makes the lookup of a saved report fast
+ */
+reportSchema.index({ userid: 1, year: 1, month: 1 }, { unique: true });
+
 // 'reports' is the collection name
 module.exports = mongoose.model('Report', reportSchema, 'reports');
@@ -0,0 +1,642 @@
+/*
+ * Monthly Reports
+ * Everything about building, saving and caching the monthly reports
+ * Used by GET /api/report and GET /api/report/range
+ *
+ * This is the Computed Design Pattern:
+ * A report of a past month almost never changes, so we calculate it once,
+ * save it in the reports collection (with per category totals - the monthly rollup)
+ * and keep the hottest ones in memory too.
+ * A cost added with a createdAt in a past month is added to the saved report
+ * of that month in place (see applyCosts), so the report does not go stale.
+ *
+ * Saving a calculated report races with costs added to its month: a cost
+ * inserted after our aggregation but before our save would be missing
+ * (applyCosts found no report to add it to), and a cost our aggregation saw
+ * but applyCosts added after our save would be counted twice.
+ * So adding costs to a past month holds its report document first
+ * (holdReports - a document without data if the month was never saved):
+ * pending counts the adds going on and version goes up with every one.
+ * A calculated report is only saved if nothing was pending when the report
+ * document was read before the aggregation, and the version is still the same
+ * when we save (saveReports). Otherwise it is returned without saving
+ * and a later request saves it.
+ */
+
+const Cost = require('cost-manager-shared/models/cost');
+const Report = require('./models/report');
+const { LRUCache, SingleFlight } = require('./cache');
+const { reportLimiter, rangeLimiter } = require('./admission');
+
+// all the categories we need to include in report
+const CATEGORIES = ['food', 'health', 'housing', 'sport', 'education'];
+
+/*
+ * Report cache
+ * Past month reports rarely change, so we keep the hottest ones in memory
+ * in front of the reports collection. Size and TTL come from the environment.
+ * Every entry is { data, totals }, entries of updated reports are removed
+ * (see applyCosts and watchReports)
+ */
+const reportCache = new LRUCache(
+    parseInt(process.env.REPORT_CACHE_SIZE || '1000'),
+    parseInt(process.env.REPORT_CACHE_TTL_MS || '3600000')  // 1 hour
+);
+
+// when many requests miss the cache together only one of them does the work
+const reportFlights = new SingleFlight();
+
+// how many reports came from the reports collection, how many were calculated
+// and how many saved reports got new costs
+const reportStats = { stored: 0, computed: 0, updated: 0 };
+
+// change stream on the reports collection (see watchReports)
+let reportStream = null;
+
+// goes up every time cached reports are removed because they changed
+// a report read or calculated before that is not put in the cache,
+// it could bring back what applyCosts just removed
+let cacheEpoch = 0;
+
+const invalidateReport = (key) => {
+    cacheEpoch++;
+    reportCache.delete(key);
+};
+
+// caches a report unless a report changed since epoch was read
+const cacheReport = (key, report, epoch) => {
+    if (epoch === cacheEpoch) {
+        reportCache.set(key, report);
+    }
+};
+
+/*
+ * getMonthRange function
+ * Returns the first moment of the month and the first moment of the next month
+ * The range is half-open: start is included, end is not
+ * We use UTC like $year and $month did in the old query
+ */
+const getMonthRange = (year, month) => {
+    const start = new Date(Date.UTC(year, month - 1, 1));
+    // Date.UTC handles month 12 + 1 by moving to january of next year
+    const end = new Date(Date.UTC(year, month, 1));
+    return { start, end };
+};
+
+/*
+ * isPastMonth function
+ * Returns true if the given month already ended
+ * Only past months can be saved, current and future months might still change
+ * UTC like getMonthRange and applyCosts, so a month ends at the same moment everywhere
+ */
+const isPastMonth = (year, month) => {
+    const now = new Date();
+    const currentYear = now.getUTCFullYear();
+    const currentMonth = now.getUTCMonth() + 1;  // getUTCMonth returns 0-11
+    return year < currentYear || (year === currentYear && month < currentMonth);
+};
+
+const reportKey = (userid, year, month) => userid + '-' + year + '-' + month;
+
+/*
+ * aggregateCosts function
+ * Groups the costs that match into one row per user, month and category
+ * with the items and their sum, in a single aggregation pipeline inside mongo
+ *
+ * $match - the costs we need, with createdAt ranges so the {userid, createdAt}
+ *          index is used
+ * $sort  - oldest cost first, also served by the index
+ * $group - one row per user, month and category with its items and their sum
+ * $project - flatten the _id
+ */
+const aggregateCosts = (match) => {
+    return Cost.aggregate([
+        { $match: match },
+        { $sort: { createdAt: 1 } },
+        {
+            $group: {
+                _id: {
+                    userid: '$userid',
+                    year: { $year: '$createdAt' },
+                    month: { $month: '$createdAt' },
+                    category: '$category'
+                },
+                items: {
+                    $push: {
+                        sum: '$sum',
+                        description: '$description',
+                        day: { $dayOfMonth: '$createdAt' }  // get just the day number (UTC like the range)
+                    }
+                },
+                total: { $sum: '$sum' }
+            }
+        },
+        {
+            $project: {
+                _id: 0,
+                userid: '$_id.userid',
+                year: '$_id.year',
+                month: '$_id.month',
+                category: '$_id.category',
+                items: 1,
+                total: 1
+            }
+        }
+    ]);
+};
+
+// mongo error code of a duplicate key
+const DUPLICATE_KEY = 11000;
+
+// the createdAt range of a month for a $match
+const monthFilter = (year, month) => {
+    const { start, end } = getMonthRange(year, month);
+    return { createdAt: { $gte: start, $lt: end } };
+};
+
+/*
+ * aggregateMonths function
+ * Calculates the items and totals of one user for a list of months
+ * Returns a map: 'year-month' -> Map(category -> { items, total })
+ * Each month is a createdAt range [start of month, start of next month)
+ */
+const aggregateMonths = async (userid, months) => {
+    const ranges = months.map(({ year, month }) => monthFilter(year, month));
+    const match = ranges.length === 1
+        ? Object.assign({ userid: userid }, ranges[0])
+        : { userid: userid, $or: ranges };
+
+    const groups = await aggregateCosts(match);
+
+    const byMonth = new Map();
+    groups.forEach(g => {
+        const key = g.year + '-' + g.month;
+        if (!byMonth.has(key)) {
+            byMonth.set(key, new Map());
+        }
+        byMonth.get(key).set(g.category, { items: g.items, total: g.total });
+    });
+    return byMonth;
+};
+
+/*
+ * buildReport function
+ * Builds the report data and the category totals of one month
+ * from the categories map that aggregateMonths returned
+ */
+const buildReport = (userid, year, month, byCategory) => {
+    const categories = byCategory || new Map();
+    const totals = {};
+    CATEGORIES.forEach(cat => {
+        totals[cat] = categories.has(cat) ? categories.get(cat).total : 0;
+    });
+
+    // build the report data structure
+    const data = {
+        userid: userid,
+        year: year,
+        month: month,
+        // add to costs array as object with category name as key
+        // categories without costs get an empty array
+        costs: CATEGORIES.map(cat => ({ [cat]: categories.has(cat) ? categories.get(cat).items : [] }))
+    };
+
+    return { data, totals };
+};
+
+/*
+ * computeReport function
+ * Calculates the report of one user for one month from the costs collection
+ */
+const computeReport = async (userid, year, month) => {
+    // the calculation waits for a report slot, or fails with OverloadedError (see admission.js)
+    const byMonth = await reportLimiter.run(() => aggregateMonths(userid, [{ year, month }]));
+    return buildReport(userid, year, month, byMonth.get(year + '-' + month));
+};
+
+/*
+ * totalsFromData function
+ * Category totals of a saved report that was saved before we kept totals
+ */
+const totalsFromData = (data) => {
+    const totals = {};
+    data.costs.forEach(entry => {
+        const cat = Object.keys(entry)[0];
+        totals[cat] = entry[cat].reduce((sum, item) => sum + item.sum, 0);
+    });
+    return totals;
+};
+
+/*
+ * saveReports function
+ * Saves calculated past month reports
+ * Every entry is { report, seen }: seen is the report document (or null)
+ * read before the aggregation that calculated the report.
+ *
+ * A report is only written if its version is still the one we saw, so no costs
+ * of its month started to be added since (see holdReports), and it has no data
+ * yet - a saved report can have costs added in place (see applyCosts), our copy
+ * would undo them. A report somebody else saved or held meanwhile is a duplicate
+ * key on the upsert, together with the unique index we never get duplicate reports.
+ * Reports with pending costs are not saved at all.
+ * Reports saved before we kept totals get their totals added.
+ * Returns the number of reports that were saved
+ */
+const saveReports = async (userid, reports) => {
+    const ops = [];
+    reports.forEach(({ report, seen }) => {
+        if (seen && seen.pending > 0) {
+            return;
+        }
+        const filter = {
+            userid: userid,
+            year: report.data.year,
+            month: report.data.month,
+            // reports saved before we kept versions have none
+            version: seen && seen.version !== undefined ? seen.version : { $exists: false }
+        };
+        if (seen && seen.data) {
+            ops.push({
+                updateOne: {
+                    filter: Object.assign({ totals: { $exists: false } }, filter),
+                    update: { $set: { totals: report.totals } }
+                }
+            });
+            return;
+        }
+        ops.push({
+            updateOne: {
+                filter: Object.assign({ data: { $exists: false } }, filter),
+                update: { $set: { data: report.data, totals: report.totals } },
+                upsert: true
+            }
+        });
+    });
+    if (ops.length === 0) {
+        return 0;
+    }
+
+    let result;
+    try {
+        result = await Report.bulkWrite(ops, { ordered: false });
+    } catch (err) {
+        // the reports that changed meanwhile are just not saved
+        if (!err.writeErrors || err.writeErrors.some(e => e.code !== DUPLICATE_KEY)) {
+            throw err;
+        }
+        result = err.result;
+    }
+    return result.upsertedCount + result.modifiedCount;
+};
+
+/*
+ * getReport function
+ * Returns { data, totals } of one month, from the reports collection if we have it there
+ */
+const getReport = async (userid, year, month) => {
+    if (!isPastMonth(year, month)) {
+        // current or future month - never saved, always calculate
+        return computeReport(userid, year, month);
+    }
+
+    // first check if we already have this report saved in database
+    const existingReport = await Report.findOne({ userid, year, month }).lean();
+    if (existingReport && existingReport.data) {
+        reportStats.stored++;
+        return {
+            data: existingReport.data,
+            totals: existingReport.totals || totalsFromData(existingReport.data)
+        };
+    }
+
+    // report doesnt exist, calculate it and save it for future requests
+    // (existingReport can be a held month without data, see holdReports)
+    const report = await computeReport(userid, year, month);
+    reportStats.computed++;
+    const saved = await saveReports(userid, [{ report: report, seen: existingReport }]);
+    if (saved === 0) {
+        // another request saved it meanwhile, and it may have new costs already
+        const stored = await Report.findOne({ userid, year, month }).lean();
+        if (stored && stored.data && stored.totals) {
+            return { data: stored.data, totals: stored.totals };
+        }
+        // costs of the month are being added, a later request saves it
+        return report;
+    }
+    console.log('Computed report saved for user ' + userid + ', ' + year + '-' + month);
+
+    return report;
+};
+
+/*
+ * loadReport function
+ * Returns { data, totals } of one month
+ *
+ * Lookup order for past months:
+ * 1. memory cache  2. reports collection  3. calculate from costs and save
+ */
+const loadReport = async (userid, year, month) => {
+    const key = reportKey(userid, year, month);
+    const pastMonth = isPastMonth(year, month);
+
+    if (pastMonth) {
+        const cached = reportCache.get(key);
+        if (cached) {
+            return cached;
+        }
+    }
+
+    // only the request that does the work caches the report, with the epoch
+    // from before it started - callers that join later would check too late
+    return reportFlights.run(key, async () => {
+        const epoch = cacheEpoch;
+        const report = await getReport(userid, year, month);
+        if (pastMonth) {
+            cacheReport(key, report, epoch);
+        }
+        return report;
+    });
+};
+
+/*
+ * listMonths function
+ * All the months from (fromYear, fromMonth) to (toYear, toMonth), both included
+ */
+const listMonths = (fromYear, fromMonth, toYear, toMonth) => {
+    const months = [];
+    let year = fromYear;
+    let month = fromMonth;
+    while (year < toYear || (year === toYear && month <= toMonth)) {
+        months.push({ year, month });
+        month++;
+        if (month > 12) {
+            month = 1;
+            year++;
+        }
+    }
+    return months;
+};
+
+/*
+ * loadRangeReports function
+ * Returns { data, totals } for every month in the list, in the same order
+ *
+ * - past months come from the memory cache or the saved monthly reports
+ *   (one query for all of them)
+ * - past months that were never saved, and the current month,
+ *   are calculated together with one aggregation
+ * - the newly calculated past months are saved for next time
+ * withItems false skips reading the item lists of saved reports
+ */
+const loadRangeReports = async (userid, months, withItems) => {
+    const reports = new Map();
+    const epoch = cacheEpoch;
+
+    // 1. memory cache
+    months.forEach(({ year, month }) => {
+        if (isPastMonth(year, month)) {
+            const cached = reportCache.get(reportKey(userid, year, month));
+            if (cached) {
+                reports.set(year + '-' + month, cached);
+            }
+        }
+    });
+
+    // 2. saved reports of the past months that were not in memory
+    // the report documents we saw, for saveReports
+    const seen = new Map();
+    const wanted = months.filter(m => isPastMonth(m.year, m.month) && !reports.has(m.year + '-' + m.month));
+    if (wanted.length > 0) {
+        // without items data only tells if the report was saved
+        const projection = withItems ? {} : { 'data.costs': 0 };
+        const stored = await Report.find({
+            userid: userid,
+            year: { $gte: wanted[0].year, $lte: wanted[wanted.length - 1].year }
+        }, projection).lean();
+
+        const wantedKeys = new Set(wanted.map(m => m.year + '-' + m.month));
+        stored.forEach(r => {
+            const key = r.year + '-' + r.month;
+            if (!wantedKeys.has(key)) {
+                return;
+            }
+            seen.set(key, r);
+            // held months without data, and reports saved before we kept totals,
+            // are calculated below
+            if (!r.data || !r.totals) {
+                return;
+            }
+            const report = { data: r.data, totals: r.totals };
+            reports.set(key, report);
+            reportStats.stored++;
+            if (withItems) {
+                cacheReport(reportKey(userid, r.year, r.month), report, epoch);
+            }
+        });
+    }
+
+    // 3. calculate everything that is still missing in one aggregation
+    const missing = months.filter(m => !reports.has(m.year + '-' + m.month));
+    if (missing.length > 0) {
+        // only this step is limited, cached and saved months never wait (see admission.js)
+        const byMonth = await rangeLimiter.run(() => aggregateMonths(userid, missing));
+        const toSave = [];
+        missing.forEach(({ year, month }) => {
+            const report = buildReport(userid, year, month, byMonth.get(year + '-' + month));
+            reports.set(year + '-' + month, report);
+            if (isPastMonth(year, month)) {
+                toSave.push({ report: report, seen: seen.get(year + '-' + month) || null });
+                cacheReport(reportKey(userid, year, month), report, epoch);
+                reportStats.computed++;
+            }
+        });
+
+        // 4. save the calculated past months
+        await saveReports(userid, toSave);
+    }
+
+    return months.map(m => reports.get(m.year + '-' + m.month));
+};
+
+/*
+ * costsByReport function
+ * The costs of every past month report, by report key
+ * Costs of the current month are left out, those reports are never saved
+ */
+const costsByReport = (costs) => {
+    const byReport = new Map();
+    costs.forEach(cost => {
+        const date = new Date(cost.createdAt);
+        // UTC months, like the ranges of the aggregation
+        const year = date.getUTCFullYear();
+        const month = date.getUTCMonth() + 1;
+        if (!isPastMonth(year, month)) {
+            return;
+        }
+        const key = reportKey(cost.userid, year, month);
+        if (!byReport.has(key)) {
+            byReport.set(key, { userid: cost.userid, year: year, month: month, costs: [] });
+        }
+        byReport.get(key).costs.push(cost);
+    });
+    return byReport;
+};
+
+/*
+ * holdReports function
+ * Called before costs are inserted: marks the past month reports of the costs
+ * as having costs being added (pending) and changes their version, so a report
+ * calculated meanwhile is not saved (see saveReports)
+ * Months that were never saved get a report document without data
+ * Returns the held reports, to be passed to applyCosts after the insert
+ */
+const holdReports = async (costs) => {
+    const held = costsByReport(costs);
+    if (held.size === 0) {
+        return held;
+    }
+    const heldAt = new Date();
+    await Report.bulkWrite([...held.values()].map(r => ({
+        updateOne: {
+            filter: { userid: r.userid, year: r.year, month: r.month },
+            update: { $inc: { pending: 1, version: 1 }, $set: { heldAt: heldAt } },
+            upsert: true
+        }
+    })), { ordered: false });
+    return held;
+};
+
+/*
+ * applyCosts function
+ * Adds saved costs to the saved reports of their months and releases
+ * the reports that holdReports held for them
+ * POST /api/add takes a createdAt, so a cost can belong to a past month
+ * that already has a saved report. Instead of calculating that report again
+ * we push the items into their category and $inc the category totals,
+ * one atomic update per report - no matter how many costs it gets.
+ * Months without a saved report need nothing, they are calculated with the cost later.
+ * costs are the ones that were saved, held the reports held before the insert
+ * (call it with no costs when the insert failed)
+ */
+const applyCosts = async (costs, held) => {
+    if (held.size === 0) {
+        return;
+    }
+    const byReport = costsByReport(costs);
+
+    const ops = [];
+    byReport.forEach(r => {
+        // oldest cost first, like the aggregation
+        r.costs.sort((a, b) => new Date(a.createdAt) - new Date(b.createdAt));
+        const push = {};
+        const inc = {};
+        r.costs.forEach(cost => {
+            // data.costs has one { category: items } entry per category, in CATEGORIES order
+            const path = 'data.costs.' + CATEGORIES.indexOf(cost.category) + '.' + cost.category;
+            if (!push[path]) {
+                push[path] = { $each: [] };
+            }
+            push[path].$each.push({
+                sum: cost.sum,
+                description: cost.description,
+                day: new Date(cost.createdAt).getUTCDate()
+            });
+            inc['totals.' + cost.category] = (inc['totals.' + cost.category] || 0) + cost.sum;
+        });
+
+        // held months without data need nothing, they are calculated with the cost later
+        const filter = { userid: r.userid, year: r.year, month: r.month, data: { $exists: true } };
+        ops.push({
+            updateOne: {
+                filter: Object.assign({ totals: { $exists: true } }, filter),
+                update: { $push: push, $inc: inc }
+            }
+        });
+        // reports saved before we kept totals only get the items (see totalsFromData)
+        ops.push({
+            updateOne: {
+                filter: Object.assign({ totals: { $exists: false } }, filter),
+                update: { $push: push }
+            }
+        });
+    });
+
+    try {
+        if (ops.length > 0) {
+            const result = await Report.bulkWrite(ops, { ordered: false });
+            reportStats.updated += result.modifiedCount;
+        }
+    } finally {
+        // a report that stays held is calculated on every request until
+        // reports:check --fix releases it
+        await Report.bulkWrite([...held.values()].map(r => ({
+            updateOne: {
+                filter: { userid: r.userid, year: r.year, month: r.month },
+                update: { $inc: { pending: -1 } }
+            }
+        })), { ordered: false });
+        // other workers and services drop their copies from the change stream
+        held.forEach((r, key) => invalidateReport(key));
+    }
+};
+
+/*
+ * watchReports function
+ * Removes reports that were updated anywhere (another worker, another service
+ * in the combined launcher) from the memory cache
+ * Change streams need a replica set, without one only the updates of
+ * this process are seen and the others expire with the cache TTL
+ */
+const watchReports = () => {
+    try {
+        reportStream = Report.watch([
+            { $match: { operationType: { $in: ['update', 'replace'] } } },
+            { $project: { 'fullDocument.userid': 1, 'fullDocument.year': 1, 'fullDocument.month': 1 } }
+        ], { fullDocument: 'updateLookup' });
+        reportStream.on('change', change => {
+            const r = change.fullDocument;
+            if (r) {
+                invalidateReport(reportKey(r.userid, r.year, r.month));
+            }
+        });
+        reportStream.on('error', err => {
+            console.error('Report change stream error:', err.message);
+            reportStream.close().catch(() => {});
+            reportStream = null;
+        });
+    } catch (err) {
+        console.error('Report change stream error:', err.message);
+    }
+};
+
+/*
+ * unwatchReports function
+ * Stops the change stream (used on shutdown)
+ */
+const unwatchReports = async () => {
+    if (reportStream) {
+        const stream = reportStream;
+        reportStream = null;
+        await stream.close();
+    }
+};
+
+module.exports = {
+    CATEGORIES,
+    reportCache,
+    reportFlights,
+    reportStats,
+    getMonthRange,
+    isPastMonth,
+    reportKey,
+    monthFilter,
+    aggregateCosts,
+    buildReport,
+    holdReports,
+    applyCosts,
+    watchReports,
+    unwatchReports,
+    loadReport,
+    listMonths,
+    loadRangeReports
+};
@@ -0,0 +1,362 @@
+"""
+Cost Manager - Monthly Reports Precompute Job
+
+GET /api/report saves the report of a past month the first time somebody asks
+for it (the Computed Design Pattern, see src/reports.js). This job saves the
+reports of every user with costs in a closed month up front, right after the
+month ends, so the first requests of the month do not all calculate at once.
+
+How it works:
+- the user ids come from the users collection, --user-batch at a time, and the
+  costs of the month are read per batch with { userid: { $in }, createdAt range }
+  sorted by userid and createdAt. The {userid, createdAt, _id} index serves this
+  with one bounded range per user, instead of a walk over the whole index
+  (a createdAt filter alone has no index prefix to use)
+- the costs are split into chunks of --chunk-size costs
+- every chunk becomes columnar NumPy arrays (userid, category, sum, day)
+- costs are grouped by user and category with a stable argsort and the category
+  totals are summed with bincount, no Python loop over the sums
+- the reports are saved with unordered bulk writes, --write-batch at a time
+
+Only one chunk (plus the costs of one user that continue in the next chunk)
+is in memory, so millions of costs need the same memory as a few thousand.
+
+The saved documents are the same as the ones the costs service saves:
+{ userid, year, month, data: { userid, year, month, costs: [{ food: [{ sum,
+description, day }] }, ...] }, totals: { food, health, ... } }, with the items
+of every category oldest first. Numbers are stored like the Node driver does:
+whole numbers as int32, everything else as double.
+
+Reports that are already saved are left alone, since they may have costs added
+in place (see applyCosts). --replace overwrites them.
+Like saveReports in src/reports.js, the report documents of a user batch are
+read before its costs, and a report is only written if its version is still
+the same and no costs of the month were pending (see holdReports): a report
+whose costs are being added meanwhile is left to the first request.
+Users without costs in the month get their empty report on the first request.
+
+MONGO_URI comes from the environment.
+
+To run:   python src/scripts/precompute_reports.py                  (the last closed month)
+          python src/scripts/precompute_reports.py --year 2026 --month 1
+To check: npm run reports:check
+
+Requires numpy and pymongo.
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# same order as CATEGORIES in src/reports.js - the order of data.costs and totals
+CATEGORIES = ["food", "health", "housing", "sport", "education"]
+CATEGORY_CODES = {name: code for code, name in enumerate(CATEGORIES)}
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+# mongo error code of a duplicate key
+DUPLICATE_KEY = 11000
+
+
+def month_range(year, month):
+    """The first moment of the month and of the next month (UTC, like getMonthRange)"""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+def last_closed_month():
+    now = datetime.now(timezone.utc)
+    return (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+
+
+def js_number(value):
+    """A number the way the Node driver stores it: int32 if it is whole and fits, else double"""
+    value = float(value)
+    if value.is_integer() and INT32_MIN <= value <= INT32_MAX:
+        return int(value)
+    return value
+
+
+# ===========================================
+# Reading - costs of the month as columns
+# ===========================================
+class Columns:
+    """The costs of one chunk, one list per field"""
+
+    def __init__(self):
+        self.userid = []
+        self.category = []
+        self.sum = []
+        self.day = []
+        self.description = []
+
+    def __len__(self):
+        return len(self.userid)
+
+    def append(self, cost):
+        code = CATEGORY_CODES.get(cost.get("category"))
+        # the schema only allows these categories, anything else is not in a report either
+        if code is None:
+            return
+        self.userid.append(cost["userid"])
+        self.category.append(code)
+        self.sum.append(cost["sum"])
+        self.day.append(cost["createdAt"].day)
+        self.description.append(cost["description"])
+
+    def split(self, at):
+        """Keeps the rows before at and returns the rest as new Columns"""
+        rest = Columns()
+        for name in ("userid", "category", "sum", "day", "description"):
+            values = getattr(self, name)
+            setattr(rest, name, values[at:])
+            del values[at:]
+        return rest
+
+
+def user_batches(users, size):
+    """Yields the user ids in order, size at a time (the unique index on id serves the sort)"""
+    batch = []
+    for user in users.find({}, {"_id": 0, "id": 1}).sort("id", 1):
+        batch.append(user["id"])
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_costs(db, year, month, user_batch, batch_size, seen):
+    """
+    Yields the costs of the month sorted by userid and createdAt, one query per user batch
+    The report documents of the batch are read first, into seen by userid
+    """
+    start, end = month_range(year, month)
+    for userids in user_batches(db["users"], user_batch):
+        for report in db["reports"].find(
+            {"userid": {"$in": userids}, "year": year, "month": month},
+            {"_id": 0, "userid": 1, "data.userid": 1, "pending": 1, "version": 1},
+        ):
+            seen[report["userid"]] = report
+        cursor = db["costs"].find(
+            {"userid": {"$in": userids}, "createdAt": {"$gte": start, "$lt": end}},
+            {"_id": 0, "userid": 1, "category": 1, "sum": 1, "description": 1, "createdAt": 1},
+            batch_size=batch_size,
+        ).sort([("userid", 1), ("createdAt", 1)])
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+
+def read_chunks(costs, chunk_size):
+    """
+    Yields Columns with whole users only
+    The rows of the last user of a chunk can continue in the next one,
+    so they are carried over to the next chunk
+    """
+    chunk = Columns()
+    # the chunk is split when it has limit rows
+    limit = chunk_size
+    try:
+        for cost in costs:
+            chunk.append(cost)
+            if len(chunk) < limit:
+                continue
+            # the first row of the last user in the chunk
+            last = chunk.userid[-1]
+            at = len(chunk) - 1
+            while at > 0 and chunk.userid[at - 1] == last:
+                at -= 1
+            # one user with more costs than the chunk, keep reading
+            if at == 0:
+                limit = len(chunk) + chunk_size
+                continue
+            rest = chunk.split(at)
+            yield chunk
+            chunk = rest
+            limit = chunk_size
+    finally:
+        costs.close()
+    if len(chunk) > 0:
+        yield chunk
+
+
+# ===========================================
+# Grouping - vectorized per chunk
+# ===========================================
+def build_reports(chunk, year, month):
+    """
+    Groups the costs of a chunk by user and category
+    Yields (userid, data, totals) for every user in the chunk
+    """
+    userids = np.asarray(chunk.userid, dtype=np.int64)
+    categories = np.asarray(chunk.category, dtype=np.int64)
+    sums = np.asarray(chunk.sum, dtype=np.float64)
+    n_categories = len(CATEGORIES)
+
+    # rows are sorted by userid, so every user is one run of rows
+    new_user = np.empty(len(userids), dtype=bool)
+    new_user[0] = True
+    np.not_equal(userids[1:], userids[:-1], out=new_user[1:])
+    user_of_row = np.cumsum(new_user) - 1
+    users = userids[new_user]
+
+    # one group per user and category, a stable sort keeps the createdAt order inside a group
+    keys = user_of_row * n_categories + categories
+    order = np.argsort(keys, kind="stable")
+    n_groups = len(users) * n_categories
+    counts = np.bincount(keys, minlength=n_groups)
+    totals = np.bincount(keys, weights=sums, minlength=n_groups).reshape(len(users), n_categories)
+    group_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # the report items, already in group order
+    sums_list = sums[order].tolist()
+    days_list = np.asarray(chunk.day, dtype=np.int64)[order].tolist()
+    items = [
+        {"sum": js_number(sums_list[i]), "description": chunk.description[row], "day": days_list[i]}
+        for i, row in enumerate(order.tolist())
+    ]
+
+    counts_list = counts.tolist()
+    starts_list = group_starts.tolist()
+    totals_list = totals.tolist()
+    for u, userid in enumerate(users.tolist()):
+        userid = js_number(userid)
+        costs = []
+        for c, category in enumerate(CATEGORIES):
+            group = u * n_categories + c
+            start = starts_list[group]
+            costs.append({category: items[start:start + counts_list[group]]})
+        data = {"userid": userid, "year": year, "month": month, "costs": costs}
+        report_totals = {category: js_number(totals_list[u][c]) for c, category in enumerate(CATEGORIES)}
+        yield userid, data, report_totals
+
+
+# ===========================================
+# Writing
+# ===========================================
+def write_reports(reports, ops, replace):
+    """
+    Saves a batch of reports with one unordered bulk write
+    Returns the number of reports that were inserted or replaced
+    """
+    if not ops:
+        return 0
+    try:
+        result = reports.bulk_write(ops, ordered=False)
+    except BulkWriteError as error:
+        # a request saved the same report meanwhile, its report is just as good
+        others = [e for e in error.details["writeErrors"] if e["code"] != DUPLICATE_KEY]
+        if others:
+            raise
+        result = error.details
+        return result["nUpserted"] + (result["nModified"] if replace else 0)
+    return result.upserted_count + (result.modified_count if replace else 0)
+
+
+def report_update(userid, year, month, data, totals, replace, seen):
+    """
+    The write of one report, or None if it is not written
+    seen is the report document read before the costs (or None)
+    """
+    if seen is not None and (seen.get("pending", 0) > 0 or ("data" in seen and not replace)):
+        return None
+    report_filter = {"userid": userid, "year": year, "month": month}
+    # a changed version is a duplicate key on the upsert, like a report saved meanwhile
+    report_filter["version"] = seen["version"] if seen is not None and "version" in seen else {"$exists": False}
+    if not replace:
+        report_filter["data"] = {"$exists": False}
+    return UpdateOne(report_filter, {"$set": {"data": data, "totals": totals}}, upsert=True)
+
+
+class Progress:
+    """Prints how far the job is every interval seconds, and the throughput"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.printed = self.started
+        self.costs = 0
+        self.users = 0
+        self.written = 0
+
+    def update(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.printed < self.interval:
+            return
+        self.printed = now
+        elapsed = max(now - self.started, 1e-9)
+        print(f"{elapsed:8.1f}s  costs {self.costs:>10} ({self.costs / elapsed:,.0f}/s)  "
+              f"users {self.users:>8} ({self.users / elapsed:,.0f}/s)  saved {self.written:>8}",
+              flush=True)
+
+
+def precompute(db, year, month, chunk_size, user_batch, write_batch, replace, progress):
+    reports = db["reports"]
+    ops = []
+    # report documents by userid, an entry is removed when its report is built
+    seen = {}
+    costs = read_costs(db, year, month, user_batch, min(chunk_size, 10000), seen)
+    for chunk in read_chunks(costs, chunk_size):
+        for userid, data, totals in build_reports(chunk, year, month):
+            op = report_update(userid, year, month, data, totals, replace, seen.pop(userid, None))
+            if op is not None:
+                ops.append(op)
+            progress.users += 1
+            if len(ops) >= write_batch:
+                progress.written += write_reports(reports, ops, replace)
+                ops = []
+        progress.costs += len(chunk)
+        progress.update()
+    progress.written += write_reports(reports, ops, replace)
+    progress.update(force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Save the monthly reports of a closed month for every user")
+    default_year, default_month = last_closed_month()
+    parser.add_argument("--year", type=int, default=default_year)
+    parser.add_argument("--month", type=int, default=default_month, choices=range(1, 13), metavar="1-12")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="costs grouped at a time")
+    parser.add_argument("--user-batch", type=int, default=1000, help="users read with one query")
+    parser.add_argument("--write-batch", type=int, default=1000, help="reports per bulk write")
+    parser.add_argument("--replace", action="store_true", help="overwrite reports that are already saved")
+    parser.add_argument("--progress", type=float, default=5, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    # reports of open months are never saved, they can still change
+    if (args.year, args.month) > last_closed_month():
+        parser.error(f"{args.year}-{args.month:02d} is not a closed month")
+
+    uri = os.environ.get("MONGO_URI")
+    if not uri:
+        parser.error("MONGO_URI is not set")
+
+    client = MongoClient(uri)
+    try:
+        # mongoose uses the database of the URI, or test when it has none
+        db = client.get_default_database("test")
+        progress = Progress(args.progress)
+        print(f"Precomputing reports of {args.year}-{args.month:02d}", flush=True)
+        precompute(db, args.year, args.month, args.chunk_size, args.user_batch, args.write_batch,
+                   args.replace, progress)
+        print(f"Saved {progress.written} reports for {progress.users} users "
+              f"from {progress.costs} costs", flush=True)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(130)
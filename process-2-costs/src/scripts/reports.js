@@ -0,0 +1,216 @@
+/*
+ * Reports Maintenance Script
+ * Checks the saved monthly reports that GET /api/report reads
+ *
+ * Usage:
+ *   node src/scripts/reports.js check         - compare saved reports with the costs and print differences
+ *   node src/scripts/reports.js check --fix   - same as check, and also save the calculated reports
+ *                                               and release stale holds
+ *
+ * Saved reports are updated in place when a cost is added to a past month
+ * (see applyCosts in reports.js). This script makes sure they still match
+ * a full calculation, for example after costs were changed by hand.
+ *
+ * It also finds reports held for costs being added for longer than
+ * STALE_HOLD_MS (a process stopped between holdReports and applyCosts).
+ * A held month is never saved, so it is calculated on every request.
+ */
+
+const mongoose = require('mongoose');
+const Report = require('../models/report');
+const { CATEGORIES, reportKey, monthFilter, aggregateCosts, buildReport } = require('../reports');
+
+// load environment variables from .env file
+require('dotenv').config();
+
+// how many saved reports we check with one aggregation
+const BATCH_SIZE = 200;
+
+// sums can be floats so we allow a tiny difference when comparing
+const EPSILON = 1e-6;
+
+// adding costs takes milliseconds, a hold this old was never released
+const STALE_HOLD_MS = parseInt(process.env.STALE_HOLD_MS || '600000');  // 10 minutes
+
+/*
+ * computeReports function
+ * Calculates the reports of a batch of saved reports with one aggregation
+ * Returns a map: report key -> { data, totals }
+ */
+const computeReports = async (reports) => {
+    const groups = await aggregateCosts({
+        $or: reports.map(r => Object.assign({ userid: r.userid }, monthFilter(r.year, r.month)))
+    });
+
+    // report key -> Map(category -> { items, total }), like aggregateMonths
+    const byReport = new Map();
+    groups.forEach(g => {
+        const key = reportKey(g.userid, g.year, g.month);
+        if (!byReport.has(key)) {
+            byReport.set(key, new Map());
+        }
+        byReport.get(key).set(g.category, { items: g.items, total: g.total });
+    });
+
+    const computed = new Map();
+    reports.forEach(r => {
+        const key = reportKey(r.userid, r.year, r.month);
+        computed.set(key, buildReport(r.userid, r.year, r.month, byReport.get(key)));
+    });
+    return computed;
+};
+
+/*
+ * sortedItems function
+ * The items of a category in a fixed order
+ * Costs added to a saved report are at the end of their category,
+ * so we compare the items without their order
+ */
+const sortedItems = (data, category) => {
+    const entry = data.costs.find(c => Object.keys(c)[0] === category);
+    const items = entry ? entry[category] : [];
+    return JSON.stringify(items
+        .map(item => [item.day, item.sum, item.description])
+        .sort((a, b) => (a[0] - b[0]) || (a[1] - b[1]) || String(a[2]).localeCompare(String(b[2]))));
+};
+
+/*
+ * differences function
+ * The categories where a saved report does not match the calculated one
+ * Reports saved before we kept totals only have their items checked
+ */
+const differences = (stored, computed) => {
+    return CATEGORIES.filter(cat => {
+        if (stored.totals && Math.abs((stored.totals[cat] || 0) - computed.totals[cat]) > EPSILON) {
+            return true;
+        }
+        return sortedItems(stored.data, cat) !== sortedItems(computed.data, cat);
+    });
+};
+
+/*
+ * writeReports function
+ * Replaces the data and totals of the given reports with the calculated ones
+ * Every entry is { report, stored }. A report whose costs started to be added
+ * since it was read (its version changed, see holdReports) is left alone,
+ * the next check finds it again if it is still wrong
+ */
+const writeReports = async (reports) => {
+    for (let i = 0; i < reports.length; i += BATCH_SIZE) {
+        await Report.bulkWrite(reports.slice(i, i + BATCH_SIZE).map(({ report, stored }) => ({
+            updateOne: {
+                filter: {
+                    userid: stored.userid,
+                    year: stored.year,
+                    month: stored.month,
+                    version: stored.version !== undefined ? stored.version : { $exists: false },
+                    pending: { $not: { $gt: 0 } }
+                },
+                update: { $set: { data: report.data, totals: report.totals } }
+            }
+        })), { ordered: false });
+    }
+};
+
+/*
+ * checkBatch function
+ * Compares a batch of saved reports with their calculation
+ * Returns { report, stored } of the ones that are wrong, report is the calculated one
+ */
+const checkBatch = async (batch) => {
+    const computed = await computeReports(batch);
+    const wrong = [];
+    batch.forEach(stored => {
+        const report = computed.get(reportKey(stored.userid, stored.year, stored.month));
+        const categories = differences(stored, report);
+        if (categories.length > 0) {
+            console.log('Report ' + stored.userid + ' ' + stored.year + '-' + stored.month +
+                ': wrong ' + categories.join(', '));
+            wrong.push({ report: report, stored: stored });
+        }
+    });
+    return wrong;
+};
+
+/*
+ * checkHolds function
+ * Finds reports that are held for longer than STALE_HOLD_MS and releases them if fix is true
+ * The version goes up, so a report calculated before the release is not saved
+ * Returns the number of stale holds
+ */
+const checkHolds = async (fix) => {
+    const stale = { pending: { $gt: 0 }, heldAt: { $lt: new Date(Date.now() - STALE_HOLD_MS) } };
+    const count = await Report.countDocuments(stale);
+    console.log(count + ' stale held reports found');
+    if (fix && count > 0) {
+        await Report.updateMany(stale, { $set: { pending: 0 }, $inc: { version: 1 } });
+        console.log('Released ' + count + ' held reports');
+    }
+    return count;
+};
+
+/*
+ * check function
+ * Compares every saved report with a calculation from the costs
+ * Prints every report that is wrong, and fixes them if fix is true
+ * Returns the number of wrong reports and stale holds
+ */
+const check = async (fix) => {
+    let checked = 0;
+    let wrong = [];
+    let batch = [];
+
+    // documents without data are held months that were never saved
+    const saved = Report.find({ data: { $exists: true } }).lean();
+    for await (const report of saved.cursor({ batchSize: BATCH_SIZE })) {
+        batch.push(report);
+        if (batch.length >= BATCH_SIZE) {
+            wrong = wrong.concat(await checkBatch(batch));
+            checked += batch.length;
+            batch = [];
+        }
+    }
+    if (batch.length > 0) {
+        wrong = wrong.concat(await checkBatch(batch));
+        checked += batch.length;
+    }
+
+    console.log(wrong.length + ' wrong reports found in ' + checked + ' saved reports');
+
+    if (fix && wrong.length > 0) {
+        await writeReports(wrong);
+        console.log('Fixed ' + wrong.length + ' reports');
+    }
+
+    return wrong.length + await checkHolds(fix);
+};
+
+const main = async () => {
+    const command = process.argv[2];
+    const fix = process.argv.includes('--fix');
+
+    await mongoose.connect(process.env.MONGO_URI);
+
+    let exitCode = 0;
+    try {
+        if (command === 'check') {
+            const wrongCount = await check(fix);
+            // exit with 1 so this can be used in scheduled jobs
+            if (wrongCount > 0 && !fix) {
+                exitCode = 1;
+            }
+        } else {
+            console.error('Usage: node src/scripts/reports.js check [--fix]');
+            exitCode = 2;
+        }
+    } finally {
+        await mongoose.disconnect();
+    }
+
+    process.exit(exitCode);
+};
+
+main().catch(err => {
+    console.error('Reports script error:', err);
+    process.exit(1);
+});
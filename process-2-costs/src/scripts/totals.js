@@ -0,0 +1,212 @@
+/*
+ * Totals Maintenance Script
+ * Tools for the running totals collection that GET /api/users/:id reads
+ *
+ * Usage:
+ *   node src/scripts/totals.js backfill      - compute all totals from the costs collection
+ *   node src/scripts/totals.js check         - compare totals with the costs and print differences
+ *   node src/scripts/totals.js check --fix   - same as check, and also fix the wrong totals
+ *
+ * Both can run while POST /api/add is live. The stored totals are read before
+ * the costs are summed, and a total is only set if it is still the one we read:
+ * a cost added meanwhile $inc-ed it, so the user is summed again instead of
+ * overwriting that $inc (which would lose the cost). Adding a cost takes
+ * milliseconds, a cost is only counted twice if it was saved before its user
+ * was summed and its $inc came after we set the total, long after we read it.
+ */
+
+const mongoose = require('mongoose');
+const Cost = require('cost-manager-shared/models/cost');
+const Total = require('cost-manager-shared/models/total');
+
+// load environment variables from .env file
+require('dotenv').config();
+
+// how many updates we send to mongo in one bulkWrite
+const BATCH_SIZE = 1000;
+
+// sums can be floats so we allow a tiny difference when comparing
+const EPSILON = 1e-6;
+
+// how many times a user whose total changed meanwhile is summed again
+const MAX_ATTEMPTS = 5;
+
+// mongo error code of a duplicate key
+const DUPLICATE_KEY = 11000;
+
+/*
+ * readTotals function
+ * Loads the stored totals into a map: userid -> total
+ */
+const readTotals = async (filter) => {
+    const stored = new Map();
+    for await (const t of Total.find(filter || {}).lean().cursor()) {
+        stored.set(t.userid, t.total);
+    }
+    return stored;
+};
+
+/*
+ * computeTotals function
+ * Sums the costs of every user (or of the users that match) inside mongo with an aggregation
+ * Returns a cursor so we dont hold all the users in memory at once
+ */
+const computeTotals = (match) => {
+    const pipeline = match ? [{ $match: match }] : [];
+    pipeline.push({ $group: { _id: '$userid', total: { $sum: '$sum' } } });
+    return Cost.aggregate(pipeline).cursor({ batchSize: BATCH_SIZE });
+};
+
+/*
+ * writeTotals function
+ * Sets the given totals with bulkWrite, BATCH_SIZE updates at a time
+ * Every entry is { userid, total, stored }, stored is the total we read before
+ * the costs were summed (undefined if the user had none). A total that is not
+ * stored anymore is not matched, so its upsert fails with a duplicate key.
+ * Returns the userids whose total changed meanwhile
+ */
+const writeTotals = async (totals) => {
+    const changed = [];
+    for (let i = 0; i < totals.length; i += BATCH_SIZE) {
+        const batch = totals.slice(i, i + BATCH_SIZE);
+        try {
+            await Total.bulkWrite(batch.map(t => ({
+                updateOne: {
+                    filter: { userid: t.userid, total: t.stored !== undefined ? t.stored : { $exists: false } },
+                    update: { $set: { total: t.total } },
+                    upsert: true
+                }
+            })), { ordered: false });
+        } catch (err) {
+            if (!err.writeErrors || err.writeErrors.some(e => e.code !== DUPLICATE_KEY)) {
+                throw err;
+            }
+            err.writeErrors.forEach(e => changed.push(batch[e.index].userid));
+        }
+    }
+    return changed;
+};
+
+/*
+ * rewriteTotals function
+ * Sums the costs of the users whose total changed meanwhile again and sets them,
+ * until no total changes or MAX_ATTEMPTS
+ * Returns the userids that still changed every time
+ */
+const rewriteTotals = async (userids) => {
+    let changed = userids;
+    for (let attempt = 1; attempt < MAX_ATTEMPTS && changed.length > 0; attempt++) {
+        const filter = { userid: { $in: changed } };
+        const stored = await readTotals(filter);
+        // users without costs anymore get 0
+        const totals = new Map(changed.map(userid => [userid, 0]));
+        for await (const row of computeTotals(filter)) {
+            totals.set(row._id, row.total);
+        }
+        changed = await writeTotals([...totals].map(([userid, total]) => ({
+            userid: userid,
+            total: total,
+            stored: stored.get(userid)
+        })));
+    }
+    changed.forEach(userid => {
+        console.log('User ' + userid + ': total kept changing, run check again');
+    });
+    return changed;
+};
+
+/*
+ * backfill function
+ * Writes the correct total for every user that has costs
+ */
+const backfill = async () => {
+    const stored = await readTotals();
+    let count = 0;
+    let changed = [];
+    let batch = [];
+
+    for await (const row of computeTotals()) {
+        batch.push({ userid: row._id, total: row.total, stored: stored.get(row._id) });
+        if (batch.length >= BATCH_SIZE) {
+            changed = changed.concat(await writeTotals(batch));
+            count += batch.length;
+            batch = [];
+        }
+    }
+    changed = changed.concat(await writeTotals(batch));
+    count += batch.length;
+    await rewriteTotals(changed);
+
+    console.log('Backfilled totals for ' + count + ' users');
+};
+
+/*
+ * check function
+ * Compares every stored total with the real sum of the costs
+ * Prints every user that is wrong, and fixes them if fix is true
+ * Returns the number of wrong totals
+ */
+const check = async (fix) => {
+    // read before the costs are summed, see writeTotals
+    const stored = await readTotals();
+
+    const wrong = [];
+    for await (const row of computeTotals()) {
+        const storedTotal = stored.has(row._id) ? stored.get(row._id) : 0;
+        if (Math.abs(storedTotal - row.total) > EPSILON) {
+            wrong.push({ userid: row._id, total: row.total, stored: stored.get(row._id) });
+        }
+        stored.delete(row._id);
+    }
+
+    // whatever is left in the map has a total but no costs at all
+    stored.forEach((storedTotal, userid) => {
+        if (Math.abs(storedTotal) > EPSILON) {
+            wrong.push({ userid: userid, total: 0, stored: storedTotal });
+        }
+    });
+
+    wrong.forEach(w => {
+        console.log('User ' + w.userid + ': stored ' + (w.stored || 0) + ', expected ' + w.total);
+    });
+    console.log(wrong.length + ' wrong totals found');
+
+    if (fix && wrong.length > 0) {
+        const left = await rewriteTotals(await writeTotals(wrong));
+        console.log('Fixed ' + (wrong.length - left.length) + ' totals');
+    }
+
+    return wrong.length;
+};
+
+const main = async () => {
+    const command = process.argv[2];
+    const fix = process.argv.includes('--fix');
+
+    await mongoose.connect(process.env.MONGO_URI);
+
+    let exitCode = 0;
+    try {
+        if (command === 'backfill') {
+            await backfill();
+        } else if (command === 'check') {
+            const wrongCount = await check(fix);
+            // exit with 1 so this can be used in scheduled jobs
+            if (wrongCount > 0 && !fix) {
+                exitCode = 1;
+            }
+        } else {
+            console.error('Usage: node src/scripts/totals.js <backfill|check> [--fix]');
+            exitCode = 2;
+        }
+    } finally {
+        await mongoose.disconnect();
+    }
+
+    process.exit(exitCode);
+};
+
+main().catch(err => {
+    console.error('Totals script error:', err);
+    process.exit(1);
+});
@@ -0,0 +1,58 @@
+/*
+ * Schema Serializers
+ * The response shapes of this service, compiled once with compile and
+ * compileArray (see serialize.js in the shared package)
+ */
+
+const { compile, compileArray } = require('cost-manager-shared/serialize');
+
+// a cost item as saved in the database (POST /api/add)
+const serializeCost = compile({
+    description: 'string',
+    category: 'string',
+    userid: 'number',
+    sum: 'number',
+    createdAt: 'date',
+    _id: 'id',
+    updatedAt: 'date',
+    __v: 'number'
+});
+
+// one item in a monthly report
+const serializeReportItem = compileArray(compile({
+    sum: 'number',
+    description: 'string',
+    day: 'number'
+}));
+
+// the costs of a report: [{ food: [...] }, { health: [...] }, ...]
+const serializeReportCosts = (costs) => '[' + costs.map(entry => {
+    const category = Object.keys(entry)[0];
+    return '{' + JSON.stringify(category) + ':' + serializeReportItem(entry[category]) + '}';
+}).join(',') + ']';
+
+// a monthly report (GET /api/report)
+const serializeReport = compile({
+    userid: 'number',
+    year: 'number',
+    month: 'number',
+    costs: serializeReportCosts
+});
+
+// one cost in a cost history (GET /api/costs), only the projected fields
+const serializeHistoryItems = compileArray(compile({
+    _id: 'id',
+    description: 'string',
+    category: 'string',
+    sum: 'number',
+    createdAt: 'date'
+}));
+
+// a page of a cost history, aggregate is only there when it was asked for
+const serializeHistory = compile({
+    userid: 'number',
+    costs: serializeHistoryItems,
+    aggregate: value => JSON.stringify(value)
+});
+
+module.exports = { serializeCost, serializeReport, serializeHistory };
@@ -0,0 +1,113 @@
+/*
+ * Known Users Cache
+ * Users are never deleted, so once we saw a user id we know it exists.
+ * Before adding a cost we check this set instead of asking mongo every time.
+ *
+ * - warmed at startup with all the user ids from the users collection
+ * - new users are added from a change stream on the users collection
+ * - a miss falls back to a User.exists query (and adds the id if found)
+ * - at most USER_CACHE_MAX ids are kept, after that misses just go to mongo
+ */
+
+const User = require('cost-manager-shared/models/user');
+
+class UserCache {
+    constructor(maxSize) {
+        this.maxSize = maxSize;
+        this.ids = new Set();
+        this.stream = null;
+        // counters so we can see how well the cache works
+        this.hits = 0;
+        this.misses = 0;
+    }
+
+    add(id) {
+        if (this.ids.size < this.maxSize) {
+            this.ids.add(id);
+        }
+    }
+
+    has(id) {
+        return this.ids.has(Number(id));
+    }
+
+    /*
+     * exists function
+     * Returns true if the user exists, from memory if we can
+     */
+    async exists(id) {
+        if (this.has(id)) {
+            this.hits++;
+            return true;
+        }
+        this.misses++;
+        // lean exists query - returns only the _id, not the full user
+        const found = await User.exists({ id: id });
+        if (found) {
+            this.add(Number(id));
+        }
+        return Boolean(found);
+    }
+
+    /*
+     * warm function
+     * Loads all the user ids, only the id field is read
+     */
+    async warm() {
+        const cursor = User.find({}, { id: 1, _id: 0 }).lean().cursor({ batchSize: 5000 });
+        for await (const user of cursor) {
+            if (this.ids.size >= this.maxSize) {
+                break;
+            }
+            this.ids.add(user.id);
+        }
+        await cursor.close();
+        console.log('User cache warmed with ' + this.ids.size + ' users');
+    }
+
+    /*
+     * watch function
+     * Adds users inserted by the users service while we are running
+     * Change streams need a replica set (Atlas has one), if they are not
+     * available we only rely on the fallback query
+     */
+    watch() {
+        try {
+            this.stream = User.watch([{ $match: { operationType: 'insert' } }]);
+            this.stream.on('change', change => this.add(change.fullDocument.id));
+            this.stream.on('error', err => {
+                console.error('User cache change stream error:', err.message);
+                this.stream.close().catch(() => {});
+                this.stream = null;
+            });
+        } catch (err) {
+            console.error('User cache change stream error:', err.message);
+        }
+    }
+
+    /*
+     * unwatch function
+     * Stops the change stream (used on shutdown)
+     */
+    async unwatch() {
+        if (this.stream) {
+            const stream = this.stream;
+            this.stream = null;
+            await stream.close();
+        }
+    }
+
+    stats() {
+        return {
+            size: this.ids.size,
+            maxSize: this.maxSize,
+            hits: this.hits,
+            misses: this.misses,
+            watching: this.stream !== null
+        };
+    }
+}
+
+const userCache = new UserCache(parseInt(process.env.USER_CACHE_MAX || '1000000'));
+
+module.exports = { UserCache, userCache };
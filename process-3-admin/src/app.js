@@ -5,15 +5,30 @@
  */
 
 const express = require('express');
-const { connectDB, logger } = require('./db');
+const { connectDB, closeDB, createLogger, logShipper } = require('cost-manager-shared/db');
+const { runService, serve } = require('cost-manager-shared/cluster');
+const { requestLogger } = require('cost-manager-shared/logger');
+const { IMMUTABLE, encode, sendEncoded } = require('cost-manager-shared/httpcache');
+const { compress } = require('cost-manager-shared/compress');
+const { httpMetrics, metricsHandler } = require('cost-manager-shared/metrics');
+const { serializeTeam } = require('./serialize');
 
 const app = express();
 
+// the service name in the logs and the metrics
+const SERVICE_NAME = require('../package.json').name;
+const logger = createLogger(SERVICE_NAME);
+
+// count and time every request, and serve them on GET /metrics (see metrics.js)
+// /metrics comes before the request logger so scrapes do not fill the logs
+app.use(httpMetrics(SERVICE_NAME));
+app.get('/metrics', metricsHandler);
+
+// compress responses with brotli or gzip (see compress.js)
+app.use(compress());
+
 // logging middleware - logs every request
-app.use((req, res, next) => {
-    logger.info({ method: req.method, url: req.url }, 'Admin Request');
-    next();
-});
+app.use(requestLogger(logger, logShipper, 'Admin Request'));
 
 /*
  * Team members data
@@ -32,13 +47,17 @@ const team = [
     }    
 ];
 
+// the team never changes while the service runs, so we serialize it only once
+const teamResponse = encode(team, serializeTeam);
+
 /*
  * GET /api/about
  * Returns the development team members
  * Only returns first_name and last_name as required
  */
 app.get('/api/about', (req, res) => {
-    res.json(team);
+    // immutable with a strong ETag - If-None-Match with the same ETag gets 304
+    sendEncoded(res, teamResponse, IMMUTABLE);
 });
 
 // get port from environment or use default
@@ -46,8 +65,16 @@ const PORT = process.env.PORT || 3003;
 
 // connect to database then start server
 // we still connect to DB here for the logging to work
-connectDB().then(() => {
-    app.listen(PORT, () => {
-        console.log('Admin Service running on port ' + PORT);
+// only when run directly - the combined launcher mounts the app itself
+// with CLUSTER_WORKERS set every worker runs this (see cluster.js)
+if (require.main === module) {
+    runService('Admin Service', () => {
+        connectDB().then(() => {
+            serve(app, PORT, () => {
+                console.log('Admin Service running on port ' + PORT);
+            }, closeDB);
+        });
     });
-});
+}
+
+module.exports = { app };
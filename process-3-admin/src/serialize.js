@@ -0,0 +1,15 @@
+/*
+ * Schema Serializers
+ * The response shapes of this service, compiled once with compile and
+ * compileArray (see serialize.js in the shared package)
+ */
+
+const { compile, compileArray } = require('cost-manager-shared/serialize');
+
+// the team members (GET /api/about)
+const serializeTeam = compileArray(compile({
+    first_name: 'string',
+    last_name: 'string'
+}));
+
+module.exports = { serializeTeam };
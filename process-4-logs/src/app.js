@@ -7,30 +7,238 @@
 
 const express = require('express');
 const mongoose = require('mongoose');
-const { connectDB, logger } = require('./db'); 
+const { connectDB, closeDB, createLogger, logShipper } = require('cost-manager-shared/db');
+const { runService, serve } = require('cost-manager-shared/cluster');
+const { requestLogger } = require('cost-manager-shared/logger');
+const { streamCursor } = require('cost-manager-shared/stream');
+const { compress } = require('cost-manager-shared/compress');
+const { httpMetrics, metricsHandler } = require('cost-manager-shared/metrics');
+const { COLLECTION, openLogs } = require('./storage');
+const { createLogIndexes, setTimeToLive, startRetention } = require('./retention');
+const { openTail, closeTails } = require('./tail');
 
 const app = express();
 
+// the service name in the logs and the metrics
+const SERVICE_NAME = require('../package.json').name;
+const logger = createLogger(SERVICE_NAME);
+
+// count and time every request, and serve them on GET /metrics (see metrics.js)
+// /metrics comes before the request logger so scrapes do not fill the logs
+app.use(httpMetrics(SERVICE_NAME));
+app.get('/metrics', metricsHandler);
+
+// compress responses with brotli or gzip (see compress.js)
+// log listings are big and compress very well
+app.use(compress());
+
 // logging middleware - yes we also log requests to this service
-app.use((req, res, next) => {
-    logger.info({ method: req.method, url: req.url }, 'Logs Service Request');
-    next();
-});
+app.use(requestLogger(logger, logShipper, 'Logs Service Request'));
+
+// page size for GET /api/logs when limit is not given, and the biggest allowed
+const DEFAULT_PAGE_SIZE = 100;
+const MAX_PAGE_SIZE = 1000;
+
+// an event id of the live tail, the hex _data of a change stream resume token
+const RESUME_TOKEN = /^[0-9A-Fa-f]{2,1024}$/;
+
+/*
+ * parseTime function
+ * Accepts epoch milliseconds ("1700000000000") or a date string ("2026-01-31")
+ * Returns a Date, or null if the value is not a valid time
+ */
+const parseTime = (value) => {
+    const date = /^\d+$/.test(value) ? new Date(Number(value)) : new Date(value);
+    return isNaN(date.getTime()) ? null : date;
+};
+
+/*
+ * buildFilter function
+ * Turns the query parameters into a mongo filter
+ * Throws an error with status 400 if a parameter is invalid
+ */
+const buildFilter = (query) => {
+    const filter = {};
+
+    // time range - from is included, to is not
+    if (query.from || query.to) {
+        filter.time = {};
+        if (query.from) {
+            const from = parseTime(query.from);
+            if (!from) {
+                throw Object.assign(new Error("Invalid from"), { status: 400 });
+            }
+            filter.time.$gte = from;
+        }
+        if (query.to) {
+            const to = parseTime(query.to);
+            if (!to) {
+                throw Object.assign(new Error("Invalid to"), { status: 400 });
+            }
+            filter.time.$lt = to;
+        }
+    }
+
+    // pino saves the service name (from package.json) in the name field
+    if (query.service) {
+        filter.name = query.service;
+    }
+    if (query.message) {
+        filter.msg = query.message;
+    }
+    if (query.method) {
+        filter.method = query.method.toUpperCase();
+    }
+    // url prefix - escape regex characters so /api/users?x=1 is taken literally
+    if (query.url) {
+        filter.url = { $regex: '^' + query.url.replace(/[.*+?^${}()|[\]\\]/g, '\\$&') };
+    }
+    // the X-Request-Id of the logged request (see tracing.js)
+    if (query.request_id) {
+        filter.request_id = query.request_id;
+    }
+
+    // keyset pagination - _id is a stable order to page through, the same in every place
+    // the logs are kept (openLogs merges them by _id), but it is not the insert order: every service creates the _ids of its logs when its shipper
+    // flushes (see logger.js), so a log saved later can get a smaller _id than the
+    // last page. To follow new logs use GET /api/logs/tail
+    if (query.after) {
+        if (!mongoose.isValidObjectId(query.after)) {
+            throw Object.assign(new Error("Invalid after"), { status: 400 });
+        }
+        filter._id = { $gt: new mongoose.Types.ObjectId(query.after) };
+    }
+
+    return filter;
+};
+
+/*
+ * readLogs function
+ * Reads up to limit logs from the cursor and closes it
+ */
+const readLogs = async (cursor, limit) => {
+    const logs = [];
+    try {
+        let doc;
+        while (logs.length < limit && (doc = await cursor.next())) {
+            logs.push(doc);
+        }
+    } finally {
+        await cursor.close();
+    }
+    return logs;
+};
 
 /*
  * GET /api/logs
- * Returns all log entries from the logs collection
- * We access the collection directly using mongoose.connection
- * because pino-mongodb creates the logs, not a mongoose model
+ * Returns log entries from the logs collection (and the daily buckets, see storage.js)
+ * We access the collections directly using mongoose.connection
+ * because the log shipper of every service writes the logs (see logger.js),
+ * not a mongoose model
+ *
+ * Optional query parameters (all can be combined):
+ * - from, to: time range (epoch ms or date string)
+ * - service: service name, like users-service
+ * - message: exact log message, like 'Costs Service Request'
+ * - method: HTTP method of the logged request
+ * - url: url prefix of the logged request
+ * - request_id: request id of the logged request
+ * - archive=true: also search the archived logs (see archive.js), oldest first
+ * - after, limit: keyset pagination by _id, X-Next-After header has the next after
+ * - format=ndjson (or Accept: application/x-ndjson): one log per line
+ *
+ * Without after/limit the matching logs are streamed from a cursor,
+ * so memory stays small no matter how big the collection is
  */
 app.get('/api/logs', async (req, res) => {
     try {
-        // get logs directly from collection
-        // we use mongoose.connection.db to access the raw MongoDB driver
-        // then find all documents and convert to array
-        const logs = await mongoose.connection.db.collection('logs').find({}).toArray();
+        const filter = buildFilter(req.query);
+        const format = req.query.format === 'ndjson' || req.get('Accept') === 'application/x-ndjson'
+            ? 'ndjson'
+            : 'json';
+        const archive = req.query.archive === 'true';
+
+        if (req.query.after || req.query.limit !== undefined) {
+            const limit = req.query.limit !== undefined ? parseInt(req.query.limit) : DEFAULT_PAGE_SIZE;
+            if (isNaN(limit) || limit < 1) {
+                return res.status(400).json({ id: 0, message: "Invalid limit" });
+            }
+            const pageSize = Math.min(limit, MAX_PAGE_SIZE);
+            const page = await readLogs(await openLogs(filter, { archive: archive }), pageSize);
+
+            // a full page means there might be more logs after it
+            if (page.length === pageSize) {
+                res.set('X-Next-After', String(page[page.length - 1]._id));
+            }
+
+            if (format === 'ndjson') {
+                return res.type('application/x-ndjson')
+                    .send(page.map(l => JSON.stringify(l) + '\n').join(''));
+            }
+            return res.json(page);
+        }
+
+        // no pagination - stream every matching log from the cursor
+        await streamCursor(await openLogs(filter, { archive: archive }), res, format);
+    } catch (error) {
+        res.status(error.status || 500).json({ id: 0, message: error.message });
+    }
+});
+
+/*
+ * GET /api/logs/tail
+ * Sends new logs as Server-Sent Events while the services write them (see tail.js)
+ * Every event has the log as data and the resume token of its change as id
+ *
+ * Optional query parameters: service, message, method, url and request_id like GET /api/logs
+ * A reconnecting client first gets the logs inserted after its Last-Event-ID header
+ * (or the after parameter), then the live ones
+ */
+app.get('/api/logs/tail', async (req, res) => {
+    let filter;
+    try {
+        filter = buildFilter(Object.assign({}, req.query, { after: undefined }));
+    } catch (error) {
+        return res.status(error.status || 500).json({ id: 0, message: error.message });
+    }
+    const lastEventId = req.get('Last-Event-ID') || req.query.after;
+    if (lastEventId && !RESUME_TOKEN.test(lastEventId)) {
+        return res.status(400).json({ id: 0, message: "Invalid Last-Event-ID" });
+    }
+    await openTail(req, res, filter, lastEventId);
+});
+
+/*
+ * GET /api/logs/trace/:id
+ * Returns every request with this request id, in all the services, in time order
+ * Only the lines written when a request was done have the duration and the spans,
+ * so these are the ones we return:
+ * { request_id, requests: [{ service, method, url, status, time, duration_ms, spans }] }
+ * archive=true also searches the archived logs
+ */
+app.get('/api/logs/trace/:id', async (req, res) => {
+    try {
+        const filter = { request_id: req.params.id, duration_ms: { $exists: true } };
+        const cursor = await openLogs(filter, { archive: req.query.archive === 'true', sort: { time: 1, _id: 1 } });
+        const done = await readLogs(cursor, MAX_PAGE_SIZE);
 
-        res.json(logs);
+        if (done.length === 0) {
+            return res.status(404).json({ id: req.params.id, message: "Trace not found" });
+        }
+
+        res.json({
+            request_id: req.params.id,
+            requests: done.map(log => ({
+                service: log.name,
+                method: log.method,
+                url: log.url,
+                status: log.status,
+                time: log.time,
+                duration_ms: log.duration_ms,
+                aborted: log.aborted,
+                spans: log.spans || []
+            }))
+        });
     } catch (error) {
         res.status(500).json({ id: 0, message: error.message });
     }
@@ -39,9 +247,50 @@ app.get('/api/logs', async (req, res) => {
 // port for this service
 const PORT = process.env.PORT || 3004;
 
+// stops the background retention (set by start)
+let stopRetention = null;
+
+/*
+ * start function
+ * Runs once the database is connected, before serving
+ */
+const start = async () => {
+    try {
+        await createLogIndexes(COLLECTION);
+        await setTimeToLive();
+    } catch (err) {
+        console.error('Index build error:', err);
+    }
+    // archive and remove old logs in the background (see retention.js)
+    stopRetention = startRetention();
+};
+
+/*
+ * stop function
+ * Runs on shutdown, before the database is closed
+ */
+const stop = async () => {
+    if (stopRetention) {
+        stopRetention();
+    }
+    closeTails();
+};
+
 // connect to database then start server
-connectDB().then(() => {
-    app.listen(PORT, () => {
-        console.log('Logs Service running on port ' + PORT);
+// only when run directly - the combined launcher mounts the app itself
+// with CLUSTER_WORKERS set every worker runs this (see cluster.js)
+if (require.main === module) {
+    runService('Logs Service', () => {
+        connectDB().then(async () => {
+            await start();
+            serve(app, PORT, () => {
+                console.log('Logs Service running on port ' + PORT);
+            }, async () => {
+                await stop();
+                await closeDB();
+            });
+        });
     });
-});
+}
+
+module.exports = { app, start, stop };
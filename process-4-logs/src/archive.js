@@ -0,0 +1,183 @@
+/*
+ * Log Archive
+ * Logs that left the database are kept in gzip compressed NDJSON files,
+ * one file per UTC day and source collection: 2026-01-31.logs.ndjson.gz
+ * The logs service reads them back for historical queries (archive=true).
+ *
+ * Configuration (environment variables):
+ * - LOG_ARCHIVE_DIR - folder of the archive files (default none - expired logs are not archived)
+ */
+
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+const zlib = require('zlib');
+const { pipeline } = require('stream/promises');
+
+const DAY_MS = 24 * 60 * 60 * 1000;
+const FILE_NAME = /^(\d{4}-\d{2}-\d{2})\.([\w]+)\.ndjson\.gz$/;
+
+const archiveDir = () => process.env.LOG_ARCHIVE_DIR || null;
+
+// 2026-01-31 of a Date (UTC)
+const dayOf = (date) => date.toISOString().slice(0, 10);
+
+/*
+ * writeArchive function
+ * Saves the documents of a cursor as the archive of one day and source
+ * We write to a temporary file and link it in place, so a file that exists is always complete
+ * Returns false if the day was already archived
+ */
+const writeArchive = async (day, source, cursor) => {
+    const file = path.join(archiveDir(), day + '.' + source + '.ndjson.gz');
+    if (fs.existsSync(file)) {
+        await cursor.close();
+        return false;
+    }
+    await fs.promises.mkdir(archiveDir(), { recursive: true });
+
+    const temp = file + '.' + process.pid + '.tmp';
+    const lines = async function* () {
+        for await (const doc of cursor) {
+            yield JSON.stringify(doc) + '\n';
+        }
+    };
+    try {
+        await pipeline(lines, zlib.createGzip(), fs.createWriteStream(temp));
+        // link fails if another process archived the day meanwhile, we keep its file
+        await fs.promises.link(temp, file);
+    } catch (err) {
+        if (err.code !== 'EEXIST') {
+            throw err;
+        }
+        return false;
+    } finally {
+        await fs.promises.rm(temp, { force: true });
+    }
+    return true;
+};
+
+/*
+ * archiveFiles function
+ * The archive files of the days in [from, to), oldest first
+ * from and to are Dates or null for no limit
+ */
+const archiveFiles = async (from, to) => {
+    if (!archiveDir()) {
+        return [];
+    }
+    let names;
+    try {
+        names = await fs.promises.readdir(archiveDir());
+    } catch (err) {
+        if (err.code === 'ENOENT') {
+            return [];
+        }
+        throw err;
+    }
+
+    return names
+        .map(name => FILE_NAME.exec(name))
+        .filter(match => {
+            if (!match) {
+                return false;
+            }
+            const start = new Date(match[1] + 'T00:00:00Z').getTime();
+            return (!from || start + DAY_MS > from.getTime()) && (!to || start < to.getTime());
+        })
+        .sort((a, b) => a[0].localeCompare(b[0]))
+        .map(match => path.join(archiveDir(), match[0]));
+};
+
+// values we can compare with < and >, ObjectIds compare by their hex string
+const comparable = (value) => {
+    if (value instanceof Date) {
+        return value.getTime();
+    }
+    if (value && value._bsontype === 'ObjectId') {
+        return value.toHexString();
+    }
+    return value;
+};
+
+/*
+ * matches function
+ * Checks an archived document against a mongo filter from buildFilter
+ * Only what buildFilter creates is supported: equality, $gt, $gte, $lt, $regex and $exists
+ */
+const matches = (doc, filter) => {
+    return Object.keys(filter).every(key => {
+        const condition = filter[key];
+        const value = comparable(doc[key]);
+        if (condition === null || typeof condition !== 'object' || condition instanceof Date ||
+            condition._bsontype === 'ObjectId') {
+            return value === comparable(condition);
+        }
+        return Object.keys(condition).every(op => {
+            const operand = comparable(condition[op]);
+            switch (op) {
+                case '$gt': return value !== undefined && value > operand;
+                case '$gte': return value !== undefined && value >= operand;
+                case '$lt': return value !== undefined && value < operand;
+                case '$regex': return typeof value === 'string' && new RegExp(operand).test(value);
+                case '$exists': return (value !== undefined) === Boolean(operand);
+                default: return false;
+            }
+        });
+    });
+};
+
+/*
+ * ArchiveCursor class
+ * Reads the documents of archive files that match the filter, in _id order in every file,
+ * with the next/close interface of a mongo cursor (see stream.js)
+ */
+class ArchiveCursor {
+    constructor(files, filter) {
+        this.files = files.slice();
+        this.filter = filter;
+        this.lines = null;
+        this.input = null;
+    }
+
+    async next() {
+        while (true) {
+            if (!this.lines) {
+                const file = this.files.shift();
+                if (!file) {
+                    return null;
+                }
+                this.input = fs.createReadStream(file).pipe(zlib.createGunzip());
+                this.lines = readline.createInterface({ input: this.input, crlfDelay: Infinity })[Symbol.asyncIterator]();
+            }
+
+            const { value, done } = await this.lines.next();
+            if (done) {
+                this.lines = null;
+                continue;
+            }
+            if (!value) {
+                continue;
+            }
+            const doc = JSON.parse(value);
+            // time was a Date in the database, so filters and sorting work the same
+            if (doc.time) {
+                doc.time = new Date(doc.time);
+            }
+            if (matches(doc, this.filter)) {
+                return doc;
+            }
+        }
+    }
+
+    async close() {
+        if (this.lines) {
+            await this.lines.return();
+            this.input.destroy();
+            this.lines = null;
+        }
+        this.files = [];
+    }
+}
+
+module.exports = { DAY_MS, archiveDir, dayOf, writeArchive, archiveFiles, comparable, matches, ArchiveCursor };
@@ -0,0 +1,156 @@
+/*
+ * Log Retention
+ * Keeps only the last LOG_RETENTION_DAYS days of logs in the database.
+ * Expired days are first saved to the archive (when LOG_ARCHIVE_DIR is set, see archive.js),
+ * then removed: a bucket collection is dropped at once, the logs collection
+ * gets a deleteMany by time (or a TTL index when nothing is archived).
+ *
+ * Configuration (environment variables):
+ * - LOG_RETENTION_DAYS        - days of logs kept in the database (default 0 - keep everything)
+ * - LOG_RETENTION_INTERVAL_MS - how often the retention runs (default 3600000 - every hour)
+ *
+ * Every step can run again safely: a day that is already archived is not written twice,
+ * so cluster workers or a crash in the middle do not lose or duplicate logs.
+ */
+
+const mongoose = require('mongoose');
+const { DAY_MS, archiveDir, dayOf, writeArchive } = require('./archive');
+const { COLLECTION, bucketDay, logCollections } = require('./storage');
+const { bucketName } = require('cost-manager-shared/logger');
+
+const retentionDays = () => parseInt(process.env.LOG_RETENTION_DAYS || '0');
+
+// the biggest TTL mongo accepts, we use it for no TTL
+const NO_TTL = 2147483647;
+
+// mongo error code of a collection that does not exist
+const NAMESPACE_NOT_FOUND = 26;
+
+/*
+ * createLogIndexes function
+ * the log shipper (see logger.js) only inserts documents, so we create the indexes ourselves
+ * time - for time range queries (and the TTL when logs are deleted without archiving)
+ * name + time - for the service filter together with a time range
+ * request_id - for the trace of one request (sparse, old logs have no id)
+ */
+const createLogIndexes = async (name) => {
+    const logs = mongoose.connection.db.collection(name);
+    await logs.createIndex({ time: 1 });
+    await logs.createIndex({ name: 1, time: 1 });
+    await logs.createIndex({ request_id: 1, time: 1 }, { sparse: true });
+};
+
+/*
+ * setTimeToLive function
+ * Without an archive, mongo itself deletes old logs from the logs collection
+ * with a TTL on the time index
+ */
+const setTimeToLive = async () => {
+    const days = archiveDir() ? 0 : retentionDays();
+    const logs = mongoose.connection.db.collection(COLLECTION);
+    const index = (await logs.indexes()).find(i => i.name === 'time_1');
+    const current = index ? index.expireAfterSeconds : undefined;
+
+    let wanted;
+    if (days > 0) {
+        wanted = days * DAY_MS / 1000;
+    } else if (current !== undefined && current !== NO_TTL) {
+        // a TTL cannot be removed with collMod, a huge one turns it off
+        wanted = NO_TTL;
+    }
+    if (wanted !== undefined && wanted !== current) {
+        await mongoose.connection.db.command({
+            collMod: COLLECTION,
+            index: { keyPattern: { time: 1 }, expireAfterSeconds: wanted }
+        });
+    }
+};
+
+/*
+ * archiveLogsCollection function
+ * Archives every day before the cutoff that is still in the logs collection, then deletes them
+ */
+const archiveLogsCollection = async (cutoff) => {
+    const logs = mongoose.connection.db.collection(COLLECTION);
+    const oldest = await logs.find({ time: { $lt: cutoff } }).sort({ time: 1 }).limit(1).next();
+    if (!oldest) {
+        return;
+    }
+
+    for (let day = new Date(dayOf(oldest.time) + 'T00:00:00Z'); day < cutoff; day = new Date(day.getTime() + DAY_MS)) {
+        const range = { time: { $gte: day, $lt: new Date(day.getTime() + DAY_MS) } };
+        if (await logs.countDocuments(range, { limit: 1 }) > 0) {
+            await writeArchive(dayOf(day), COLLECTION, logs.find(range).sort({ _id: 1 }));
+        }
+    }
+    const result = await logs.deleteMany({ time: { $lt: cutoff } });
+    console.log('Log retention: archived and deleted ' + result.deletedCount + ' logs before ' + dayOf(cutoff));
+};
+
+/*
+ * runRetention function
+ * One retention run: prepare the next buckets, then archive and remove the expired days
+ */
+const runRetention = async () => {
+    // indexes of today's and tomorrow's buckets before the first log is written to them
+    if (process.env.LOG_BUCKETS === 'daily') {
+        const now = new Date();
+        await createLogIndexes(bucketName(COLLECTION, now));
+        await createLogIndexes(bucketName(COLLECTION, new Date(now.getTime() + DAY_MS)));
+    }
+
+    const days = retentionDays();
+    if (days <= 0) {
+        return;
+    }
+    // the first day we keep starts at the cutoff
+    const cutoff = new Date(new Date(dayOf(new Date()) + 'T00:00:00Z').getTime() - (days - 1) * DAY_MS);
+
+    for (const name of await logCollections(true)) {
+        const day = bucketDay(name);
+        if (!day || day >= cutoff) {
+            continue;
+        }
+        const logs = mongoose.connection.db.collection(name);
+        if (archiveDir()) {
+            await writeArchive(dayOf(day), name, logs.find({}).sort({ _id: 1 }));
+        }
+        try {
+            await logs.drop();
+            console.log('Log retention: dropped ' + name);
+        } catch (err) {
+            // another worker dropped it first
+            if (err.code !== NAMESPACE_NOT_FOUND) {
+                throw err;
+            }
+        }
+    }
+
+    if (archiveDir()) {
+        await archiveLogsCollection(cutoff);
+    }
+};
+
+/*
+ * startRetention function
+ * Runs the retention now and every LOG_RETENTION_INTERVAL_MS, returns a function that stops it
+ */
+const startRetention = () => {
+    // a slow run (a big archive) must not overlap the next one
+    let running = false;
+    const run = () => {
+        if (running) {
+            return;
+        }
+        running = true;
+        runRetention()
+            .catch(err => console.error('Log retention error:', err))
+            .finally(() => { running = false; });
+    };
+    run();
+    const timer = setInterval(run, parseInt(process.env.LOG_RETENTION_INTERVAL_MS || '3600000'));
+    timer.unref();
+    return () => clearInterval(timer);
+};
+
+module.exports = { createLogIndexes, setTimeToLive, runRetention, startRetention };
@@ -0,0 +1,35 @@
+/*
+ * Log Retention Script
+ * Runs one retention pass (see retention.js) and exits, for a scheduled job
+ * instead of (or next to) the hourly run inside the logs service
+ *
+ * Usage:
+ *   node src/scripts/retention.js
+ *
+ * Uses the same LOG_RETENTION_DAYS, LOG_ARCHIVE_DIR and LOG_BUCKETS settings as the service
+ */
+
+const mongoose = require('mongoose');
+
+// load environment variables from .env file
+require('dotenv').config();
+
+const { COLLECTION } = require('../storage');
+const { createLogIndexes, setTimeToLive, runRetention } = require('../retention');
+
+const main = async () => {
+    await mongoose.connect(process.env.MONGO_URI);
+    try {
+        await createLogIndexes(COLLECTION);
+        await setTimeToLive();
+        await runRetention();
+    } finally {
+        await mongoose.disconnect();
+    }
+    process.exit(0);
+};
+
+main().catch(err => {
+    console.error('Retention script error:', err);
+    process.exit(1);
+});
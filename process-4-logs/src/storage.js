@@ -0,0 +1,230 @@
+/*
+ * Log Storage
+ * The logs can be in three places, oldest first:
+ * - archive files (see archive.js), only read when a query asks for them
+ * - the logs collection
+ * - daily bucket collections logs_20260131 (LOG_BUCKETS=daily, see logger.js)
+ *
+ * openLogs returns one cursor over all the places a query needs, merged in one order,
+ * so GET /api/logs does not care where the logs are.
+ */
+
+const mongoose = require('mongoose');
+const { DAY_MS, archiveFiles, comparable, ArchiveCursor } = require('./archive');
+
+const COLLECTION = 'logs';
+const BUCKET = /^logs_(\d{4})(\d{2})(\d{2})$/;
+const ARCHIVE_DAY = /(\d{4}-\d{2}-\d{2})\.[\w]+\.ndjson\.gz$/;
+
+// listCollections is cheap but not free, the list only changes once a day
+const LIST_TTL_MS = 10000;
+let listed = { at: 0, names: null };
+
+// the start of the day of a bucket collection, null for other names
+const bucketDay = (name) => {
+    const match = BUCKET.exec(name);
+    return match ? new Date(match[1] + '-' + match[2] + '-' + match[3] + 'T00:00:00Z') : null;
+};
+
+/*
+ * logCollections function
+ * The logs collection and the bucket collections, buckets oldest first
+ */
+const logCollections = async (fresh) => {
+    if (fresh || !listed.names || Date.now() - listed.at > LIST_TTL_MS) {
+        const collections = await mongoose.connection.db.listCollections({}, { nameOnly: true }).toArray();
+        const names = collections.map(c => c.name);
+        listed = {
+            at: Date.now(),
+            names: [COLLECTION].concat(names.filter(name => BUCKET.test(name)).sort())
+        };
+    }
+    return listed.names;
+};
+
+/*
+ * hotCollections function
+ * The collections that can have logs in [from, to), from and to can be null
+ */
+const hotCollections = async (from, to) => {
+    const names = await logCollections();
+    return names.filter(name => {
+        const day = bucketDay(name);
+        if (!day) {
+            return true;
+        }
+        return (!from || day.getTime() + DAY_MS > from.getTime()) && (!to || day < to);
+    });
+};
+
+// the values of the sort fields of a document, compared field by field
+const sortKey = (doc, sort) => Object.keys(sort).map(field => comparable(doc[field]));
+
+// a missing value comes first, like in a mongo sort
+const compareKeys = (a, b) => {
+    for (let i = 0; i < a.length; i++) {
+        if (a[i] === b[i]) {
+            continue;
+        }
+        if (a[i] === undefined || a[i] < b[i]) {
+            return -1;
+        }
+        return 1;
+    }
+    return 0;
+};
+
+/*
+ * MergedCursor class
+ * Merges several cursors, each sorted by the same fields, into one sorted cursor
+ * with the next/close interface of one cursor (a k-way merge).
+ * The places can not be read one after the other: a log is filed by its time but
+ * its _id is made when its shipper flushes (see logger.js), so the _ids of the
+ * places overlap, and a page that ends inside one place would skip the logs of
+ * the next places that come before its last _id.
+ *
+ * Every source is { open, from }: open opens its cursor, from is the smallest
+ * sort key it can have (or null). A source is only opened once the merge reaches
+ * from, so a query over many days does not open every day at once.
+ * A log that is in two places (archived, but not removed yet) is returned once.
+ */
+class MergedCursor {
+    constructor(sources, sort) {
+        this.sort = sort;
+        // sources not opened yet, smallest from first
+        this.waiting = sources.slice().sort((a, b) => (!a.from ? -1 : !b.from ? 1 : compareKeys(a.from, b.from)));
+        // open cursors with their next document: { cursor, doc, key }
+        this.heads = [];
+        this.lastKey = null;
+    }
+
+    // reads the next document of a head, or closes it
+    async advance(head) {
+        head.doc = await head.cursor.next();
+        if (head.doc) {
+            head.key = sortKey(head.doc, this.sort);
+            return;
+        }
+        this.heads.splice(this.heads.indexOf(head), 1);
+        await head.cursor.close();
+    }
+
+    smallest() {
+        return this.heads.reduce((min, head) => (!min || compareKeys(head.key, min.key) < 0 ? head : min), null);
+    }
+
+    async next() {
+        while (true) {
+            // open the sources that can have a document before the smallest one we have
+            let min = this.smallest();
+            while (this.waiting.length > 0 &&
+                (!min || !this.waiting[0].from || compareKeys(this.waiting[0].from, min.key) <= 0)) {
+                const head = { cursor: await this.waiting.shift().open(), doc: null, key: null };
+                this.heads.push(head);
+                await this.advance(head);
+                min = this.smallest();
+            }
+            if (!min) {
+                return null;
+            }
+
+            const doc = min.doc;
+            const key = min.key;
+            await this.advance(min);
+            if (this.lastKey && compareKeys(key, this.lastKey) === 0) {
+                continue;
+            }
+            this.lastKey = key;
+            return doc;
+        }
+    }
+
+    async close() {
+        const heads = this.heads;
+        this.heads = [];
+        this.waiting = [];
+        await Promise.all(heads.map(head => head.cursor.close()));
+    }
+}
+
+/*
+ * ArrayCursor class
+ * A cursor over documents already in memory
+ */
+class ArrayCursor {
+    constructor(docs) {
+        this.docs = docs;
+    }
+
+    async next() {
+        return this.docs.shift() || null;
+    }
+
+    async close() {
+        this.docs = [];
+    }
+}
+
+/*
+ * openArchive function
+ * A cursor over one archive file in sort order. The files are written in _id order
+ * (see retention.js); for another order the matching documents are sorted in memory,
+ * which is only done for the small results of a trace.
+ */
+const openArchive = async (file, filter, sort) => {
+    const cursor = new ArchiveCursor([file], filter);
+    const fields = Object.keys(sort);
+    if (fields.length === 1 && fields[0] === '_id') {
+        return cursor;
+    }
+    const docs = [];
+    for (let doc = await cursor.next(); doc; doc = await cursor.next()) {
+        docs.push(doc);
+    }
+    return new ArrayCursor(docs.sort((a, b) => compareKeys(sortKey(a, sort), sortKey(b, sort))));
+};
+
+/*
+ * fromDay function
+ * The smallest sort key a place with the logs of one day can have:
+ * their time is in the day, and their _id was made at that time or later
+ */
+const fromDay = (day, sort) => Object.keys(sort).map(field => {
+    if (field === 'time') {
+        return day.getTime();
+    }
+    if (field === '_id') {
+        return mongoose.Types.ObjectId.createFromTime(Math.floor(day.getTime() / 1000)).toHexString();
+    }
+    return undefined;
+});
+
+/*
+ * openLogs function
+ * A cursor over the logs that match the filter, in sort order across all the places
+ * options.archive - also read the archive files
+ * options.sort    - the order (default { _id: 1 })
+ */
+const openLogs = async (filter, options) => {
+    const opts = Object.assign({ archive: false, sort: { _id: 1 } }, options);
+    const from = filter.time && filter.time.$gte ? filter.time.$gte : null;
+    const to = filter.time && filter.time.$lt ? filter.time.$lt : null;
+
+    const sources = [];
+    if (opts.archive) {
+        for (const file of await archiveFiles(from, to)) {
+            const day = new Date(ARCHIVE_DAY.exec(file)[1] + 'T00:00:00Z');
+            sources.push({ open: () => openArchive(file, filter, opts.sort), from: fromDay(day, opts.sort) });
+        }
+    }
+    for (const name of await hotCollections(from, to)) {
+        const day = bucketDay(name);
+        sources.push({
+            open: () => mongoose.connection.db.collection(name).find(filter).sort(opts.sort).batchSize(500),
+            from: day ? fromDay(day, opts.sort) : null
+        });
+    }
+    return new MergedCursor(sources, opts.sort);
+};
+
+module.exports = { COLLECTION, bucketDay, logCollections, openLogs };
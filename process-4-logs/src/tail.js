@@ -0,0 +1,318 @@
+/*
+ * Live Log Tail
+ * GET /api/logs/tail sends new logs as Server-Sent Events while they are written,
+ * so a watcher keeps one open connection instead of polling GET /api/logs.
+ *
+ * - one change stream per process on the inserts into the logs collections
+ *   (logs and the daily buckets), shared by every subscriber: a hundred
+ *   watchers use one cursor, not a hundred pool connections
+ * - every subscriber has its own filter (the parameters of GET /api/logs),
+ *   checked here with matches() from archive.js before anything is sent
+ * - the event id is the resume token of the change event, not the _id of the log:
+ *   every service creates the _ids of its logs when its shipper flushes (see
+ *   logger.js), so a log of another service can be inserted later with a smaller
+ *   _id. A client that reconnects with Last-Event-ID (EventSource does it by
+ *   itself) gets the logs it missed from a change stream opened with resumeAfter,
+ *   in the order they were inserted, then the live ones
+ * - every subscriber has a bounded buffer: a client that can not keep up is
+ *   disconnected, and catches up with Last-Event-ID when it reconnects
+ *
+ * Change streams need a replica set (Atlas has one). A client can resume as long
+ * as its token is still in the oplog, else it gets a gap event.
+ *
+ * Configuration (environment variables):
+ * - TAIL_BUFFER_SIZE     - logs waiting for one client before it is disconnected (default 1000)
+ * - TAIL_MAX_SUBSCRIBERS - open tails per process (default 1000)
+ * - TAIL_REPLAY_LIMIT    - most missed changes read after a reconnect (default 10000)
+ * - TAIL_HEARTBEAT_MS    - a comment line for idle connections, so proxies keep them open (default 15000)
+ */
+
+const mongoose = require('mongoose');
+const { matches } = require('./archive');
+const { waitForDrain } = require('cost-manager-shared/stream');
+const { registry } = require('cost-manager-shared/metrics');
+
+const bufferSize = () => parseInt(process.env.TAIL_BUFFER_SIZE || '1000');
+const maxSubscribers = () => parseInt(process.env.TAIL_MAX_SUBSCRIBERS || '1000');
+const replayLimit = () => parseInt(process.env.TAIL_REPLAY_LIMIT || '10000');
+
+// the collections the log shipper writes to (see storage.js)
+const LOG_COLLECTIONS = '^logs(_\\d{8})?$';
+const PIPELINE = [{ $match: { operationType: 'insert', 'ns.coll': { $regex: LOG_COLLECTIONS } } }];
+
+// the SSE id of a change event, and the resumeAfter of an id
+const eventId = (change) => change._id._data;
+const resumeToken = (id) => ({ _data: id });
+
+// a replayed change can still come from the shared stream a moment later
+const REPLAYED_TTL_MS = 30000;
+
+// how many clients were disconnected, by reason
+const disconnects = { slow: 0, error: 0, shutdown: 0 };
+
+/*
+ * Subscriber class
+ * One open tail: its response, its filter and the changes waiting to be written
+ */
+class Subscriber {
+    constructor(res, filter) {
+        this.res = res;
+        this.filter = filter;
+        // waiting changes: { id, doc }
+        this.queue = [];
+        this.writing = false;
+        // live changes wait in the queue until the missed ones are sent
+        this.replaying = false;
+        // event ids sent by the replay, so they are not sent again live
+        this.replayed = null;
+        this.closed = false;
+    }
+
+    // adds a live change if its log matches the filter
+    push(change) {
+        if (this.closed || !matches(change.fullDocument, this.filter)) {
+            return;
+        }
+        this.queue.push({ id: eventId(change), doc: change.fullDocument });
+        if (this.queue.length > bufferSize()) {
+            this.close('slow');
+            return;
+        }
+        this.flush();
+    }
+
+    // writes one log, waits while the socket buffer is full
+    async send(id, doc) {
+        if (!this.res.write('id: ' + id + '\ndata: ' + JSON.stringify(doc) + '\n\n')) {
+            await waitForDrain(this.res);
+        }
+    }
+
+    // writes the waiting logs, one flush at a time
+    async flush() {
+        if (this.writing || this.replaying) {
+            return;
+        }
+        this.writing = true;
+        try {
+            while (this.queue.length > 0 && !this.closed && !this.res.destroyed) {
+                const next = this.queue.shift();
+                if (this.replayed && this.replayed.has(next.id)) {
+                    continue;
+                }
+                await this.send(next.id, next.doc);
+            }
+        } finally {
+            this.writing = false;
+        }
+    }
+
+    /*
+     * replay function
+     * Sends the logs inserted after the change lastId, in insert order,
+     * from a change stream of this subscriber that resumes after lastId.
+     * The shared stream takes over at the first change it queued for us,
+     * or when our stream has nothing more and the shared one is running:
+     * everything after that comes from the shared stream, and the changes
+     * both streams have are only sent once (replayed).
+     */
+    async replay(lastId) {
+        this.replaying = true;
+        this.replayed = new Set();
+        const stream = mongoose.connection.db.watch(PIPELINE, { resumeAfter: resumeToken(lastId) });
+        const limit = replayLimit();
+        let read = 0;
+        try {
+            while (!this.closed && !this.res.destroyed) {
+                const change = await stream.tryNext();
+                if (!change) {
+                    if (hub.ready) {
+                        break;
+                    }
+                    // tryNext does not wait for changes, so wait for the shared stream to start
+                    await hub.whenReady();
+                    continue;
+                }
+                const id = eventId(change);
+                if (this.queue.length > 0 && this.queue[0].id === id) {
+                    break;
+                }
+                if (++read > limit) {
+                    // the client gets the newest logs, it can read the gap from GET /api/logs
+                    this.sendGap({ after: lastId, from: change.fullDocument.time });
+                    break;
+                }
+                if (matches(change.fullDocument, this.filter)) {
+                    this.replayed.add(id);
+                    await this.send(id, change.fullDocument);
+                }
+            }
+        } catch (err) {
+            // the token is not in the oplog anymore (or is not a token)
+            console.error('Log tail resume error:', err.message);
+            this.sendGap({ after: lastId, from: null });
+        } finally {
+            await stream.close().catch(() => {});
+            this.replaying = false;
+        }
+        setTimeout(() => { this.replayed = null; }, REPLAYED_TTL_MS).unref();
+        this.flush();
+    }
+
+    // tells the client that some logs were not sent
+    sendGap(gap) {
+        this.res.write('event: gap\ndata: ' + JSON.stringify(gap) + '\n\n');
+    }
+
+    close(reason) {
+        if (this.closed) {
+            return;
+        }
+        this.closed = true;
+        this.queue = [];
+        if (reason) {
+            disconnects[reason]++;
+        }
+        hub.unsubscribe(this);
+        this.res.end();
+    }
+}
+
+/*
+ * TailHub class
+ * The shared change stream, open while there is at least one subscriber
+ */
+class TailHub {
+    constructor() {
+        this.subscribers = new Set();
+        this.stream = null;
+        // true once the stream started, every change after that reaches the subscribers
+        this.ready = false;
+        // resolves the promise of whenReady
+        this.resolveReady = null;
+        this.readyPromise = null;
+        this.heartbeat = null;
+    }
+
+    // resolves when the stream started, or right away when it is not opening
+    whenReady() {
+        return this.readyPromise || Promise.resolve();
+    }
+
+    setReady() {
+        this.ready = true;
+        if (this.resolveReady) {
+            this.resolveReady();
+            this.resolveReady = null;
+            this.readyPromise = null;
+        }
+    }
+
+    subscribe(subscriber) {
+        this.subscribers.add(subscriber);
+        if (!this.stream) {
+            this.open();
+        }
+    }
+
+    unsubscribe(subscriber) {
+        this.subscribers.delete(subscriber);
+        if (this.subscribers.size === 0) {
+            this.stop();
+        }
+    }
+
+    open() {
+        this.stream = mongoose.connection.db.watch(PIPELINE);
+        this.readyPromise = new Promise(resolve => { this.resolveReady = resolve; });
+        this.stream.on('init', () => this.setReady());
+        this.stream.on('change', change => {
+            this.setReady();
+            this.subscribers.forEach(subscriber => subscriber.push(change));
+        });
+        this.stream.on('error', err => {
+            console.error('Log tail change stream error:', err.message);
+            // clients reconnect with Last-Event-ID and get a new stream
+            this.closeAll('error');
+        });
+
+        this.heartbeat = setInterval(() => {
+            this.subscribers.forEach(subscriber => {
+                if (!subscriber.writing) {
+                    subscriber.res.write(': ping\n\n');
+                }
+            });
+        }, parseInt(process.env.TAIL_HEARTBEAT_MS || '15000'));
+        this.heartbeat.unref();
+    }
+
+    stop() {
+        if (this.stream) {
+            this.stream.close().catch(() => {});
+            this.stream = null;
+        }
+        // wakes the replays that wait, they stop as their subscribers are closed
+        this.setReady();
+        this.ready = false;
+        if (this.heartbeat) {
+            clearInterval(this.heartbeat);
+            this.heartbeat = null;
+        }
+    }
+
+    // ends every tail, the clients reconnect to another worker with Last-Event-ID
+    closeAll(reason) {
+        this.subscribers.forEach(subscriber => subscriber.close(reason));
+        this.stop();
+    }
+}
+
+const hub = new TailHub();
+
+// open tails would keep a graceful shutdown waiting until its timeout (see cluster.js)
+process.on('SIGTERM', () => hub.closeAll('shutdown'));
+process.on('SIGINT', () => hub.closeAll('shutdown'));
+
+registry.gauge('log_tail_subscribers', 'Open live log tails', [], m => m.set([], hub.subscribers.size));
+registry.counter('log_tail_disconnects_total', 'Live log tails ended by the service, by reason', ['reason'],
+    m => Object.keys(disconnects).forEach(reason => m.set([reason], disconnects[reason])));
+
+/*
+ * openTail function
+ * Starts the event stream of GET /api/logs/tail
+ * lastEventId (optional) is the event id of the last log the client got
+ */
+const openTail = async (req, res, filter, lastEventId) => {
+    if (hub.subscribers.size >= maxSubscribers()) {
+        return res.status(503).json({ id: 0, message: "Too many live tails" });
+    }
+
+    res.status(200).set({
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        // nginx would buffer the events
+        'X-Accel-Buffering': 'no'
+    });
+    // how long EventSource waits before it reconnects
+    res.write('retry: 2000\n\n');
+
+    const subscriber = new Subscriber(res, filter);
+    req.on('close', () => subscriber.close());
+    try {
+        hub.subscribe(subscriber);
+        if (lastEventId) {
+            await subscriber.replay(lastEventId);
+        }
+    } catch (err) {
+        console.error('Log tail error:', err.message);
+        subscriber.close('error');
+    }
+};
+
+/*
+ * closeTails function
+ * Ends every tail of this process (used on shutdown)
+ */
+const closeTails = () => hub.closeAll('shutdown');
+
+module.exports = { openTail, closeTails };
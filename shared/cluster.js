@@ -0,0 +1,176 @@
+/*
+ * Cluster Mode and Graceful Shutdown
+ * One node process uses only one core. In cluster mode the primary process
+ * forks workers that all listen on the same port (node shares it between them)
+ * and restarts a worker if it crashes.
+ *
+ * On SIGTERM (or SIGINT) every server stops accepting connections, lets the
+ * requests in flight finish and then runs the cleanup (flush logs, close the DB).
+ *
+ * Configuration (environment variables):
+ * - CLUSTER_WORKERS     - number of workers, 'auto' for one per core (default 0 - no cluster)
+ * - SHUTDOWN_TIMEOUT_MS - how long requests in flight get to finish (default 10000)
+ *
+ * Every worker has its own mongo connection pool (MONGO_POOL_SIZE in db.js),
+ * so the total number of connections is workers * MONGO_POOL_SIZE.
+ */
+
+const cluster = require('cluster');
+const os = require('os');
+
+// a worker that dies faster than this after starting is crashing on startup
+const MIN_UPTIME_MS = 5000;
+const MAX_RESTART_DELAY_MS = 30000;
+
+const shutdownTimeout = () => parseInt(process.env.SHUTDOWN_TIMEOUT_MS || '10000');
+
+/*
+ * workerCount function
+ * Reads CLUSTER_WORKERS, 0 means run without a cluster
+ */
+const workerCount = () => {
+    const value = process.env.CLUSTER_WORKERS;
+    if (value === 'auto') {
+        return os.availableParallelism();
+    }
+    const count = parseInt(value || '0');
+    return Number.isInteger(count) && count > 0 ? count : 0;
+};
+
+/*
+ * onShutdown function
+ * Runs handler once on the first SIGTERM or SIGINT
+ */
+const onShutdown = (handler) => {
+    let called = false;
+    const once = (signal) => {
+        if (!called) {
+            called = true;
+            handler(signal);
+        }
+    };
+    process.on('SIGTERM', once);
+    process.on('SIGINT', once);
+};
+
+/*
+ * runPrimary function
+ * Forks the workers, restarts the ones that crash and stops them all on shutdown
+ */
+const runPrimary = (name, count) => {
+    let stopping = false;
+    // restart delay grows while workers keep crashing right after they start
+    let restartDelay = 0;
+    const startedAt = new Map();
+
+    const fork = () => {
+        const worker = cluster.fork();
+        startedAt.set(worker.id, Date.now());
+    };
+
+    cluster.on('exit', (worker, code, signal) => {
+        const uptime = Date.now() - startedAt.get(worker.id);
+        startedAt.delete(worker.id);
+        if (stopping) {
+            if (Object.keys(cluster.workers).length === 0) {
+                process.exit(0);
+            }
+            return;
+        }
+
+        restartDelay = uptime < MIN_UPTIME_MS
+            ? Math.min(Math.max(restartDelay * 2, 1000), MAX_RESTART_DELAY_MS)
+            : 0;
+        console.error(name + ' worker ' + worker.process.pid + ' died (' + (signal || code) +
+            '), restarting in ' + restartDelay + ' ms');
+        setTimeout(fork, restartDelay);
+    });
+
+    onShutdown(signal => {
+        stopping = true;
+        console.log(name + ' received ' + signal + ', stopping ' + Object.keys(cluster.workers).length + ' workers');
+        if (Object.keys(cluster.workers).length === 0) {
+            process.exit(0);
+        }
+        for (const worker of Object.values(cluster.workers)) {
+            worker.process.kill('SIGTERM');
+        }
+        // the workers have their own timeout, this one is only a safety net
+        setTimeout(() => {
+            console.error(name + ' workers did not stop in time, exiting');
+            process.exit(1);
+        }, shutdownTimeout() + 1000).unref();
+    });
+
+    console.log(name + ' primary ' + process.pid + ' starting ' + count + ' workers');
+    for (let i = 0; i < count; i++) {
+        fork();
+    }
+};
+
+/*
+ * runService function
+ * Calls start() in this process, or in every worker when cluster mode is on
+ */
+const runService = (name, start) => {
+    const count = workerCount();
+    if (count > 0 && cluster.isPrimary) {
+        runPrimary(name, count);
+        return;
+    }
+    start();
+};
+
+/*
+ * closeServer function
+ * Stops accepting connections and resolves when the requests in flight are done
+ */
+const closeServer = (server) => {
+    return new Promise(resolve => {
+        // new requests on kept-alive connections are the last ones on them
+        server.on('request', (req, res) => res.setHeader('Connection', 'close'));
+        server.close(() => resolve());
+        // idle kept-alive connections would keep close() waiting
+        server.closeIdleConnections();
+    });
+};
+
+/*
+ * serveAll function
+ * Starts one HTTP server per entry ({ app, port, onListening }) and closes them
+ * all gracefully on shutdown
+ * cleanup runs after the last request finished (flush logs, close the DB)
+ */
+const serveAll = (entries, cleanup) => {
+    const servers = entries.map(entry => entry.app.listen(entry.port, entry.onListening));
+
+    onShutdown(async signal => {
+        console.log('Received ' + signal + ', closing server');
+        setTimeout(() => {
+            console.error('Requests did not finish in ' + shutdownTimeout() + ' ms, exiting');
+            process.exit(1);
+        }, shutdownTimeout()).unref();
+
+        await Promise.all(servers.map(closeServer));
+        try {
+            if (cleanup) {
+                await cleanup();
+            }
+        } catch (err) {
+            console.error('Shutdown cleanup error:', err);
+        }
+        process.exit(0);
+    });
+
+    return servers;
+};
+
+/*
+ * serve function
+ * Starts the HTTP server of one app, see serveAll
+ */
+const serve = (app, port, onListening, cleanup) => {
+    return serveAll([{ app: app, port: port, onListening: onListening }], cleanup)[0];
+};
+
+module.exports = { runService, serve, serveAll };
@@ -0,0 +1,185 @@
+/*
+ * Response Compression Middleware
+ * Compresses responses with brotli or gzip, whichever the client accepts
+ * (brotli first, it is smaller). Uses only node's built in zlib.
+ *
+ * Configuration (environment variables):
+ * - COMPRESS_THRESHOLD - responses smaller than this many bytes are sent as is (default 1024)
+ *
+ * Streamed responses (no Content-Length) are always compressed. The compressor is
+ * piped to the socket, so it only reads while the socket takes more. res.write
+ * returns false while the compressor is full, and writers wait for the 'drain'
+ * of res.compressor (see waitForDrain in stream.js), never a 'drain' of res.
+ *
+ * A compressed body is another representation with its own ETag: the encoding
+ * is added to the ETag express set ("abc" becomes "abc-br"), so a shared cache
+ * never answers a gzip request with a 304 for the br body. If-None-Match is
+ * read back without the suffix, so express still compares its own ETag.
+ */
+
+const { pipeline, Writable } = require('stream');
+const zlib = require('zlib');
+
+// only text formats are worth compressing
+const COMPRESSIBLE = /json|text|javascript|ndjson/i;
+
+// server-sent events must reach the client one by one, zlib would hold them back
+const NOT_COMPRESSED = /event-stream/i;
+
+/*
+ * negotiate function
+ * Picks br or gzip from the Accept-Encoding header, or null for none
+ */
+const negotiate = (header) => {
+    if (!header) {
+        return null;
+    }
+    const accepted = {};
+    header.split(',').forEach(part => {
+        const [name, ...params] = part.trim().toLowerCase().split(';');
+        const q = params.map(p => p.trim()).find(p => p.startsWith('q='));
+        accepted[name] = q ? parseFloat(q.slice(2)) : 1;
+    });
+    const ok = (name) => (accepted[name] !== undefined ? accepted[name] : accepted['*'] || 0) > 0;
+    if (ok('br')) {
+        return 'br';
+    }
+    if (ok('gzip')) {
+        return 'gzip';
+    }
+    return null;
+};
+
+// the ETag of the body compressed with encoding, weak ETags stay weak
+const encodedTag = (etag, encoding) => String(etag).replace(/"$/, '-' + encoding + '"');
+
+const createStream = (encoding) => {
+    if (encoding === 'br') {
+        // quality 4 is much faster than the default 11 and still smaller than gzip
+        return zlib.createBrotliCompress({
+            params: { [zlib.constants.BROTLI_PARAM_QUALITY]: 4 }
+        });
+    }
+    return zlib.createGzip();
+};
+
+const compress = () => {
+    const threshold = parseInt(process.env.COMPRESS_THRESHOLD || '1024');
+
+    return (req, res, next) => {
+        const encoding = negotiate(req.headers['accept-encoding']);
+        res.vary('Accept-Encoding');
+        if (!encoding || req.method === 'HEAD') {
+            return next();
+        }
+
+        // validators of our compressed bodies, compared by express without the encoding
+        const ifNoneMatch = req.headers['if-none-match'];
+        const suffix = '-' + encoding + '"';
+        const conditional = Boolean(ifNoneMatch && ifNoneMatch.includes(suffix));
+        if (conditional) {
+            req.headers['if-none-match'] = ifNoneMatch.split(suffix).join('"');
+        }
+
+        const write = res.write;
+        const end = res.end;
+        let stream = null;
+        let decided = false;
+
+        // decide once, right before the headers are sent
+        const decide = (length) => {
+            decided = true;
+            const type = res.getHeader('Content-Type') || '';
+            const etag = res.getHeader('ETag');
+            // a 304 for a compressed body has the ETag of that body
+            if (res.statusCode === 304 && conditional && etag) {
+                res.setHeader('ETag', encodedTag(etag, encoding));
+            }
+            if (res.statusCode === 204 || res.statusCode === 304 ||
+                res.getHeader('Content-Encoding') ||
+                !COMPRESSIBLE.test(type) ||
+                NOT_COMPRESSED.test(type) ||
+                (length !== null && length < threshold)) {
+                return;
+            }
+
+            stream = createStream(encoding);
+            res.setHeader('Content-Encoding', encoding);
+            res.removeHeader('Content-Length');
+            if (etag) {
+                res.setHeader('ETag', encodedTag(etag, encoding));
+            }
+
+            // sends the compressed bytes with the write and end of the response
+            const socket = new Writable({
+                write(chunk, chunkEncoding, callback) {
+                    if (write.call(res, chunk)) {
+                        return callback();
+                    }
+                    res.once('drain', () => callback());
+                },
+                final(callback) {
+                    end.call(res);
+                    callback();
+                }
+            });
+            pipeline(stream, socket, err => {
+                if (err && !res.destroyed) {
+                    res.destroy(err);
+                }
+            });
+            // a client that is gone stops the compressor and the pipeline with it
+            res.on('close', () => stream.destroy());
+            res.compressor = stream;
+        };
+
+        const knownLength = (chunk, chunkEncoding) => {
+            const header = res.getHeader('Content-Length');
+            if (header !== undefined) {
+                return parseInt(header);
+            }
+            return chunk ? Buffer.byteLength(chunk, chunkEncoding) : 0;
+        };
+
+        res.write = function (chunk, chunkEncoding, callback) {
+            if (!decided) {
+                // a write without Content-Length is a stream - size unknown
+                const header = res.getHeader('Content-Length');
+                decide(header !== undefined ? parseInt(header) : null);
+            }
+            if (!stream) {
+                return write.call(res, chunk, chunkEncoding, callback);
+            }
+            return stream.write(chunk, chunkEncoding, callback);
+        };
+
+        res.end = function (chunk, chunkEncoding, callback) {
+            if (typeof chunk === 'function') {
+                callback = chunk;
+                chunk = null;
+            } else if (typeof chunkEncoding === 'function') {
+                callback = chunkEncoding;
+                chunkEncoding = undefined;
+            }
+            if (!decided) {
+                decide(knownLength(chunk, chunkEncoding));
+            }
+            if (!stream) {
+                return end.call(res, chunk, chunkEncoding, callback);
+            }
+            if (callback) {
+                res.once('finish', callback);
+            }
+            if (chunk) {
+                stream.end(chunk, chunkEncoding);
+            } else {
+                stream.end();
+            }
+            return res;
+        };
+
+        next();
+    };
+};
+
+module.exports = { compress, negotiate };
@@ -0,0 +1,81 @@
+/*
+ * Database Connection and Logger Configuration
+ * This file sets up the connection to MongoDB and configures pino logger
+ * Every service of a process uses the same connection and log shipper,
+ * with its own logger (createLogger)
+ */
+
+const mongoose = require('mongoose');
+const pino = require('pino');
+const { createShipper } = require('./logger');
+const { registry, watchMongo } = require('./metrics');
+const { traceMongo } = require('./tracing');
+
+// load environment variables from .env file
+require('dotenv').config();
+
+/*
+ * connectDB function
+ * Connects to MongoDB Atlas using the URI from .env file
+ * We use async/await because connecting to database takes time
+ */
+const connectDB = async () => {
+    // every process (and every cluster worker) has its own pool, keep it bounded
+    const maxPoolSize = parseInt(process.env.MONGO_POOL_SIZE || '10');
+
+    // time the commands and follow the pool for /metrics (see metrics.js),
+    // and add the commands of traced requests to their spans (see tracing.js)
+    // 'connected' comes before the first command, so no pool event is missed
+    mongoose.connection.on('connected', () => {
+        const client = mongoose.connection.getClient();
+        watchMongo(client, maxPoolSize);
+        traceMongo(client);
+    });
+    try {
+        await mongoose.connect(process.env.MONGO_URI, {
+            maxPoolSize: maxPoolSize,
+            monitorCommands: true
+        });
+        console.log('MongoDB Connected');
+    } catch (err) {
+        console.error('MongoDB error:', err);
+    }
+};
+
+/*
+ * Pino Logger Configuration
+ * All logs go to the 'logs' collection in our database
+ * This is required by the project specifications
+ * pino writes into the log shipper, which saves the logs in batches
+ * with insertMany (see logger.js for the settings)
+ */
+const logShipper = createShipper('logs');
+
+registry.counter('log_records_total', 'Log records written, saved and dropped', ['state'], m => {
+    const stats = logShipper.stats();
+    ['written', 'flushed', 'dropped'].forEach(state => m.set([state], stats[state]));
+});
+registry.gauge('log_buffer_records', 'Log records waiting to be saved', [],
+    m => m.set([], logShipper.stats().buffered));
+
+/*
+ * createLogger function
+ * The pino logger of a service, name is the name from its package.json
+ */
+const createLogger = (name) => pino({
+    // name is saved in every log line so the logs service can filter by service
+    name: name,
+    level: process.env.LOG_LEVEL || 'info'
+}, logShipper);
+
+/*
+ * closeDB function
+ * Saves the logs that are still waiting and closes the connection (used on shutdown)
+ */
+const closeDB = async () => {
+    await logShipper.close();
+    await mongoose.disconnect();
+};
+
+// export them so we can use them in app.js
+module.exports = { connectDB, closeDB, createLogger, logShipper };
@@ -0,0 +1,42 @@
+/*
+ * HTTP Caching Helpers
+ * Strong ETags and Cache-Control values for our responses
+ *
+ * When the client sends If-None-Match with the same ETag,
+ * express answers 304 Not Modified without a body (res.send checks req.fresh)
+ */
+
+const crypto = require('crypto');
+
+// for responses that never change - clients and CDNs can keep them forever
+const IMMUTABLE = 'public, max-age=31536000, immutable';
+
+// for responses that rarely change - clients keep them 5 minutes, then check the ETag
+// private: they are per-user data, shared proxies and CDNs must not store them
+const SHORT_TTL = 'private, max-age=300';
+
+// for responses that can change - always ask the server, but 304 is enough
+const REVALIDATE = 'no-cache';
+
+/*
+ * encode function
+ * Serializes a value once and returns the JSON body with its strong ETag
+ * serialize turns the value into JSON (default JSON.stringify)
+ */
+const encode = (value, serialize = JSON.stringify) => {
+    const body = serialize(value);
+    const etag = '"' + crypto.createHash('sha1').update(body).digest('base64url') + '"';
+    return { body, etag };
+};
+
+/*
+ * sendEncoded function
+ * Sends a body from encode() with its ETag and Cache-Control
+ */
+const sendEncoded = (res, encoded, cacheControl) => {
+    res.set('ETag', encoded.etag);
+    res.set('Cache-Control', cacheControl);
+    res.type('application/json').send(encoded.body);
+};
+
+module.exports = { IMMUTABLE, SHORT_TTL, REVALIDATE, encode, sendEncoded };
@@ -0,0 +1,313 @@
+/*
+ * Log Shipping
+ * Instead of writing every log line to MongoDB on its own,
+ * pino writes into a memory buffer and we save the buffer with insertMany
+ * when it has LOG_BATCH_SIZE records or every LOG_FLUSH_MS milliseconds.
+ *
+ * Configuration (environment variables):
+ * - LOG_LEVEL       - lowest pino level that is logged (default info)
+ * - LOG_BATCH_SIZE  - flush when this many records are waiting (default 500)
+ * - LOG_FLUSH_MS    - flush at least this often (default 1000)
+ * - LOG_BUFFER_MAX  - most records we keep in memory (default 10000)
+ * - LOG_OVERFLOW    - what to do when the buffer is full:
+ *                     drop-newest (default), drop-oldest,
+ *                     or block - request logs wait until there is room
+ * - LOG_BLOCK_TIMEOUT_MS - with block, the longest a request waits for room (default 1000),
+ *                     after that its logs are dropped like drop-newest, so a log
+ *                     database that is down does not stop the service
+ * - LOG_SAMPLE_RATE - part of the requests that are logged, 0 to 1 (default 1)
+ * - LOG_ROUTES      - per route settings as JSON, matched by path prefix, like
+ *                     {"/api/logs": {"sample": 0.1, "level": "debug"}}
+ * - LOG_BUCKETS     - 'daily' saves the logs of every UTC day in their own collection
+ *                     (logs_20260131), so the logs service can drop old days at once
+ *                     (default off - everything goes to the logs collection)
+ *
+ * Every logged request has two lines: one when it comes in and one when it is
+ * done, with the status, the duration and the timing spans (see tracing.js).
+ */
+
+const mongoose = require('mongoose');
+const { Trace, requestId, runTraced, runUntraced } = require('./tracing');
+
+/*
+ * LogShipper class
+ * A pino destination - pino calls write() with one JSON line per log
+ */
+class LogShipper {
+    constructor(options) {
+        this.collection = options.collection;
+        this.batchSize = options.batchSize;
+        this.bufferMax = options.bufferMax;
+        this.overflow = options.overflow;
+        this.blockTimeoutMs = options.blockTimeoutMs;
+        this.buckets = options.buckets;
+        this.buffer = [];
+        this.flushing = false;
+        // callbacks of requests waiting for room in the buffer (block policy)
+        this.waiting = [];
+        // counters so we can see what happens to the logs
+        this.counters = { written: 0, flushed: 0, dropped: 0, flushErrors: 0, blockTimeouts: 0 };
+
+        // the timer should not keep the process alive by itself
+        this.timer = setInterval(() => this.flush(), options.flushMs);
+        this.timer.unref();
+    }
+
+    write(line) {
+        if (this.buffer.length >= this.bufferMax) {
+            if (this.overflow === 'drop-oldest') {
+                this.buffer.shift();
+                this.counters.dropped++;
+            } else {
+                // drop-newest, and block for logs that did not wait for room
+                this.counters.dropped++;
+                return true;
+            }
+        }
+        this.buffer.push(line);
+        this.counters.written++;
+        if (this.buffer.length >= this.batchSize) {
+            // the flush is not part of the request that happened to fill the batch
+            runUntraced(() => setImmediate(() => this.flush()));
+        }
+        return true;
+    }
+
+    isFull() {
+        return this.buffer.length >= this.bufferMax;
+    }
+
+    /*
+     * whenRoom function
+     * Resolves when the buffer has room again, or after blockTimeoutMs
+     * (used by the block policy). flush does nothing while mongo is not
+     * connected, so without the timeout every request would wait for it
+     */
+    whenRoom() {
+        if (!this.isFull()) {
+            return Promise.resolve();
+        }
+        return new Promise(resolve => {
+            const timer = setTimeout(() => {
+                this.waiting.splice(this.waiting.indexOf(done), 1);
+                // the logs of the request are dropped by write, like drop-newest
+                this.counters.blockTimeouts++;
+                resolve();
+            }, this.blockTimeoutMs);
+            const done = () => {
+                clearTimeout(timer);
+                resolve();
+            };
+            this.waiting.push(done);
+        });
+    }
+
+    async flush() {
+        // one flush at a time, and wait for the database connection
+        if (this.flushing || this.buffer.length === 0 || mongoose.connection.readyState !== 1) {
+            return;
+        }
+        this.flushing = true;
+        const lines = this.buffer.splice(0, this.batchSize);
+        try {
+            // with daily buckets a batch can go over midnight, so we group by collection
+            const groups = new Map();
+            for (const doc of lines.map(toDocument)) {
+                const name = this.buckets ? bucketName(this.collection, doc.time || new Date()) : this.collection;
+                if (!groups.has(name)) {
+                    groups.set(name, []);
+                }
+                groups.get(name).push(doc);
+            }
+            for (const [name, docs] of groups) {
+                await mongoose.connection.db.collection(name).insertMany(docs, { ordered: false });
+            }
+            this.counters.flushed += lines.length;
+        } catch (err) {
+            // we dont retry so the buffer stays bounded
+            this.counters.flushErrors++;
+            this.counters.dropped += lines.length;
+            console.error('Log flush error:', err.message);
+        } finally {
+            this.flushing = false;
+        }
+
+        // let waiting requests continue now that there is room
+        while (this.waiting.length > 0 && !this.isFull()) {
+            this.waiting.shift()();
+        }
+        // more than a full batch is waiting - keep going
+        if (this.buffer.length >= this.batchSize) {
+            setImmediate(() => this.flush());
+        }
+    }
+
+    /*
+     * close function
+     * Saves everything still in the buffer (used on shutdown)
+     */
+    async close() {
+        clearInterval(this.timer);
+        while (this.buffer.length > 0 && mongoose.connection.readyState === 1) {
+            if (this.flushing) {
+                await new Promise(resolve => setTimeout(resolve, 10));
+            } else {
+                await this.flush();
+            }
+        }
+    }
+
+    stats() {
+        return Object.assign({ buffered: this.buffer.length, waiting: this.waiting.length }, this.counters);
+    }
+}
+
+/*
+ * bucketName function
+ * The collection of the logs of one UTC day, like logs_20260131
+ */
+const bucketName = (collection, time) => {
+    return collection + '_' + time.toISOString().slice(0, 10).replace(/-/g, '');
+};
+
+/*
+ * toDocument function
+ * Turns one pino JSON line into the document we save
+ * time is saved as a Date, like pino-mongodb saved the older logs
+ */
+const toDocument = (line) => {
+    try {
+        const doc = JSON.parse(line);
+        if (doc.time) {
+            doc.time = new Date(doc.time);
+        }
+        if (doc.time && isNaN(doc.time.getTime())) {
+            delete doc.time;
+        }
+        return doc;
+    } catch (err) {
+        return { msg: line };
+    }
+};
+
+/*
+ * parseRoutes function
+ * Reads LOG_ROUTES and returns [{ prefix, sample, level }],
+ * longest prefix first so the most specific route wins
+ */
+const parseRoutes = (json) => {
+    if (!json) {
+        return [];
+    }
+    try {
+        const routes = JSON.parse(json);
+        return Object.keys(routes)
+            .map(prefix => Object.assign({ prefix: prefix }, routes[prefix]))
+            .sort((a, b) => b.prefix.length - a.prefix.length);
+    } catch (err) {
+        console.error('Invalid LOG_ROUTES:', err.message);
+        return [];
+    }
+};
+
+/*
+ * traceResponse function
+ * Adds the response span (headers until the last byte) and writes the done line
+ */
+const traceResponse = (logger, level, message, trace, req, res) => {
+    let responseStart = null;
+    const writeHead = res.writeHead;
+    res.writeHead = function () {
+        responseStart = trace.elapsed();
+        return writeHead.apply(this, arguments);
+    };
+
+    // close also comes when the client went away before the response was done
+    res.on('close', () => {
+        const duration = trace.elapsed();
+        if (responseStart !== null) {
+            trace.addSpan('response', 'response', responseStart, duration - responseStart);
+        }
+        const fields = {
+            request_id: trace.id,
+            method: req.method,
+            url: req.originalUrl,
+            status: res.statusCode,
+            duration_ms: Math.round(duration * 1000) / 1000,
+            spans: trace.spans
+        };
+        if (!res.writableFinished) {
+            fields.aborted = true;
+        }
+        if (trace.droppedSpans > 0) {
+            fields.dropped_spans = trace.droppedSpans;
+        }
+        logger[level](fields, message + ' Done');
+    });
+};
+
+/*
+ * requestLogger function
+ * Returns the express middleware that logs every request
+ * It decides per route if the request is sampled and in which level it is logged
+ * Every request gets a request id (X-Request-Id), logged requests are also traced
+ */
+const requestLogger = (logger, shipper, message) => {
+    const defaultSample = parseFloat(process.env.LOG_SAMPLE_RATE || '1');
+    const routes = parseRoutes(process.env.LOG_ROUTES);
+
+    return (req, res, next) => {
+        const id = requestId(req);
+        req.id = id;
+        res.setHeader('X-Request-Id', id);
+
+        const route = routes.find(r => req.path.startsWith(r.prefix)) || {};
+        const sample = route.sample !== undefined ? route.sample : defaultSample;
+        const level = route.level || 'info';
+
+        // skip requests that are not sampled or below the logger level
+        if ((sample < 1 && Math.random() >= sample) || !logger.isLevelEnabled(level)) {
+            return next();
+        }
+
+        const trace = new Trace(id);
+        const log = () => logger[level]({ request_id: id, method: req.method, url: req.originalUrl }, message);
+        traceResponse(logger, level, message, trace, req, res);
+
+        // block policy - wait until the logs are saved before handling the request
+        if (shipper.overflow === 'block' && shipper.isFull()) {
+            return shipper.whenRoom().then(() => {
+                log();
+                runTraced(trace, next);
+            });
+        }
+        log();
+        runTraced(trace, next);
+    };
+};
+
+// shippers of this process by collection - shared by every service of the
+// process, so in the combined launcher all services write through one shipper
+const shippers = new Map();
+
+/*
+ * createShipper function
+ * Creates the log shipper with the settings from the environment,
+ * or returns the one this process already has for the collection
+ */
+const createShipper = (collection) => {
+    if (!shippers.has(collection)) {
+        shippers.set(collection, new LogShipper({
+            collection: collection,
+            batchSize: parseInt(process.env.LOG_BATCH_SIZE || '500'),
+            flushMs: parseInt(process.env.LOG_FLUSH_MS || '1000'),
+            bufferMax: parseInt(process.env.LOG_BUFFER_MAX || '10000'),
+            overflow: process.env.LOG_OVERFLOW || 'drop-newest',
+            blockTimeoutMs: parseInt(process.env.LOG_BLOCK_TIMEOUT_MS || '1000'),
+            buckets: process.env.LOG_BUCKETS === 'daily'
+        }));
+    }
+    return shippers.get(collection);
+};
+
+module.exports = { LogShipper, bucketName, createShipper, requestLogger };
@@ -0,0 +1,288 @@
+/*
+ * Metrics
+ * Counters, gauges and histograms in the Prometheus text format, served on GET /metrics.
+ * Recording is only a Map lookup and a few additions, the text is built on scrape,
+ * so the metrics can stay on under production load.
+ *
+ * What we measure:
+ * - http_requests_total / http_request_duration_seconds - per service, method, route and status
+ * - mongodb_command_duration_seconds - per collection and command (driver command events)
+ * - mongodb_pool_* - connections in use, waiting for a connection and the pool size
+ * - nodejs_eventloop_lag_seconds - event loop delay since the last scrape
+ * - heap, memory and cpu of the process
+ *
+ * All services of one process share this module and so one registry
+ * (like the log shipper), the combined launcher reports every metric once.
+ */
+
+const { monitorEventLoopDelay } = require('perf_hooks');
+const { commandCollection } = require('./tracing');
+
+const HTTP_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10];
+const MONGO_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5];
+
+const escapeLabel = (value) => String(value).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+
+// {a="1",b="2"} from label names and values, '' without labels
+const formatLabels = (names, values, extra) => {
+    const parts = names.map((name, i) => name + '="' + escapeLabel(values[i]) + '"');
+    if (extra) {
+        parts.push(extra);
+    }
+    return parts.length ? '{' + parts.join(',') + '}' : '';
+};
+
+/*
+ * Metric class
+ * One value per label set, used for counters and gauges
+ * collect (optional) runs before every scrape to set the current values
+ */
+class Metric {
+    constructor(type, name, help, labelNames, collect) {
+        this.type = type;
+        this.name = name;
+        this.help = help;
+        this.labelNames = labelNames || [];
+        this.collect = collect;
+        this.values = new Map();
+    }
+
+    // values are kept by the label values joined into one string key
+    entry(labelValues) {
+        const key = labelValues.join('\u0000');
+        let entry = this.values.get(key);
+        if (!entry) {
+            entry = { labels: labelValues.slice(), value: 0 };
+            this.values.set(key, entry);
+        }
+        return entry;
+    }
+
+    inc(labelValues, amount) {
+        this.entry(labelValues || []).value += amount === undefined ? 1 : amount;
+    }
+
+    set(labelValues, value) {
+        this.entry(labelValues || []).value = value;
+    }
+
+    render() {
+        const lines = [];
+        for (const entry of this.values.values()) {
+            lines.push(this.name + formatLabels(this.labelNames, entry.labels) + ' ' + entry.value);
+        }
+        return lines;
+    }
+}
+
+/*
+ * Histogram class
+ * Counts observations per bucket (upper bounds in seconds)
+ */
+class Histogram extends Metric {
+    constructor(name, help, labelNames, buckets) {
+        super('histogram', name, help, labelNames);
+        this.buckets = buckets;
+    }
+
+    observe(labelValues, seconds) {
+        const key = labelValues.join('\u0000');
+        let entry = this.values.get(key);
+        if (!entry) {
+            entry = { labels: labelValues.slice(), counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+            this.values.set(key, entry);
+        }
+        // counts per bucket are not cumulative here, render adds them up
+        let i = 0;
+        while (i < this.buckets.length && seconds > this.buckets[i]) {
+            i++;
+        }
+        if (i < this.buckets.length) {
+            entry.counts[i]++;
+        }
+        entry.sum += seconds;
+        entry.count++;
+    }
+
+    render() {
+        const lines = [];
+        for (const entry of this.values.values()) {
+            let cumulative = 0;
+            this.buckets.forEach((bound, i) => {
+                cumulative += entry.counts[i];
+                lines.push(this.name + '_bucket' +
+                    formatLabels(this.labelNames, entry.labels, 'le="' + bound + '"') + ' ' + cumulative);
+            });
+            const labels = formatLabels(this.labelNames, entry.labels);
+            lines.push(this.name + '_bucket' + formatLabels(this.labelNames, entry.labels, 'le="+Inf"') + ' ' + entry.count);
+            lines.push(this.name + '_sum' + labels + ' ' + entry.sum);
+            lines.push(this.name + '_count' + labels + ' ' + entry.count);
+        }
+        return lines;
+    }
+}
+
+/*
+ * Registry class
+ * Creating a metric that already exists returns the existing one,
+ * so every service can register what it needs without checking
+ */
+class Registry {
+    constructor() {
+        this.metrics = new Map();
+        // mongo clients we already listen to (see watchMongo)
+        this.clients = new WeakSet();
+    }
+
+    add(metric) {
+        if (!this.metrics.has(metric.name)) {
+            this.metrics.set(metric.name, metric);
+        }
+        return this.metrics.get(metric.name);
+    }
+
+    counter(name, help, labelNames, collect) {
+        return this.add(new Metric('counter', name, help, labelNames, collect));
+    }
+
+    gauge(name, help, labelNames, collect) {
+        return this.add(new Metric('gauge', name, help, labelNames, collect));
+    }
+
+    histogram(name, help, labelNames, buckets) {
+        return this.add(new Histogram(name, help, labelNames, buckets));
+    }
+
+    render() {
+        const lines = [];
+        for (const metric of this.metrics.values()) {
+            if (metric.collect) {
+                metric.collect(metric);
+            }
+            lines.push('# HELP ' + metric.name + ' ' + metric.help);
+            lines.push('# TYPE ' + metric.name + ' ' + metric.type);
+            lines.push(...metric.render());
+        }
+        return lines.join('\n') + '\n';
+    }
+}
+
+/*
+ * createRegistry function
+ * A new registry with the metrics of the node process
+ */
+const createRegistry = () => {
+    const registry = new Registry();
+
+    // event loop delay, sampled every 20 ms by node itself
+    const loopDelay = monitorEventLoopDelay({ resolution: 20 });
+    loopDelay.enable();
+    registry.gauge('nodejs_eventloop_lag_seconds', 'Event loop delay since the last scrape', ['quantile'], m => {
+        m.set(['0.5'], loopDelay.percentile(50) / 1e9);
+        m.set(['0.99'], loopDelay.percentile(99) / 1e9);
+        m.set(['1'], loopDelay.max / 1e9);
+        loopDelay.reset();
+    });
+
+    registry.gauge('nodejs_heap_bytes', 'V8 heap size and the part in use', ['state'], m => {
+        const memory = process.memoryUsage();
+        m.set(['used'], memory.heapUsed);
+        m.set(['total'], memory.heapTotal);
+    });
+    registry.gauge('process_resident_memory_bytes', 'Resident memory of the process', [],
+        m => m.set([], process.memoryUsage.rss()));
+    registry.counter('process_cpu_seconds_total', 'User and system CPU time of the process', [], m => {
+        const usage = process.cpuUsage();
+        m.set([], (usage.user + usage.system) / 1e6);
+    });
+
+    return registry;
+};
+
+// one registry per process, every service of the process requires this module
+const registry = createRegistry();
+
+const httpRequests = registry.counter('http_requests_total',
+    'HTTP requests by service, method, route and status', ['service', 'method', 'route', 'status']);
+const httpDuration = registry.histogram('http_request_duration_seconds',
+    'HTTP request duration in seconds', ['service', 'method', 'route'], HTTP_BUCKETS);
+
+/*
+ * httpMetrics function
+ * Middleware that counts and times every request of the service
+ * The route is the express route pattern (/api/users/:id), not the url,
+ * so the number of label values stays small
+ */
+const httpMetrics = (service) => {
+    return (req, res, next) => {
+        const start = process.hrtime.bigint();
+        res.on('finish', () => {
+            const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+            const route = req.route ? req.baseUrl + req.route.path : 'unmatched';
+            httpRequests.inc([service, req.method, route, res.statusCode]);
+            httpDuration.observe([service, req.method, route], seconds);
+        });
+        next();
+    };
+};
+
+/*
+ * watchMongo function
+ * Times every command and follows the connection pool of a MongoClient
+ * Needs monitorCommands: true in the connect options (see db.js)
+ */
+const watchMongo = (client, maxPoolSize) => {
+    if (registry.clients.has(client)) {
+        return;
+    }
+    registry.clients.add(client);
+
+    const commandDuration = registry.histogram('mongodb_command_duration_seconds',
+        'MongoDB command duration in seconds', ['collection', 'command'], MONGO_BUCKETS);
+    const commandFailures = registry.counter('mongodb_command_failures_total',
+        'MongoDB commands that failed', ['collection', 'command']);
+
+    // the collection is only in the started event, keep it until the command ends
+    const started = new Map();
+    client.on('commandStarted', event => started.set(event.requestId, commandCollection(event)));
+    const finished = (failed) => (event) => {
+        const collection = started.get(event.requestId) || '';
+        started.delete(event.requestId);
+        commandDuration.observe([collection, event.commandName], event.duration / 1000);
+        if (failed) {
+            commandFailures.inc([collection, event.commandName]);
+        }
+    };
+    client.on('commandSucceeded', finished(false));
+    client.on('commandFailed', finished(true));
+
+    const pool = { open: 0, inUse: 0, waiting: 0 };
+    client.on('connectionCreated', () => pool.open++);
+    client.on('connectionClosed', () => { pool.open = Math.max(0, pool.open - 1); });
+    client.on('connectionCheckOutStarted', () => pool.waiting++);
+    client.on('connectionCheckOutFailed', () => { pool.waiting = Math.max(0, pool.waiting - 1); });
+    client.on('connectionCheckedOut', () => {
+        pool.waiting = Math.max(0, pool.waiting - 1);
+        pool.inUse++;
+    });
+    client.on('connectionCheckedIn', () => { pool.inUse = Math.max(0, pool.inUse - 1); });
+
+    registry.gauge('mongodb_pool_connections', 'Open connections in the MongoDB pool', [],
+        m => m.set([], pool.open));
+    registry.gauge('mongodb_pool_in_use', 'Pool connections used by an operation right now', [],
+        m => m.set([], pool.inUse));
+    registry.gauge('mongodb_pool_waiting', 'Operations waiting for a pool connection', [],
+        m => m.set([], pool.waiting));
+    registry.gauge('mongodb_pool_max_size', 'Maximum size of the MongoDB pool', [],
+        m => m.set([], maxPoolSize));
+};
+
+/*
+ * metricsHandler function
+ * GET /metrics in the Prometheus text format
+ */
+const metricsHandler = (req, res) => {
+    res.type('text/plain; version=0.0.4').send(registry.render());
+};
+
+module.exports = { registry, httpMetrics, watchMongo, metricsHandler };
@@ -40,4 +40,14 @@ const costSchema = new mongoose.Schema({
     timestamps: true  // automatically adds createdAt and updatedAt
 });
 
+/*
+ * Compound index for the monthly report query and the cost history
+ * The report looks up one user's costs inside a createdAt range,
+ * so with this index mongo jumps straight to that user and month
+ * instead of scanning all the costs.
+ * _id makes the order unique, the history pages by (createdAt, _id) with it.
+ * It replaces the old { userid, createdAt } index, which can be dropped.
+ */
+costSchema.index({ userid: 1, createdAt: 1, _id: 1 });
+
 module.exports = mongoose.model('Cost', costSchema, 'costs');
@@ -0,0 +1,26 @@
+/*
+ * Total Model
+ * Keeps a running total of all the costs of each user
+ * Every time a cost is added we increase the total with $inc,
+ * so the users service can read the total without summing all the costs
+ * (the costs service updates it, the users service only reads it)
+ */
+
+const mongoose = require('mongoose');
+
+const totalSchema = new mongoose.Schema({
+    // the user id this total belongs to (our custom id, not _id)
+    userid: {
+        type: Number,
+        required: true,
+        unique: true  // only one total document per user
+    },
+    // sum of all the costs of this user
+    total: {
+        type: Number,
+        default: 0
+    }
+});
+
+// 'totals' is the collection name in MongoDB
+module.exports = mongoose.model('Total', totalSchema, 'totals');
@@ -2,6 +2,7 @@
  * User Model
  * Defines the schema for users in MongoDB
  * This tells mongoose what fields a user document should have
+ * The users service creates users, the costs service checks that a user exists
  */
 
 const mongoose = require('mongoose');
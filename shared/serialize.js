@@ -0,0 +1,58 @@
+/*
+ * Schema Serializers
+ * Our responses always have the same fields, so instead of res.json
+ * (which calls the mongoose toJSON of the document and then walks every value)
+ * we compile a serializer once per shape that writes only the known fields.
+ *
+ * Field types:
+ * - 'string', 'number', 'date' (ISO string like JSON.stringify), 'id' (ObjectId)
+ * - a function - a serializer for a nested value (from compile or compileArray)
+ * Fields that are undefined are skipped, like JSON.stringify does.
+ */
+
+const writers = {
+    string: v => JSON.stringify(String(v)),
+    number: v => (Number.isFinite(v) ? String(v) : 'null'),
+    date: v => {
+        const date = v instanceof Date ? v : new Date(v);
+        return isNaN(date.getTime()) ? 'null' : '"' + date.toISOString() + '"';
+    },
+    id: v => '"' + String(v) + '"'
+};
+
+/*
+ * compile function
+ * Returns a function that turns an object with these fields into a JSON string
+ */
+const compile = (schema) => {
+    const fields = Object.keys(schema).map(name => ({
+        name: name,
+        key: JSON.stringify(name) + ':',
+        write: typeof schema[name] === 'function' ? schema[name] : writers[schema[name]]
+    }));
+
+    return (obj) => {
+        let out = '{';
+        for (let i = 0; i < fields.length; i++) {
+            const field = fields[i];
+            const value = obj[field.name];
+            if (value === undefined) {
+                continue;
+            }
+            if (out.length > 1) {
+                out += ',';
+            }
+            out += field.key + (value === null ? 'null' : field.write(value));
+        }
+        return out + '}';
+    };
+};
+
+/*
+ * compileArray function
+ * Returns a function that turns an array of items into a JSON string
+ */
+const compileArray = (itemSerializer) => {
+    return (items) => '[' + items.map(itemSerializer).join(',') + ']';
+};
+module.exports = { compile, compileArray };
@@ -0,0 +1,86 @@
+/*
+ * Streaming Helpers
+ * Sends the documents of a mongoose cursor one by one to the client
+ * instead of loading all of them into memory and calling res.json
+ *
+ * Two formats are supported:
+ * - 'json'   - a normal JSON array, written in chunks: [doc,doc,...]
+ * - 'ndjson' - one JSON document per line
+ */
+
+/*
+ * waitForDrain function
+ * res.write returns false when the socket buffer is full (or the compressor,
+ * res.compressor, see compress.js). Then we wait until it is empty again (drain)
+ * or the client is gone (close), so a slow client never makes us hold the whole
+ * result in memory
+ */
+const waitForDrain = (res) => {
+    const target = res.compressor || res;
+    return new Promise(resolve => {
+        const done = () => {
+            target.off('drain', done);
+            res.off('close', done);
+            resolve();
+        };
+        target.on('drain', done);
+        res.on('close', done);
+    });
+};
+
+/*
+ * streamCursor function
+ * Writes all documents of the cursor to the response in the given format
+ * We read the first document before sending anything, so if the query
+ * fails the caller can still answer with a normal error response
+ * serialize turns one document into JSON (default JSON.stringify)
+ */
+const streamCursor = async (cursor, res, format, serialize = JSON.stringify) => {
+    const ndjson = format === 'ndjson';
+    let doc;
+    try {
+        doc = await cursor.next();
+    } catch (err) {
+        await cursor.close();
+        throw err;
+    }
+
+    res.type(ndjson ? 'application/x-ndjson' : 'application/json');
+    if (!ndjson) {
+        res.write('[');
+    }
+
+    let first = true;
+    try {
+        while (doc) {
+            let chunk = serialize(doc);
+            if (ndjson) {
+                chunk += '\n';
+            } else if (!first) {
+                chunk = ',' + chunk;
+            }
+            first = false;
+
+            if (!res.write(chunk)) {
+                await waitForDrain(res);
+            }
+            // stop reading from mongo if the client disconnected
+            if (res.destroyed) {
+                return;
+            }
+            doc = await cursor.next();
+        }
+
+        if (!ndjson) {
+            res.write(']');
+        }
+        res.end();
+    } catch (err) {
+        // headers were already sent, the only thing we can do is cut the response
+        res.destroy(err);
+    } finally {
+        await cursor.close();
+    }
+};
+
+module.exports = { waitForDrain, streamCursor };
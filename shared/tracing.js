@@ -0,0 +1,114 @@
+/*
+ * Request Tracing
+ * Every request gets a request id: the X-Request-Id header of the request, so a
+ * client can send one id with all the calls of a flow, or a new uuid.
+ * The id goes back to the client in the X-Request-Id response header.
+ *
+ * While a logged request runs, its trace is kept in an AsyncLocalStorage context
+ * and collects timing spans: every mongo command it sends (from the driver
+ * command events) and the response phase. The request logger saves the spans
+ * with the line it writes when the request is done (see logger.js), and the logs
+ * service returns all the lines of one request id on GET /api/logs/trace/:id.
+ */
+
+const { AsyncLocalStorage } = require('async_hooks');
+const crypto = require('crypto');
+
+// spans kept per request, a long cursor does not make the log line huge
+const MAX_SPANS = 100;
+
+// ids we accept from clients, anything else gets a new id
+const VALID_ID = /^[\w.:-]{1,128}$/;
+
+// one context per process, shared by every service of it (combined launcher)
+const shared = {
+    context: new AsyncLocalStorage(),
+    clients: new WeakSet()
+};
+
+const round = (ms) => Math.round(ms * 1000) / 1000;
+
+/*
+ * Trace class
+ * The spans of one request, times in milliseconds since the request started
+ */
+class Trace {
+    constructor(id) {
+        this.id = id;
+        this.start = process.hrtime.bigint();
+        this.spans = [];
+        this.droppedSpans = 0;
+    }
+
+    elapsed() {
+        return Number(process.hrtime.bigint() - this.start) / 1e6;
+    }
+
+    addSpan(type, name, startMs, durationMs) {
+        if (this.spans.length >= MAX_SPANS) {
+            this.droppedSpans++;
+            return;
+        }
+        this.spans.push({ type: type, name: name, start_ms: round(startMs), duration_ms: round(durationMs) });
+    }
+}
+
+/*
+ * requestId function
+ * The id of the request from the X-Request-Id header, or a new one
+ */
+const requestId = (req) => {
+    const header = req.get('X-Request-Id');
+    return header && VALID_ID.test(header) ? header : crypto.randomUUID();
+};
+
+// runs fn (and everything it starts) with the trace as the current one
+const runTraced = (trace, fn) => shared.context.run(trace, fn);
+
+// runs fn without a current trace, for work that does not belong to a request
+const runUntraced = (fn) => shared.context.exit(fn);
+
+/*
+ * commandCollection function
+ * The collection a mongo command event is about, '' if there is none
+ */
+const commandCollection = (event) => {
+    const target = event.command[event.commandName];
+    return typeof target === 'string' ? target : (event.command.collection || '');
+};
+
+/*
+ * traceMongo function
+ * Adds a span for every command a traced request sends
+ * Needs monitorCommands: true in the connect options (see db.js)
+ */
+const traceMongo = (client) => {
+    if (shared.clients.has(client)) {
+        return;
+    }
+    shared.clients.add(client);
+
+    // commandStarted runs inside the request context, the end events do not
+    const started = new Map();
+    client.on('commandStarted', event => {
+        const trace = shared.context.getStore();
+        if (trace) {
+            started.set(event.requestId, {
+                trace: trace,
+                name: event.commandName + ' ' + commandCollection(event),
+                start: trace.elapsed()
+            });
+        }
+    });
+    const finished = (event) => {
+        const span = started.get(event.requestId);
+        if (span) {
+            started.delete(event.requestId);
+            span.trace.addSpan('mongo', span.name, span.start, event.duration);
+        }
+    };
+    client.on('commandSucceeded', finished);
+    client.on('commandFailed', finished);
+};
+
+module.exports = { Trace, requestId, runTraced, runUntraced, commandCollection, traceMongo };
@@ -0,0 +1,321 @@
+"""
+Cost Manager RESTful Web Services - Load and Latency Benchmark
+
+Drives the same endpoint scenarios as test.py with many concurrent requests
+and reports throughput (req/s) and p50/p95/p99 latency per endpoint.
+
+Scenarios:
+- users_list:     GET  /api/users
+- user_total:     GET  /api/users/:id
+- cost_add:       POST /api/add (costs service)
+- report_current: GET  /api/report for the current month
+- report_past:    GET  /api/report for a past month
+- logs:           GET  /api/logs (one page of 100 logs)
+
+Modes:
+- ramp: concurrency grows from 1 to --concurrency during --ramp seconds,
+        then stays there until --duration is over (closed loop)
+- rate: a new request starts every 1/--rate seconds (open loop),
+        latency is measured from the planned start time so a slow server
+        can not hide its queueing delay
+
+Base URLs come from USERS_URL, COSTS_URL, ADMIN_URL and LOGS_URL
+(default: localhost ports 3001-3004).
+
+To run:     python bench.py --mode ramp --concurrency 50 --duration 30 --output results.json
+To compare: python bench.py --compare baseline.json results.json
+
+Requires httpx.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+# ===========================================
+# Service URLs Configuration (local by default)
+# ===========================================
+USERS_URL = os.environ.get("USERS_URL", "http://localhost:3001")
+COSTS_URL = os.environ.get("COSTS_URL", "http://localhost:3002")
+ADMIN_URL = os.environ.get("ADMIN_URL", "http://localhost:3003")
+LOGS_URL = os.environ.get("LOGS_URL", "http://localhost:3004")
+
+# Same constants as test.py
+EXISTING_USER_ID = 123123
+CURRENT_YEAR = datetime.now().year
+CURRENT_MONTH = datetime.now().month
+
+
+# ===========================================
+# Scenarios - each one sends a single request
+# ===========================================
+async def users_list(client):
+    return await client.get(f"{USERS_URL}/api/users")
+
+
+async def user_total(client):
+    return await client.get(f"{USERS_URL}/api/users/{EXISTING_USER_ID}")
+
+
+async def cost_add(client):
+    return await client.post(f"{COSTS_URL}/api/add", json={
+        "description": "Benchmark item",
+        "category": "food",
+        "userid": EXISTING_USER_ID,
+        "sum": 1
+    })
+
+
+async def report_current(client):
+    return await client.get(
+        f"{COSTS_URL}/api/report",
+        params={"id": EXISTING_USER_ID, "year": CURRENT_YEAR, "month": CURRENT_MONTH}
+    )
+
+
+async def report_past(client):
+    return await client.get(
+        f"{COSTS_URL}/api/report",
+        params={"id": EXISTING_USER_ID, "year": CURRENT_YEAR - 1, "month": 6}
+    )
+
+
+async def logs(client):
+    return await client.get(f"{LOGS_URL}/api/logs", params={"limit": 100})
+
+
+SCENARIOS = {
+    "users_list": users_list,
+    "user_total": user_total,
+    "cost_add": cost_add,
+    "report_current": report_current,
+    "report_past": report_past,
+    "logs": logs,
+}
+
+
+# ===========================================
+# Measurements
+# ===========================================
+class Recorder:
+    """Collects the latency of every request that finished in the measured window"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.bytes = 0
+        self.started_at = None
+        self.stopped_at = None
+
+    def record(self, latency, ok, size=0):
+        self.latencies.append(latency)
+        self.bytes += size
+        if not ok:
+            self.errors += 1
+
+    def summary(self):
+        elapsed = (self.stopped_at or time.perf_counter()) - self.started_at
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "rps": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+            # bytes on the wire (compressed) per response
+            "avg_bytes": round(self.bytes / count) if count else None,
+        }
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile in milliseconds, None if there are no values"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return round(sorted_values[int(rank) - 1] * 1000, 2)
+
+
+async def timed(client, scenario, recorder, planned_start=None):
+    """Sends one request and records its latency (from planned_start if given)"""
+    start = planned_start if planned_start is not None else time.perf_counter()
+    size = 0
+    try:
+        response = await scenario(client)
+        ok = response.status_code < 400
+        size = response.num_bytes_downloaded
+    except httpx.HTTPError:
+        ok = False
+    recorder.record(time.perf_counter() - start, ok, size)
+
+
+# ===========================================
+# Load generators
+# ===========================================
+async def run_ramp(client, scenario, concurrency, ramp, duration):
+    """Closed loop: workers start one by one during ramp, each sends requests back to back"""
+    recorder = Recorder()
+    end = time.perf_counter() + duration
+
+    async def worker(delay):
+        await asyncio.sleep(delay)
+        while time.perf_counter() < end:
+            await timed(client, scenario, recorder)
+
+    recorder.started_at = time.perf_counter()
+    step = ramp / concurrency if concurrency > 0 else 0
+    await asyncio.gather(*(worker(i * step) for i in range(concurrency)))
+    recorder.stopped_at = time.perf_counter()
+    return recorder
+
+
+async def run_rate(client, scenario, rate, duration, max_in_flight):
+    """Open loop: starts a request every 1/rate seconds no matter how slow the server is"""
+    recorder = Recorder()
+    interval = 1.0 / rate
+    in_flight = set()
+    dropped = 0
+
+    recorder.started_at = time.perf_counter()
+    end = recorder.started_at + duration
+    planned = recorder.started_at
+    while planned < end:
+        delay = planned - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= max_in_flight:
+            # the server is too far behind, dont pile up more requests
+            dropped += 1
+        else:
+            task = asyncio.create_task(timed(client, scenario, recorder, planned))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        planned += interval
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    recorder.stopped_at = time.perf_counter()
+    recorder.errors += dropped
+    return recorder
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.max_connections,
+                          max_keepalive_connections=args.max_connections)
+    timeout = httpx.Timeout(args.timeout)
+    results = {}
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            if args.mode == "ramp":
+                recorder = await run_ramp(client, scenario, args.concurrency, args.ramp, args.duration)
+            else:
+                recorder = await run_rate(client, scenario, args.rate, args.duration, args.max_in_flight)
+            results[name] = recorder.summary()
+            print_row(name, results[name])
+    return results
+
+
+# ===========================================
+# Output and comparison
+# ===========================================
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_row(name, summary):
+    print(f"{name:<16} {summary['rps']:>9} req/s  "
+          f"p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms  "
+          f"{summary['avg_bytes']} B  errors {summary['errors']}/{summary['requests']}")
+
+
+def compare(baseline_path, current_path, threshold):
+    """Prints the change of every endpoint, returns 1 if any got slower than threshold"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    with open(current_path) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    for name, now in current.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "avg_bytes"):
+            # older result files have no avg_bytes
+            if not before.get(key) or now.get(key) is None:
+                continue
+            change = (now[key] - before[key]) / before[key] * 100
+            # lower rps or higher latency is worse
+            worse = -change if key == "rps" else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{name:<16} {key:<7} {before[key]:>10} -> {now[key]:>10} ({change:+.1f}%){flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost Manager load and latency benchmark")
+    parser.add_argument("--mode", choices=["ramp", "rate"], default="ramp")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated list of scenarios to run")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="ramp mode: number of workers")
+    parser.add_argument("--ramp", type=float, default=5, help="ramp mode: seconds to start all workers")
+    parser.add_argument("--rate", type=float, default=100, help="rate mode: requests per second")
+    parser.add_argument("--max-in-flight", type=int, default=1000,
+                        help="rate mode: requests over this limit are counted as errors")
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="compare: percent change that counts as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenarios: " + ", ".join(unknown))
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "config": {
+                    "mode": args.mode,
+                    "duration": args.duration,
+                    "concurrency": args.concurrency,
+                    "ramp": args.ramp,
+                    "rate": args.rate,
+                    "urls": {"users": USERS_URL, "costs": COSTS_URL,
+                             "admin": ADMIN_URL, "logs": LOGS_URL},
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
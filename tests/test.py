@@ -7,22 +7,28 @@ This file contains comprehensive unit tests for all four processes:
 - Process 3 (Admin Service): Port 3003
 - Process 4 (Logs Service): Port 3004
 
+All requests go through the cost_manager client, so the tests reuse
+one keep-alive connection per service.
+
 Developers: Ofir Nesher, Asaf Arusi
 
 To run: pytest tests.py -v
 """
 
-import requests
+import os
+import time
 import pytest
 from datetime import datetime
 
+from cost_manager import CostManagerClient, LogGap, ServiceError
+
 # ===========================================
 # Service URLs Configuration (Deployed on Render)
 # ===========================================
-USERS_URL = "https://process-1-users.onrender.com"
-COSTS_URL = "https://process-2-costs.onrender.com"
-ADMIN_URL = "https://process-3-admin.onrender.com"
-LOGS_URL = "https://process-4-logs.onrender.com"
+USERS_URL = os.environ.get("USERS_URL", "https://process-1-users.onrender.com")
+COSTS_URL = os.environ.get("COSTS_URL", "https://process-2-costs.onrender.com")
+ADMIN_URL = os.environ.get("ADMIN_URL", "https://process-3-admin.onrender.com")
+LOGS_URL = os.environ.get("LOGS_URL", "https://process-4-logs.onrender.com")
 
 # Test constants
 EXISTING_USER_ID = 123123
@@ -30,6 +36,13 @@ TEST_USER_ID = 987654
 CURRENT_YEAR = datetime.now().year
 CURRENT_MONTH = datetime.now().month
 
+# One client (and connection pool per service) for the whole test run
+client = CostManagerClient(USERS_URL, COSTS_URL, ADMIN_URL, LOGS_URL)
+
+
+def teardown_module():
+    client.close()
+
 
 # ===========================================
 # PROCESS 3: Admin Service Tests (/api/about)
@@ -39,20 +52,18 @@ class TestAdminService:
 
     def test_about_returns_200(self):
         """Should return HTTP 200 status"""
-        response = requests.get(f"{ADMIN_URL}/api/about")
+        response = client.request("admin", "GET", "/api/about")
         assert response.status_code == 200
 
     def test_about_returns_array(self):
         """Should return an array of team members"""
-        response = requests.get(f"{ADMIN_URL}/api/about")
-        data = response.json()
+        data = client.about()
         assert isinstance(data, list)
         assert len(data) > 0
 
     def test_about_contains_required_fields(self):
         """Should contain first_name and last_name for each member"""
-        response = requests.get(f"{ADMIN_URL}/api/about")
-        data = response.json()
+        data = client.about()
         for member in data:
             assert "first_name" in member
             assert "last_name" in member
@@ -61,15 +72,22 @@ class TestAdminService:
 
     def test_about_no_extra_fields(self):
         """Should not contain additional properties beyond first_name and last_name"""
-        response = requests.get(f"{ADMIN_URL}/api/about")
-        data = response.json()
+        data = client.about()
         for member in data:
             keys = set(member.keys())
             assert keys == {"first_name", "last_name"}
 
+    def test_about_not_modified(self):
+        """Should return 304 when If-None-Match has the current ETag"""
+        response = client.request("admin", "GET", "/api/about")
+        assert "immutable" in response.headers["Cache-Control"]
+        etag = response.headers["ETag"]
+        response = client.request("admin", "GET", "/api/about", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
     def test_about_with_trailing_slash(self):
         """Should handle trailing slash in URL"""
-        response = requests.get(f"{ADMIN_URL}/api/about/")
+        response = client.request("admin", "GET", "/api/about/")
         assert response.status_code in [200, 301, 302, 307, 308]
 
 
@@ -81,19 +99,17 @@ class TestUsersServiceList:
 
     def test_users_list_returns_200(self):
         """Should return HTTP 200 status"""
-        response = requests.get(f"{USERS_URL}/api/users")
+        response = client.request("users", "GET", "/api/users")
         assert response.status_code == 200
 
     def test_users_list_returns_array(self):
         """Should return an array"""
-        response = requests.get(f"{USERS_URL}/api/users")
-        data = response.json()
+        data = client.list_users()
         assert isinstance(data, list)
 
     def test_users_list_contains_required_properties(self):
         """Should contain user with required properties"""
-        response = requests.get(f"{USERS_URL}/api/users")
-        data = response.json()
+        data = client.list_users()
         if len(data) > 0:
             user = data[0]
             assert "id" in user
@@ -103,26 +119,48 @@ class TestUsersServiceList:
 
     def test_users_list_contains_existing_user(self):
         """Should contain the pre-existing user (id: 123123)"""
-        response = requests.get(f"{USERS_URL}/api/users")
-        data = response.json()
+        data = client.list_users()
         existing_user = next((u for u in data if u["id"] == EXISTING_USER_ID), None)
         assert existing_user is not None
         assert existing_user["first_name"] == "mosh"
         assert existing_user["last_name"] == "israeli"
 
+    def test_users_list_pagination(self):
+        """Should return pages ordered by id when limit and after are given"""
+        response = client.request("users", "GET", "/api/users", params={"limit": 2})
+        assert response.status_code == 200
+        page = response.json()
+        assert isinstance(page, list)
+        assert len(page) <= 2
+        if "X-Next-After" in response.headers:
+            after = response.headers["X-Next-After"]
+            next_page = client.list_users(after=after, limit=2)
+            assert all(u["id"] > int(after) for u in next_page)
+
+    def test_users_list_iterates_all_pages(self):
+        """Should return the same users page by page as in one list"""
+        paged_ids = [u["id"] for u in client.iter_users(page_size=2)]
+        all_ids = sorted(u["id"] for u in client.list_users())
+        assert paged_ids == all_ids
+
+    def test_users_list_ndjson(self):
+        """Should return one user per line in ndjson format"""
+        users = list(client.stream_users())
+        assert len(users) > 0
+        assert "id" in users[0]
+
 
 class TestUsersServiceGetById:
     """Tests for GET /api/users/:id - Get Specific User Details"""
 
     def test_get_user_returns_200(self):
         """Should return HTTP 200 for existing user"""
-        response = requests.get(f"{USERS_URL}/api/users/{EXISTING_USER_ID}")
+        response = client.request("users", "GET", f"/api/users/{EXISTING_USER_ID}")
         assert response.status_code == 200
 
     def test_get_user_contains_required_fields(self):
         """Should return user with first_name, last_name, id, and total"""
-        response = requests.get(f"{USERS_URL}/api/users/{EXISTING_USER_ID}")
-        data = response.json()
+        data = client.get_user(EXISTING_USER_ID)
         assert "first_name" in data
         assert "last_name" in data
         assert "id" in data
@@ -130,8 +168,7 @@ class TestUsersServiceGetById:
 
     def test_get_user_correct_data_types(self):
         """Should return correct data types"""
-        response = requests.get(f"{USERS_URL}/api/users/{EXISTING_USER_ID}")
-        data = response.json()
+        data = client.get_user(EXISTING_USER_ID)
         assert isinstance(data["first_name"], str)
         assert isinstance(data["last_name"], str)
         assert isinstance(data["id"], int)
@@ -139,69 +176,57 @@ class TestUsersServiceGetById:
 
     def test_get_user_not_found_returns_404(self):
         """Should return HTTP 404 for non-existing user"""
-        response = requests.get(f"{USERS_URL}/api/users/999888777")
-        assert response.status_code == 404
+        with pytest.raises(ServiceError) as error:
+            client.get_user(999888777)
+        assert error.value.status_code == 404
 
     def test_get_user_not_found_error_format(self):
         """Should return error JSON with id and message for non-existing user"""
-        response = requests.get(f"{USERS_URL}/api/users/999888777")
-        data = response.json()
-        assert "id" in data
-        assert "message" in data
+        with pytest.raises(ServiceError) as error:
+            client.get_user(999888777)
+        assert error.value.id is not None
+        assert error.value.message
 
     def test_get_user_total_is_valid(self):
         """Should calculate total costs correctly"""
-        response = requests.get(f"{USERS_URL}/api/users/{EXISTING_USER_ID}")
-        data = response.json()
+        data = client.get_user(EXISTING_USER_ID)
         assert isinstance(data["total"], (int, float))
         assert data["total"] >= 0
 
+    def test_get_many_users(self):
+        """Should fetch many users at the same time, in the given order"""
+        users = client.get_users([EXISTING_USER_ID, EXISTING_USER_ID])
+        assert [u["id"] for u in users] == [EXISTING_USER_ID, EXISTING_USER_ID]
+
 
 class TestUsersServiceAddUser:
     """Tests for POST /api/add - Add New User"""
 
     def test_add_user_success(self):
         """Should add a new user successfully"""
-        new_user = {
-            "id": TEST_USER_ID,
-            "first_name": "Test",
-            "last_name": "User",
-            "birthday": "1995-05-15"
-        }
-        response = requests.post(f"{USERS_URL}/api/add", json=new_user)
         # Either 201 (created) or 500 (if user already exists)
-        assert response.status_code in [201, 500]
-        if response.status_code == 201:
-            data = response.json()
-            assert data["id"] == TEST_USER_ID
-            assert data["first_name"] == "Test"
-            assert data["last_name"] == "User"
+        try:
+            data = client.add_user(TEST_USER_ID, "Test", "User", "1995-05-15")
+        except ServiceError as error:
+            assert error.status_code == 500
+            return
+        assert data["id"] == TEST_USER_ID
+        assert data["first_name"] == "Test"
+        assert data["last_name"] == "User"
 
     def test_add_duplicate_user_returns_error(self):
         """Should return error when adding duplicate user"""
-        duplicate_user = {
-            "id": EXISTING_USER_ID,
-            "first_name": "Duplicate",
-            "last_name": "User",
-            "birthday": "1990-01-01"
-        }
-        response = requests.post(f"{USERS_URL}/api/add", json=duplicate_user)
-        assert response.status_code == 500
-        data = response.json()
-        assert "message" in data
+        with pytest.raises(ServiceError) as error:
+            client.add_user(EXISTING_USER_ID, "Duplicate", "User", "1990-01-01")
+        assert error.value.status_code == 500
+        assert error.value.message
 
     def test_add_user_error_format(self):
         """Should return error JSON with id and message on failure"""
-        invalid_user = {
-            "id": EXISTING_USER_ID,
-            "first_name": "Test",
-            "last_name": "Invalid",
-            "birthday": "2000-01-01"
-        }
-        response = requests.post(f"{USERS_URL}/api/add", json=invalid_user)
-        data = response.json()
-        assert "id" in data
-        assert "message" in data
+        with pytest.raises(ServiceError) as error:
+            client.add_user(EXISTING_USER_ID, "Test", "Invalid", "2000-01-01")
+        assert error.value.id is not None
+        assert error.value.message
 
     def test_add_user_missing_fields(self):
         """Should handle missing required fields"""
@@ -210,7 +235,7 @@ class TestUsersServiceAddUser:
             "first_name": "Incomplete"
             # missing last_name and birthday
         }
-        response = requests.post(f"{USERS_URL}/api/add", json=incomplete_user)
+        response = client.request("users", "POST", "/api/add", json=incomplete_user)
         assert response.status_code == 500
 
 
@@ -222,15 +247,7 @@ class TestCostsServiceAddCost:
 
     def test_add_cost_success(self):
         """Should add a cost item for existing user"""
-        new_cost = {
-            "description": "Test meal",
-            "category": "food",
-            "userid": EXISTING_USER_ID,
-            "sum": 25
-        }
-        response = requests.post(f"{COSTS_URL}/api/add", json=new_cost)
-        assert response.status_code == 201
-        data = response.json()
+        data = client.add_cost("Test meal", "food", EXISTING_USER_ID, 25)
         assert data["description"] == "Test meal"
         assert data["category"] == "food"
         assert data["userid"] == EXISTING_USER_ID
@@ -240,54 +257,26 @@ class TestCostsServiceAddCost:
         """Should add cost items for all valid categories"""
         categories = ["food", "health", "housing", "sport", "education"]
         for category in categories:
-            cost = {
-                "description": f"Test {category} item",
-                "category": category,
-                "userid": EXISTING_USER_ID,
-                "sum": 10
-            }
-            response = requests.post(f"{COSTS_URL}/api/add", json=cost)
-            assert response.status_code == 201
-            data = response.json()
+            data = client.add_cost(f"Test {category} item", category, EXISTING_USER_ID, 10)
             assert data["category"] == category
 
     def test_add_cost_non_existing_user(self):
         """Should return error for non-existing user"""
-        cost = {
-            "description": "Invalid cost",
-            "category": "food",
-            "userid": 999888777,
-            "sum": 100
-        }
-        response = requests.post(f"{COSTS_URL}/api/add", json=cost)
-        assert response.status_code == 500
-        data = response.json()
-        assert "message" in data
+        with pytest.raises(ServiceError) as error:
+            client.add_cost("Invalid cost", "food", 999888777, 100)
+        assert error.value.status_code == 500
+        assert error.value.message
 
     def test_add_cost_error_format(self):
         """Should return error JSON with id and message on failure"""
-        cost = {
-            "description": "Invalid",
-            "category": "food",
-            "userid": 999888777,
-            "sum": 50
-        }
-        response = requests.post(f"{COSTS_URL}/api/add", json=cost)
-        data = response.json()
-        assert "id" in data
-        assert "message" in data
+        with pytest.raises(ServiceError) as error:
+            client.add_cost("Invalid", "food", 999888777, 50)
+        assert error.value.id is not None
+        assert error.value.message
 
     def test_add_cost_default_date(self):
         """Should use current date if not provided"""
-        cost = {
-            "description": "Date test item",
-            "category": "food",
-            "userid": EXISTING_USER_ID,
-            "sum": 5
-        }
-        response = requests.post(f"{COSTS_URL}/api/add", json=cost)
-        assert response.status_code == 201
-        data = response.json()
+        data = client.add_cost("Date test item", "food", EXISTING_USER_ID, 5)
         assert "createdAt" in data
 
     def test_add_cost_with_trailing_slash(self):
@@ -298,19 +287,61 @@ class TestCostsServiceAddCost:
             "userid": EXISTING_USER_ID,
             "sum": 8
         }
-        response = requests.post(f"{COSTS_URL}/api/add/", json=cost)
+        response = client.request("costs", "POST", "/api/add/", json=cost)
         assert response.status_code in [201, 307]
 
     def test_add_cost_invalid_category(self):
         """Should reject invalid category"""
-        cost = {
-            "description": "Invalid category test",
-            "category": "invalid_category",
-            "userid": EXISTING_USER_ID,
-            "sum": 10
-        }
-        response = requests.post(f"{COSTS_URL}/api/add", json=cost)
-        assert response.status_code == 500
+        with pytest.raises(ServiceError) as error:
+            client.add_cost("Invalid category test", "invalid_category", EXISTING_USER_ID, 10)
+        assert error.value.status_code == 500
+
+
+class TestCostsServiceBulkAdd:
+    """Tests for POST /api/add/bulk - Bulk Add Cost Items"""
+
+    def test_bulk_add_array(self):
+        """Should add every valid item and report the invalid ones"""
+        items = [
+            {"description": "Bulk item 1", "category": "food", "userid": EXISTING_USER_ID, "sum": 3},
+            {"description": "Bulk item 2", "category": "sport", "userid": EXISTING_USER_ID, "sum": 4},
+            {"description": "Bulk item 3", "category": "food", "userid": 999888777, "sum": 5},
+        ]
+        data = client.add_costs(items)
+        assert data["inserted"] == 2
+        assert data["failed"] == 1
+        assert "_id" in data["results"][0]
+        assert data["results"][2]["id"] == 999888777
+        assert "message" in data["results"][2]
+        assert data["updateErrors"] == []
+
+    def test_bulk_add_ndjson(self):
+        """Should add items sent as one JSON document per line"""
+        items = iter([
+            {"description": "NDJSON item", "category": "health", "userid": EXISTING_USER_ID, "sum": 6},
+            {"description": "NDJSON item", "category": "health", "userid": 999888777, "sum": 6},
+        ])
+        data = client.add_costs(items)
+        assert data["inserted"] == 1
+        assert data["results"][1]["id"] == 999888777
+
+    def test_bulk_add_invalid_json_line(self):
+        """Should report a line that is not valid JSON with id 0"""
+        response = client.request(
+            "costs", "POST", "/api/add/bulk",
+            content=b"not json\n",
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        assert response.status_code == 207
+        assert response.json()["results"][0]["id"] == 0
+
+    def test_bulk_add_invalid_body(self):
+        """Should reject a body that is not an array"""
+        response = client.request("costs", "POST", "/api/add/bulk", json={"description": "x"})
+        assert response.status_code == 400
+        data = response.json()
+        assert "id" in data
+        assert "message" in data
 
 
 class TestCostsServiceReport:
@@ -318,19 +349,15 @@ class TestCostsServiceReport:
 
     def test_report_returns_200(self):
         """Should return HTTP 200 for valid request"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
+        response = client.request(
+            "costs", "GET", "/api/report",
             params={"id": EXISTING_USER_ID, "year": CURRENT_YEAR, "month": CURRENT_MONTH}
         )
         assert response.status_code == 200
 
     def test_report_contains_required_fields(self):
         """Should return report with userid, year, month, and costs"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": CURRENT_YEAR, "month": CURRENT_MONTH}
-        )
-        data = response.json()
+        data = client.get_report(EXISTING_USER_ID, CURRENT_YEAR, CURRENT_MONTH)
         assert "userid" in data
         assert "year" in data
         assert "month" in data
@@ -338,20 +365,12 @@ class TestCostsServiceReport:
 
     def test_report_costs_is_array(self):
         """Should return costs as an array"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": CURRENT_YEAR, "month": CURRENT_MONTH}
-        )
-        data = response.json()
+        data = client.get_report(EXISTING_USER_ID, CURRENT_YEAR, CURRENT_MONTH)
         assert isinstance(data["costs"], list)
 
     def test_report_includes_all_categories(self):
         """Should include all five categories in report"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": CURRENT_YEAR, "month": CURRENT_MONTH}
-        )
-        data = response.json()
+        data = client.get_report(EXISTING_USER_ID, CURRENT_YEAR, CURRENT_MONTH)
         categories = [list(c.keys())[0] for c in data["costs"]]
         assert "food" in categories
         assert "health" in categories
@@ -361,11 +380,7 @@ class TestCostsServiceReport:
 
     def test_report_cost_item_format(self):
         """Should return cost items with sum, description, and day"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": CURRENT_YEAR, "month": CURRENT_MONTH}
-        )
-        data = response.json()
+        data = client.get_report(EXISTING_USER_ID, CURRENT_YEAR, CURRENT_MONTH)
         for category_obj in data["costs"]:
             category = list(category_obj.keys())[0]
             items = category_obj[category]
@@ -376,8 +391,8 @@ class TestCostsServiceReport:
 
     def test_report_missing_params_returns_400(self):
         """Should return error for missing parameters"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
+        response = client.request(
+            "costs", "GET", "/api/report",
             params={"id": EXISTING_USER_ID}  # missing year and month
         )
         assert response.status_code == 400
@@ -386,8 +401,8 @@ class TestCostsServiceReport:
 
     def test_report_missing_id_error_format(self):
         """Should return error JSON with id and message on missing params"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
+        response = client.request(
+            "costs", "GET", "/api/report",
             params={"year": CURRENT_YEAR, "month": CURRENT_MONTH}  # missing id
         )
         data = response.json()
@@ -396,12 +411,7 @@ class TestCostsServiceReport:
 
     def test_report_empty_month(self):
         """Should return empty arrays for categories with no costs"""
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": 2020, "month": 1}
-        )
-        assert response.status_code == 200
-        data = response.json()
+        data = client.get_report(EXISTING_USER_ID, 2020, 1)
         for category_obj in data["costs"]:
             category = list(category_obj.keys())[0]
             assert isinstance(category_obj[category], list)
@@ -409,8 +419,8 @@ class TestCostsServiceReport:
     def test_report_future_month(self):
         """Should handle future month report request"""
         future_year = CURRENT_YEAR + 1
-        response = requests.get(
-            f"{COSTS_URL}/api/report",
+        response = client.request(
+            "costs", "GET", "/api/report",
             params={"id": EXISTING_USER_ID, "year": future_year, "month": 1}
         )
         assert response.status_code == 200
@@ -421,21 +431,138 @@ class TestCostsServiceReport:
         past_month = 6
 
         # First request
-        response1 = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": past_year, "month": past_month}
-        )
-        assert response1.status_code == 200
+        report1 = client.get_report(EXISTING_USER_ID, past_year, past_month)
 
         # Second request (should be cached)
-        response2 = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": past_year, "month": past_month}
-        )
-        assert response2.status_code == 200
+        report2 = client.get_report(EXISTING_USER_ID, past_year, past_month)
 
         # Both responses should be identical
-        assert response1.json() == response2.json()
+        assert report1 == report2
+
+    def test_report_past_month_not_modified(self):
+        """Should let clients keep past month reports for a while and answer If-None-Match with 304"""
+        params = {"id": EXISTING_USER_ID, "year": CURRENT_YEAR - 1, "month": 6}
+        response = client.request("costs", "GET", "/api/report", params=params)
+        assert "max-age" in response.headers["Cache-Control"]
+        # per-user data, shared caches must not store it
+        assert "private" in response.headers["Cache-Control"]
+        etag = response.headers["ETag"]
+        response = client.request("costs", "GET", "/api/report", params=params,
+                                  headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+    def test_report_includes_backdated_cost(self):
+        """Should add a cost with a past createdAt to the saved report of its month"""
+        past_year = CURRENT_YEAR - 1
+        before = client.get_report(EXISTING_USER_ID, past_year, 3)
+        client.add_cost("Backdated report test", "sport", EXISTING_USER_ID, 7,
+                        f"{past_year}-03-15T12:00:00Z")
+        after = client.get_report(EXISTING_USER_ID, past_year, 3)
+
+        def sport(report):
+            return next(c["sport"] for c in report["costs"] if "sport" in c)
+        assert len(sport(after)) == len(sport(before)) + 1
+        assert {"sum": 7, "description": "Backdated report test", "day": 15} in sport(after)
+
+    def test_report_many_months(self):
+        """Should fetch reports of many months at the same time, in the given order"""
+        keys = [(EXISTING_USER_ID, CURRENT_YEAR - 1, month) for month in range(1, 13)]
+        reports = client.get_reports(keys)
+        assert [r["month"] for r in reports] == list(range(1, 13))
+
+    def test_range_report_months(self):
+        """Should return one entry per month with category totals"""
+        data = client.get_range_report(EXISTING_USER_ID, f"{CURRENT_YEAR - 1}-11", f"{CURRENT_YEAR}-02")
+        assert [(m["year"], m["month"]) for m in data["months"]] == [
+            (CURRENT_YEAR - 1, 11), (CURRENT_YEAR - 1, 12), (CURRENT_YEAR, 1), (CURRENT_YEAR, 2)
+        ]
+        for month in data["months"]:
+            assert set(month["totals"]) == {"food", "health", "housing", "sport", "education"}
+            assert "costs" in month
+        assert data["total"] == pytest.approx(sum(m["total"] for m in data["months"]))
+
+    def test_range_report_matches_monthly_report(self):
+        """Should return the same items as the monthly report"""
+        past_year = CURRENT_YEAR - 1
+        monthly = client.get_report(EXISTING_USER_ID, past_year, 6)
+        data = client.get_range_report(EXISTING_USER_ID, f"{past_year}-06", f"{past_year}-06")
+        assert data["months"][0]["costs"] == monthly["costs"]
+
+    def test_range_report_without_items(self):
+        """Should skip the item lists when items=false"""
+        data = client.get_range_report(EXISTING_USER_ID, f"{CURRENT_YEAR - 1}-01",
+                                       f"{CURRENT_YEAR - 1}-12", items=False)
+        assert len(data["months"]) == 12
+        assert all("costs" not in m for m in data["months"])
+
+    def test_range_report_invalid_range(self):
+        """Should reject a range that ends before it starts"""
+        with pytest.raises(ServiceError) as error:
+            client.get_range_report(EXISTING_USER_ID, f"{CURRENT_YEAR}-05", f"{CURRENT_YEAR}-01")
+        assert error.value.status_code == 400
+
+    def test_report_cache_stats(self):
+        """Should count a cache hit when the same past month is requested twice"""
+        client.get_report(EXISTING_USER_ID, CURRENT_YEAR - 1, 7)
+        before = client.report_cache_stats()
+
+        client.get_report(EXISTING_USER_ID, CURRENT_YEAR - 1, 7)
+        after = client.report_cache_stats()
+
+        assert "hits" in after["cache"]
+        assert "misses" in after["cache"]
+        assert after["cache"]["hits"] >= before["cache"]["hits"] + 1
+
+    def test_report_admission_stats(self):
+        """Should list the admission limits of the report calculations"""
+        admission = client.report_cache_stats()["admission"]
+        for route in ("report", "range", "bulk"):
+            assert admission[route]["concurrency"] > 0
+            assert admission[route]["queued"] <= admission[route]["queueSize"]
+
+
+class TestCostsServiceHistory:
+    """Tests for GET /api/costs - Cost History of a User"""
+
+    def test_history_filters_by_category_and_date(self):
+        """Should return only the costs of the category inside the date range, oldest first"""
+        data = client.list_costs(EXISTING_USER_ID, since=f"{CURRENT_YEAR - 1}-01-01",
+                                 until=f"{CURRENT_YEAR}-01-01", category="sport", limit=50)
+        assert data["userid"] == EXISTING_USER_ID
+        times = [cost["createdAt"] for cost in data["costs"]]
+        assert times == sorted(times)
+        for cost in data["costs"]:
+            assert cost["category"] == "sport"
+            assert f"{CURRENT_YEAR - 1}-01-01" <= cost["createdAt"] < f"{CURRENT_YEAR}-01-01"
+            assert set(cost) == {"_id", "description", "category", "sum", "createdAt"}
+
+    def test_history_pages_do_not_overlap(self):
+        """Should page by (createdAt, _id) without repeating a cost"""
+        first = client.request("costs", "GET", "/api/costs",
+                               params={"id": EXISTING_USER_ID, "limit": 2})
+        assert first.status_code == 200
+        after = first.headers.get("X-Next-After")
+        if after:
+            second = client.list_costs(EXISTING_USER_ID, after=after, limit=2)
+            first_ids = {cost["_id"] for cost in first.json()["costs"]}
+            assert not first_ids & {cost["_id"] for cost in second["costs"]}
+
+    def test_history_aggregate(self):
+        """Should add count, sum, min and max per category of all the matching costs"""
+        data = client.list_costs(EXISTING_USER_ID, category=["food", "sport"],
+                                 aggregate=True, limit=1)
+        assert set(data["aggregate"]) == {"food", "sport"}
+        food = data["aggregate"]["food"]
+        all_food = list(client.iter_costs(EXISTING_USER_ID, page_size=500, category="food"))
+        assert food["count"] == len(all_food)
+        assert food["sum"] == pytest.approx(sum(cost["sum"] for cost in all_food))
+
+    def test_history_invalid_category_returns_400(self):
+        """Should reject a category that does not exist"""
+        response = client.request("costs", "GET", "/api/costs",
+                                  params={"id": EXISTING_USER_ID, "category": "toys"})
+        assert response.status_code == 400
+        assert "message" in response.json()
 
 
 # ===========================================
@@ -446,24 +573,137 @@ class TestLogsService:
 
     def test_logs_returns_200(self):
         """Should return HTTP 200 status"""
-        response = requests.get(f"{LOGS_URL}/api/logs")
+        response = client.request("logs", "GET", "/api/logs")
         assert response.status_code == 200
 
     def test_logs_returns_array(self):
         """Should return an array"""
-        response = requests.get(f"{LOGS_URL}/api/logs")
-        data = response.json()
+        data = client.list_logs()
         assert isinstance(data, list)
 
     def test_logs_contains_entries(self):
         """Should contain log entries after API requests"""
         # Make a request to generate a log
-        requests.get(f"{ADMIN_URL}/api/about")
+        client.about()
 
-        response = requests.get(f"{LOGS_URL}/api/logs")
-        data = response.json()
+        data = client.list_logs()
         assert len(data) > 0
 
+    def test_logs_filtered_page(self):
+        """Should return only matching logs, at most limit of them"""
+        client.about()
+
+        data = client.list_logs(method="GET", url="/api/about", limit=5)
+        assert len(data) <= 5
+        for log in data:
+            assert log["method"] == "GET"
+            assert log["url"].startswith("/api/about")
+
+    def test_logs_stream_matches_filter(self):
+        """Should stream only the logs of the requested service"""
+        client.about()
+
+        for log in client.stream_logs(service="admin-service"):
+            assert log["name"] == "admin-service"
+
+    def test_logs_invalid_time_returns_400(self):
+        """Should reject an invalid time range"""
+        with pytest.raises(ServiceError) as error:
+            client.list_logs(since="not-a-date")
+        assert error.value.status_code == 400
+        assert error.value.id is not None
+        assert error.value.message
+
+    def test_logs_tail_replays_missed_logs(self):
+        """Should send the logs inserted after Last-Event-ID first on the live tail"""
+        tail = client.tail_logs()
+        try:
+            # the logs are saved in batches, the tail is open before this one is
+            client.about()
+            first = next(tail)
+        finally:
+            tail.close()
+        client.about()
+        tail = client.tail_logs(last_event_id=tail.last_event_id)
+        try:
+            log = next(tail)
+        finally:
+            tail.close()
+        assert log["_id"] != first["_id"]
+
+    def test_logs_tail_unknown_token_yields_gap(self):
+        """Should yield a LogGap when Last-Event-ID is not in the oplog"""
+        token = "82" + "00" * 40
+        tail = client.tail_logs(last_event_id=token)
+        try:
+            gap = next(tail)
+        finally:
+            tail.close()
+        assert isinstance(gap, LogGap)
+        assert gap.after == token
+
+    def test_logs_with_archive(self):
+        """Should also accept queries that include the archived logs"""
+        data = client.list_logs(archive=True, method="GET", limit=5)
+        assert len(data) <= 5
+        for log in data:
+            assert log["method"] == "GET"
+
+    def test_request_id_returned(self):
+        """Should send back the X-Request-Id of the request, or a new one"""
+        response = client.request("admin", "GET", "/api/about",
+                                  headers={"X-Request-Id": "test-request-id"})
+        assert response.headers["X-Request-Id"] == "test-request-id"
+        assert client.request("admin", "GET", "/api/about").headers["X-Request-Id"]
+
+    def test_trace_spans_across_services(self):
+        """Should return the requests of one trace from every service with their spans"""
+        with client.trace() as request_id:
+            client.get_user(EXISTING_USER_ID)
+            client.get_report(EXISTING_USER_ID, CURRENT_YEAR, CURRENT_MONTH)
+
+        # the logs are saved in batches, at least once a second
+        trace = None
+        for _ in range(10):
+            try:
+                trace = client.get_trace(request_id)
+                if len(trace["requests"]) >= 2:
+                    break
+            except ServiceError:
+                pass
+            time.sleep(0.5)
+
+        assert trace is not None
+        services = {request["service"] for request in trace["requests"]}
+        assert {"users-service", "costs-service"} <= services
+        for request in trace["requests"]:
+            assert request["duration_ms"] >= 0
+            assert any(span["type"] == "mongo" for span in request["spans"])
+
+    def test_trace_includes_batched_calls(self):
+        """Should send the request id of trace() from the threads of the batch helpers"""
+        with client.trace() as request_id:
+            client.get_users([EXISTING_USER_ID, EXISTING_USER_ID])
+
+        trace = None
+        for _ in range(10):
+            try:
+                trace = client.get_trace(request_id)
+                if len(trace["requests"]) >= 2:
+                    break
+            except ServiceError:
+                pass
+            time.sleep(0.5)
+
+        assert trace is not None
+        assert len(trace["requests"]) >= 2
+
+    def test_trace_not_found(self):
+        """Should return 404 for an unknown request id"""
+        with pytest.raises(ServiceError) as error:
+            client.get_trace("no-such-request-id")
+        assert error.value.status_code == 404
+
 
 # ===========================================
 # Integration Tests
@@ -475,53 +715,39 @@ class TestIntegration:
         """Should complete full user-cost-report flow"""
         integration_user_id = 555666
 
-        # Step 1: Create a new user
-        user_response = requests.post(f"{USERS_URL}/api/add", json={
-            "id": integration_user_id,
-            "first_name": "Integration",
-            "last_name": "Test",
-            "birthday": "1988-08-08"
-        })
-        assert user_response.status_code in [201, 500]
+        # Step 1: Create a new user (fails with 500 if it already exists)
+        try:
+            client.add_user(integration_user_id, "Integration", "Test", "1988-08-08")
+            created = True
+        except ServiceError as error:
+            assert error.status_code == 500
+            created = False
 
         # Step 2: Add cost items for the user
-        cost_response = requests.post(f"{COSTS_URL}/api/add", json={
-            "description": "Integration test meal",
-            "category": "food",
-            "userid": integration_user_id,
-            "sum": 35
-        })
-        if user_response.status_code == 201:
-            assert cost_response.status_code == 201
+        try:
+            client.add_cost("Integration test meal", "food", integration_user_id, 35)
+        except ServiceError:
+            if created:
+                raise
 
         # Step 3: Get user details with total
-        user_details_response = requests.get(f"{USERS_URL}/api/users/{integration_user_id}")
-        if user_response.status_code == 201:
-            assert user_details_response.status_code == 200
-            assert user_details_response.json()["total"] >= 35
+        if created:
+            assert client.get_user(integration_user_id)["total"] >= 35
 
         # Step 4: Get monthly report
-        report_response = requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": integration_user_id, "year": CURRENT_YEAR, "month": CURRENT_MONTH}
-        )
-        assert report_response.status_code == 200
+        report = client.get_report(integration_user_id, CURRENT_YEAR, CURRENT_MONTH)
+        assert report["userid"] == integration_user_id
 
     def test_logs_created_for_operations(self):
         """Should verify logs are created for all operations"""
         # Perform various operations
-        requests.get(f"{ADMIN_URL}/api/about")
-        requests.get(f"{USERS_URL}/api/users")
-        requests.get(f"{USERS_URL}/api/users/{EXISTING_USER_ID}")
-        requests.get(
-            f"{COSTS_URL}/api/report",
-            params={"id": EXISTING_USER_ID, "year": 2026, "month": 1}
-        )
+        client.about()
+        client.list_users()
+        client.get_user(EXISTING_USER_ID)
+        client.get_report(EXISTING_USER_ID, 2026, 1)
 
         # Check logs
-        logs_response = requests.get(f"{LOGS_URL}/api/logs")
-        assert logs_response.status_code == 200
-        assert len(logs_response.json()) > 0
+        assert len(client.list_logs()) > 0
 
 
 # ===========================================
@@ -532,43 +758,27 @@ class TestValidation:
 
     def test_user_invalid_id_type(self):
         """Should reject user with invalid id type"""
-        response = requests.post(f"{USERS_URL}/api/add", json={
-            "id": "not-a-number",
-            "first_name": "Invalid",
-            "last_name": "User",
-            "birthday": "2000-01-01"
-        })
-        assert response.status_code == 500
+        with pytest.raises(ServiceError) as error:
+            client.add_user("not-a-number", "Invalid", "User", "2000-01-01")
+        assert error.value.status_code == 500
 
     def test_user_empty_first_name(self):
         """Should reject user with empty first_name"""
-        response = requests.post(f"{USERS_URL}/api/add", json={
-            "id": 444555666,
-            "first_name": "",
-            "last_name": "User",
-            "birthday": "2000-01-01"
-        })
-        assert response.status_code == 500
+        with pytest.raises(ServiceError) as error:
+            client.add_user(444555666, "", "User", "2000-01-01")
+        assert error.value.status_code == 500
 
     def test_cost_negative_sum(self):
         """Should reject cost with negative sum"""
-        response = requests.post(f"{COSTS_URL}/api/add", json={
-            "description": "Negative sum test",
-            "category": "food",
-            "userid": EXISTING_USER_ID,
-            "sum": -10
-        })
-        assert response.status_code == 500
+        with pytest.raises(ServiceError) as error:
+            client.add_cost("Negative sum test", "food", EXISTING_USER_ID, -10)
+        assert error.value.status_code == 500
 
     def test_cost_empty_description(self):
         """Should reject cost with empty description"""
-        response = requests.post(f"{COSTS_URL}/api/add", json={
-            "description": "",
-            "category": "food",
-            "userid": EXISTING_USER_ID,
-            "sum": 10
-        })
-        assert response.status_code == 500
+        with pytest.raises(ServiceError) as error:
+            client.add_cost("", "food", EXISTING_USER_ID, 10)
+        assert error.value.status_code == 500
 
 
 # ===========================================
@@ -579,31 +789,49 @@ class TestErrorFormat:
 
     def test_user_not_found_error_format(self):
         """Should return error with id and message for user not found"""
-        response = requests.get(f"{USERS_URL}/api/users/999999999")
-        data = response.json()
-        assert "id" in data
-        assert "message" in data
-        assert data["id"] == 999999999
+        with pytest.raises(ServiceError) as error:
+            client.get_user(999999999)
+        assert error.value.message
+        assert error.value.id == 999999999
 
     def test_cost_invalid_user_error_format(self):
         """Should return error with id and message for cost with invalid user"""
-        response = requests.post(f"{COSTS_URL}/api/add", json={
-            "description": "Error test",
-            "category": "food",
-            "userid": 888777666,
-            "sum": 10
-        })
-        data = response.json()
-        assert "id" in data
-        assert "message" in data
+        with pytest.raises(ServiceError) as error:
+            client.add_cost("Error test", "food", 888777666, 10)
+        assert error.value.id is not None
+        assert error.value.message
 
     def test_report_missing_params_error_format(self):
         """Should return error with id and message for missing report params"""
-        response = requests.get(f"{COSTS_URL}/api/report")
+        response = client.request("costs", "GET", "/api/report")
         data = response.json()
         assert "id" in data
         assert "message" in data
 
 
+
+# ===========================================
+# Metrics Tests
+# ===========================================
+class TestMetrics:
+    """GET /metrics Tests"""
+
+    @pytest.mark.parametrize("service", ["users", "costs", "admin", "logs"])
+    def test_metrics_prometheus_format(self, service):
+        """Should return the metrics of every service as Prometheus text"""
+        response = client.request(service, "GET", "/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "# TYPE http_request_duration_seconds histogram" in response.text
+        assert "nodejs_eventloop_lag_seconds" in response.text
+
+    def test_metrics_count_report_requests(self):
+        """Should count report requests by route and time the mongo commands"""
+        client.get_report(EXISTING_USER_ID, 2025, 1)
+        text = client.request("costs", "GET", "/metrics").text
+        assert 'route="/api/report"' in text
+        assert "mongodb_command_duration_seconds_count" in text
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])